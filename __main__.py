@@ -9,16 +9,15 @@
 import argparse
 import logging
 import os
-from typing import List
-
-from PyQt5 import QtWidgets
+from typing import List, Optional, Tuple
 
 from __version__ import __version__, __author__, __description__
-from gui.backup_tool_dialog import BackupTool
-from gui.colors import Colors
-from gui.icons import render_svg, APP_ICON
-from gui.main_window import MainWindow
-from gui.series_tool_dialog import SeriesTool
+from cli import add_arguments, run_cli, run_benchmark
+from distributed import parse_address, run_worker
+from inplace import recover_edits
+from placement import recover_swaps
+from utils import find_ffmpeg, find_ffprobe
+from watch import add_watch_arguments, run_watch
 
 
 def setup_logging(args):
@@ -57,7 +56,16 @@ def setup_logging(args):
     handler.setFormatter(logging.Formatter(get_format_string(not args.colorless, args.log == "debug")))
     logging.getLogger().addHandler(handler)
 
-def run_gui(backup_tool: bool, series_tool: bool, start_files: List[str]) -> int:
+def run_gui(backup_tool: bool, series_tool: bool, start_files: List[str],
+            serve: Optional[Tuple[str, int]], scratch: Optional[Tuple[str, Optional[float]]]) -> int:
+    # Workers may run on headless machines without PyQt
+    from PyQt5 import QtWidgets
+    from gui.backup_tool_dialog import BackupTool
+    from gui.colors import Colors
+    from gui.icons import render_svg, APP_ICON
+    from gui.main_window import MainWindow
+    from gui.series_tool_dialog import SeriesTool
+
     app = QtWidgets.QApplication([])
     Colors.set_dark_mode(app.palette().window().color().value() <
                          app.palette().windowText().color().value())
@@ -68,11 +76,30 @@ def run_gui(backup_tool: bool, series_tool: bool, start_files: List[str]) -> int
     elif series_tool:
         gui = SeriesTool(start_files)
     else:
-        gui = MainWindow(start_files)
+        gui = MainWindow(start_files, serve, scratch)
 
     gui.show()
     return app.exec_()
 
+def run_worker_mode(address: Tuple[str, int], name: Optional[str], path_map: Optional[str]) -> int:
+    ffmpeg = find_ffmpeg()
+    ffprobe = find_ffprobe()
+    if ffmpeg.is_err() or ffprobe.is_err():
+        logging.error('Unable to find ffmpeg/ffprobe. Make sure they are installed and in PATH')
+        return 1
+
+    if path_map is not None:
+        path_map = tuple(path_map.split('=', 1))
+        if len(path_map) != 2:
+            logging.error('Path map must be REMOTE=LOCAL')
+            return 1
+
+    res = run_worker(ffmpeg.unwrap(), ffprobe.unwrap(), address, name, path_map)
+    if res.is_err():
+        logging.error('Worker stopped: %s', res.unwrap_err())
+        return 1
+    return 0
+
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter, prog=os.path.basename(__file__))
     parser.description = __description__
@@ -84,6 +111,16 @@ def main():
     group = parser.add_mutually_exclusive_group()
     group.add_argument("--backup-tool", action="store_true", help="Run backup tool without Main Window")
     group.add_argument("--series-tool", action="store_true", help="Run series tool without Main Window")
+    group.add_argument("--serve", type=str, metavar="[HOST:]PORT",
+                       help="Process files on remote workers instead of this machine.\n"
+                            "No authentication: serve on trusted networks only")
+    group.add_argument("--worker", type=str, metavar="HOST[:PORT]",
+                       help="Run as a worker of a coordinator (see --serve), without GUI")
+    parser.add_argument("--worker-name", type=str, help="Name of this worker shown by the coordinator")
+    parser.add_argument("--path-map", type=str, metavar="REMOTE=LOCAL",
+                        help="Path prefix of the coordinator's files and where they are mounted on this worker")
+    add_arguments(parser)
+    add_watch_arguments(parser)
     parser.add_argument("input", help="Path to the input files", nargs="*", action="append", default=[])
     args = parser.parse_args()
 
@@ -94,8 +131,26 @@ def main():
     setup_logging(args)
 
     logging.info("Trimmer. Version: %s", __version__)
+    recover_swaps()
+    recover_edits()
+
+    if args.benchmark:
+        return run_benchmark(args)
+
+    if args.watch:
+        return run_watch(args)
+
+    if args.no_gui:
+        return run_cli(args)
+
+    if args.worker is not None:
+        return run_worker_mode(parse_address(args.worker), args.worker_name, args.path_map)
 
-    return run_gui(args.backup_tool, args.series_tool, args.input)
+    serve = parse_address(args.serve) if args.serve is not None else None
+    scratch = (args.scratch, args.scratch_budget) if args.scratch is not None else None
+    if serve is not None and scratch is not None:
+        logging.warning('--scratch is not used with --serve: files are staged by the workers, if at all')
+    return run_gui(args.backup_tool, args.series_tool, args.input, serve, scratch)
 
 if __name__ == '__main__':
     exit(main())
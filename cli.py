@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+#
+# @file cli.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Batch mode without GUI (--no-gui), e.g. for cron on encode servers.
+# Same pipeline as the GUI: summary parse of every file, full parse
+# of the files that need track filtering, then the scheduler.
+# Must not import PyQt, directly or through other modules.
+#
+# Files that are outputs of trimmer already are skipped, so running it
+# again over the same library only costs a (cached) probe per file.
+#
+
+import argparse
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from result import Result, Ok, Err
+
+from codec import Codec, KNOWN_CODECS, prefer_hevc_codec
+from container import Container, SUPPORTED_CONTAINERS
+from ffmpeg import get_supported_hevc_codecs, get_ffprobe_version
+from journal import get_journal
+from placement import backups_summary
+from probe.cache import ProbeCache
+from probe.pool import ProbePool
+from probe.quarantine import get_quarantine
+from progress import ProgressAggregator, OverallProgress
+from scheduler import Scheduler, SlotConfig, CPU_SLOT, HW_SLOT, COPY_SLOT
+from selection import collect_files, filter_tracks
+from staging import StagingArea
+from track import AudioTrack, VideoTrack, SubtitleTrack
+from tuning import tune_presets
+from utils import find_ffmpeg, find_ffprobe, get_gpu_name, pretty_duration
+
+logger = logging.getLogger(__name__)
+
+# Terminal is redrawn this often, same as the GUI
+PROGRESS_INTERVAL = 0.1
+# Without a terminal (cron, log files) progress is logged this often
+LOG_PROGRESS_INTERVAL = 60
+
+TRACK_FILTERS = [
+    ('audio', AudioTrack),
+    ('video', VideoTrack),
+    ('subtitles', SubtitleTrack),
+]
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('batch mode (--no-gui)')
+    group.add_argument("--no-gui", action="store_true",
+                       help="Process the input files and directories without GUI")
+    group.add_argument("-r", "--recursive", action="store_true", help="Look for files in subdirectories too")
+    group.add_argument("--stdin", action="store_true", help="Read more input paths from stdin, one per line")
+    for name, _ in TRACK_FILTERS:
+        group.add_argument(f"--keep-{name}", type=str, action="append", metavar="FILTER[,FILTER...]",
+                           help=f"Keep only {name} tracks with matching language, title or codec ('*' - all)")
+        group.add_argument(f"--drop-{name}", type=str, action="append", metavar="FILTER[,FILTER...]",
+                           help=f"Drop {name} tracks with matching language, title or codec")
+    group.add_argument("--codec", type=str, choices=[codec.name for codec in KNOWN_CODECS],
+                       help="HEVC encoder. Detected by the GPU if not set")
+    group.add_argument("--preset", type=str, help="Encoder preset")
+    group.add_argument("--tune", type=str, help="Encoder tune")
+    group.add_argument("--profile", type=str, help="Encoder profile")
+    group.add_argument("--container", type=str, choices=[container.ext for container in SUPPORTED_CONTAINERS],
+                       help="Output container. Same as the input if not set")
+    default = SlotConfig.default()
+    group.add_argument("--cpu-slots", type=int, default=default.count(CPU_SLOT), help="Parallel software encodes")
+    group.add_argument("--hw-slots", type=int, default=default.count(HW_SLOT), help="Parallel hardware encodes")
+    group.add_argument("--copy-slots", type=int, default=default.count(COPY_SLOT), help="Parallel stream copies")
+    group.add_argument("--chunks", type=int, default=0, help="Segments per software encode (0 - off)")
+    group.add_argument("--scratch", type=str, metavar="DIR",
+                       help="Local directory to copy files on network shares to while they are processed")
+    group.add_argument("--scratch-budget", type=float, metavar="GB",
+                       help="Scratch space staged files may take. Free space of --scratch if not set")
+    group.add_argument("--force", action="store_true", help="Process files that were processed by trimmer already")
+    group.add_argument("--retry-quarantined", action="store_true",
+                       help="Probe again the files quarantined after a crashed or hung probe")
+    group.add_argument("--resume-batch", action="store_true",
+                       help="Continue the last interrupted batch instead of processing the input")
+    group.add_argument("--benchmark", action="store_true",
+                       help="Benchmark the presets of the codec (see --codec) and make the fastest\n"
+                            "one that compresses well the default on this machine")
+
+
+def choose_codec(ffmpeg: str, name: Optional[str]) -> Result[Codec, str]:
+    codecs = get_supported_hevc_codecs(ffmpeg)
+    if codecs.is_err():
+        return Err(codecs.unwrap_err())
+    codecs = codecs.unwrap()
+
+    if name is not None:
+        codec = next((codec for codec in codecs if codec.name == name), None)
+        if codec is None:
+            return Err(f'ffmpeg does not support {name}')
+        return Ok(codec)
+
+    # Headless servers may have no lspci and no GPU at all
+    try:
+        gpu_name = get_gpu_name().unwrap_or('')
+    except OSError as e:
+        logger.warning('Unable to get GPU name: %s', e)
+        gpu_name = ''
+    return prefer_hevc_codec(codecs, gpu_name)
+
+
+def split_filters(values: Optional[List[str]]) -> List[str]:
+    # --keep-audio eng,jpn --keep-audio ger -> ['eng', 'jpn', 'ger']
+    return [f.strip() for value in values or [] for f in value.split(',') if f.strip()]
+
+
+def track_filters(args) -> List[Tuple[List[str], List[str], type]]:
+    # (keep, drop, track type) for every track type
+    return [(split_filters(getattr(args, f'keep_{name}')), split_filters(getattr(args, f'drop_{name}')), t)
+            for name, t in TRACK_FILTERS]
+
+
+def apply_filters(containers: List[Container], filters: List[Tuple[List[str], List[str], type]]):
+    # Containers must be fully parsed
+    for keep, drop, t in filters:
+        if keep:
+            filter_tracks(containers, keep, False, t)
+        if drop:
+            filter_tracks(containers, drop, True, t)
+
+
+def input_paths(args) -> List[str]:
+    paths = list(args.input)
+    if args.stdin:
+        paths += [line.strip() for line in sys.stdin if line.strip()]
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += collect_files(path, args.recursive)
+        else:
+            files.append(path)
+    # Same file given twice (e.g. a directory and a file in it) is processed once
+    return list(dict.fromkeys(os.path.abspath(file) for file in files))
+
+
+def apply_options(container: Container, args) -> Result[None, str]:
+    codec = container.codec
+    for option, values in (('preset', codec.presets), ('tune', codec.tunes), ('profile', codec.profiles)):
+        value = getattr(args, option)
+        if value is None:
+            continue
+        if value not in values:
+            return Err(f'Unknown {option} {value} of {codec.name}. Known: {", ".join(values)}')
+        setattr(container, option, value)
+
+    if args.container is not None:
+        container.container = next(c for c in SUPPORTED_CONTAINERS if c.ext == args.container)
+    return Ok(None)
+
+
+def release_quarantined(files: List[str]):
+    # Explicit retry is the only way out of the quarantine, as in the GUI
+    if (quarantine := get_quarantine()) is None:
+        return
+    for file in files:
+        if quarantine.reason(file) is not None:
+            quarantine.release(file)
+
+
+def open_files(ffprobe: str, codec: Codec, cache: Optional[ProbeCache], args) -> Tuple[List[Container], int]:
+    # Returns the containers to process and the number of failed files
+    files = input_paths(args)
+    logger.info('Opening %d files', len(files))
+    if args.retry_quarantined:
+        release_quarantined(files)
+
+    opened = {}
+    failed = 0
+    def on_result(file: str, res: Result[Container, str]):
+        nonlocal failed
+        if res.is_err():
+            logger.error('Unable to open %s: %s', file, res.unwrap_err())
+            failed += 1
+        else:
+            opened[file] = res.unwrap()
+    ProbePool(ffprobe, codec, cache).open(files, on_result)
+
+    containers = []
+    skipped = 0
+    for file in files:
+        if (container := opened.get(file)) is None:
+            continue
+        if container.processed_by is not None and not args.force:
+            logger.debug('Skipping %s, processed by trimmer %s', file, container.processed_by)
+            skipped += 1
+            continue
+        containers.append(container)
+    if skipped != 0:
+        logger.info('Skipped %d files processed by trimmer already (see --force)', skipped)
+
+    filters = track_filters(args)
+    if any(keep or drop for keep, drop, _ in filters):
+        # Tracks of the summary parse may be incomplete
+        def on_complete(container: Container, res: Result[Container, str]):
+            nonlocal failed
+            if res.is_err():
+                logger.error('Unable to parse %s: %s', container.file, res.unwrap_err())
+                containers.remove(container)
+                failed += 1
+        ProbePool(ffprobe, codec, cache).complete(list(containers), on_complete)
+        apply_filters(containers, filters)
+
+    return containers, failed
+
+
+def resume_files(ffprobe: str, cache: Optional[ProbeCache], batch: int) -> Tuple[List[Container], List[int], int]:
+    journal = get_journal()
+    jobs = journal.unfinished_jobs(batch)
+    # Results come in completion order, jobs are resumed in theirs
+    results = {}
+    ProbePool(ffprobe, None, cache).restore([settings for _, settings, _ in jobs],
+                                            lambda settings, res: results.__setitem__(id(settings), res))
+
+    containers, positions, failed = [], [], 0
+    for position, settings, attempts in jobs:
+        res = results[id(settings)]
+        if res.is_err():
+            logger.error('Unable to resume %s (%d attempts): %s', settings['file'], attempts, res.unwrap_err())
+            journal.set_status(batch, position, 'error')
+            failed += 1
+            continue
+        containers.append(res.unwrap())
+        positions.append(position)
+    return containers, positions, failed
+
+
+def staging_area(ffmpeg: str, ffprobe: str, cache: Optional[ProbeCache], args) -> Optional[StagingArea]:
+    # None - files are processed where they are
+    return open_staging(ffmpeg, ffprobe, cache, args.scratch, args.scratch_budget)
+
+
+def open_staging(ffmpeg: str, ffprobe: str, cache: Optional[ProbeCache],
+                 scratch: Optional[str], budget_gb: Optional[float]) -> Optional[StagingArea]:
+    # Same as staging_area(), also for the GUI. One per Scheduler.run(), which closes it
+    if scratch is None:
+        return None
+    budget = int(budget_gb * 1024 ** 3) if budget_gb is not None else None
+    try:
+        return StagingArea(ffmpeg, ffprobe, cache, scratch, budget)
+    except OSError as e:
+        logger.warning('Scratch %s is not usable, processing files in place: %s', scratch, e)
+        return None
+
+
+def process(ffmpeg: str, ffprobe: str, cache: Optional[ProbeCache], slots: SlotConfig,
+            containers: List[Container], batch: Optional[int], positions: List[int],
+            staging: Optional[StagingArea] = None) -> int:
+    # Returns the number of failed files
+    journal = get_journal()
+    aggregator = ProgressAggregator()
+    overall = OverallProgress(len(containers))
+    # (index, status) from the slot threads, applied by the main thread
+    statuses = queue.SimpleQueue()
+    failed = 0
+    backups = Counter()  # Backup strategy -> files
+
+    def on_status(index: int, status: str, backup: Optional[str]):
+        if batch is not None:
+            journal.set_status(batch, positions[index], status)
+        if backup is not None:
+            backups[backup] += 1
+        statuses.put((index, status))
+
+    def on_error(message: str):
+        nonlocal failed
+        failed += 1
+        logger.error(message)
+
+    scheduler = Scheduler(ffmpeg, ffprobe, cache, slots, staging)
+    thread = threading.Thread(target=scheduler.run, name='scheduler',
+                              args=(containers, on_status, lambda index, slot: None, aggregator.update, on_error))
+    start_time = time.time()
+    thread.start()
+
+    working = {}  # index -> percent
+    done = 0
+    def update() -> str:
+        nonlocal done
+        while True:
+            try:
+                index, status = statuses.get_nowait()
+            except queue.Empty:
+                break
+            if status == 'working':
+                working[index] = 0
+            elif status in ('done', 'error'):
+                working.pop(index, None)
+                overall.set(index, 100)
+                done += 1
+                logger.info('[%d/%d] %s: %s', done, len(containers), status, containers[index].file)
+
+        for index, sample in aggregator.take().items():
+            if index in working:
+                container = containers[index]
+                working[index] = sample.percent(container.duration_seconds, container.duration_frames)
+                overall.set(index, working[index])
+
+        return (f'{done}/{len(containers)} files, {overall.percent:.2f}%, '
+                f'{len(working)} running, {pretty_duration(time.time() - start_time)} elapsed')
+
+    if sys.stderr.isatty():
+        from alive_progress import alive_bar
+        with alive_bar(manual=True, title='Processing') as bar:
+            while thread.is_alive():
+                thread.join(PROGRESS_INTERVAL)
+                bar.text(update())
+                bar(overall.percent / 100)
+            bar.text(update())
+            bar(1.0)
+    else:
+        last_log = time.time()
+        while thread.is_alive():
+            thread.join(PROGRESS_INTERVAL)
+            text = update()
+            if time.time() - last_log >= LOG_PROGRESS_INTERVAL:
+                logger.info('Progress: %s', text)
+                last_log = time.time()
+        update()
+
+    if batch is not None:
+        journal.finish_batch(batch)
+    logger.info('Processed %d files in %s, %d failed', len(containers), pretty_duration(time.time() - start_time), failed)
+    if len(backups) != 0:
+        logger.info('Backups: %s', backups_summary(backups))
+    return failed
+
+
+def setup(args) -> Result[Tuple[str, str, Optional[ProbeCache], SlotConfig], str]:
+    # ffmpeg, ffprobe, probe cache and slots, common for the batch and watch modes
+    ffmpeg = find_ffmpeg()
+    ffprobe = find_ffprobe()
+    if ffmpeg.is_err() or ffprobe.is_err():
+        return Err('Unable to find ffmpeg/ffprobe. Make sure they are installed and in PATH')
+    ffmpeg, ffprobe = ffmpeg.unwrap(), ffprobe.unwrap()
+
+    cache = None
+    if (ffprobe_version := get_ffprobe_version(ffprobe)).is_err():
+        logger.warning('Probe cache disabled: %s', ffprobe_version.unwrap_err())
+    else:
+        try:
+            cache = ProbeCache(ffprobe_version.unwrap())
+        except Exception as e:
+            logger.warning('Probe cache disabled: %s', e)
+
+    slots = SlotConfig(max(1, args.cpu_slots), max(1, args.hw_slots), max(1, args.copy_slots), max(0, args.chunks))
+    return Ok((ffmpeg, ffprobe, cache, slots))
+
+
+def run_benchmark(args) -> int:
+    ffmpeg = find_ffmpeg()
+    if ffmpeg.is_err():
+        logger.error('Unable to find ffmpeg. Make sure it is installed and in PATH')
+        return 2
+    ffmpeg = ffmpeg.unwrap()
+
+    codec = choose_codec(ffmpeg, args.codec)
+    if codec.is_err():
+        logger.error('No suitable HEVC codec: %s', codec.unwrap_err())
+        return 2
+
+    if (res := tune_presets(ffmpeg, codec.unwrap())).is_err():
+        logger.error('Benchmark failed: %s', res.unwrap_err())
+        return 1
+    return 0
+
+
+def run_cli(args) -> int:
+    # 0 - every file was processed, 1 - some failed, 2 - nothing could be done
+    if (res := setup(args)).is_err():
+        logger.error('%s', res.unwrap_err())
+        return 2
+    ffmpeg, ffprobe, cache, slots = res.unwrap()
+    journal = get_journal()
+
+    if args.resume_batch:
+        if journal is None or (batch := journal.unfinished_batch()) is None:
+            logger.error('No interrupted batch to resume')
+            return 2
+        containers, positions, failed = resume_files(ffprobe, cache, batch)
+        logger.info('Resuming batch %d: %d files left', batch, len(containers))
+    else:
+        codec = choose_codec(ffmpeg, args.codec)
+        if codec.is_err():
+            logger.error('No suitable HEVC codec: %s', codec.unwrap_err())
+            return 2
+        codec = codec.unwrap()
+        logger.info('Codec: %s', codec.name)
+
+        containers, failed = open_files(ffprobe, codec, cache, args)
+        for container in containers:
+            if (res := apply_options(container, args)).is_err():
+                logger.error('%s', res.unwrap_err())
+                return 2
+
+        batch = journal.start_batch(containers) if journal is not None and len(containers) != 0 else None
+        positions = list(range(len(containers)))
+
+    if len(containers) == 0:
+        logger.info('Nothing to process')
+        if batch is not None:
+            journal.finish_batch(batch)
+        return 1 if failed != 0 else 0
+
+    staging = staging_area(ffmpeg, ffprobe, cache, args)
+    failed += process(ffmpeg, ffprobe, cache, slots, containers, batch, positions, staging)
+    return 1 if failed != 0 else 0
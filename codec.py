@@ -6,17 +6,16 @@
 # @author Maxim Kurylko <vk_vm@ukr.net>
 #
 
-from typing import List
+from typing import List, Optional
 from result import Result, Ok, Err
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-# TODO: Maybe get this from ffmpeg?
-# Actually there's ffmpeg -h encoder=<...> that can be used to get the
-# list of presets, tunes and profiles. But in some reason, libx265 doesn't
-# show them all.
+# The tables below are completed by what ffmpeg -h encoder=<...> lists
+# (see encoders.py). libx265 takes its presets, tunes and profiles as free
+# strings and does not list them, so the tables are what it gets.
 class Codec:
     def __init__(self, name: str,
                  presets: List[str],
@@ -24,7 +23,9 @@ class Codec:
                  tunes: List[str],
                  preferred_tune: str,
                  profiles: List[str],
-                 preferred_profile: str):
+                 preferred_profile: str,
+                 pix_fmts: Optional[List[str]] = None,
+                 threading: Optional[str] = None):
         self.__name = name
         self.__presets = presets
         self.__preferred_preset = preferred_preset
@@ -32,6 +33,9 @@ class Codec:
         self.__preferred_tune = preferred_tune
         self.__profiles = profiles
         self.__preferred_profile = preferred_profile
+        # Unknown unless the encoder was asked
+        self.__pix_fmts = pix_fmts or []
+        self.__threading = threading
 
     @property
     def name(self) -> str:
@@ -61,6 +65,14 @@ class Codec:
     def preferred_profile(self) -> str:
         return self.__preferred_profile
 
+    @property
+    def pix_fmts(self) -> List[str]:
+        return self.__pix_fmts
+
+    @property
+    def threading(self) -> Optional[str]:
+        return self.__threading
+
     def __str__(self):
         return f'Codec({self.name})'
 
@@ -171,15 +183,19 @@ KNOWN_CODECS = [
     HEVC_VIDEOTOOLBOX_CODEC,
 ]
 
-def prefer_hevc_codec(codecs: List[str], gpu_name: str) -> Result[Codec, str]:
-    if 'nvidia' in gpu_name.lower() and HEVC_NVENC_CODEC in codecs:
-        logger.info("Preferred HEVC codec: %s", HEVC_NVENC_CODEC)
-        return Ok(HEVC_NVENC_CODEC)
+def prefer_hevc_codec(codecs: List[Codec], gpu_name: str) -> Result[Codec, str]:
+    # Codecs are the ones ffmpeg reported, so they are matched by name
+    def find(name: str) -> Optional[Codec]:
+        return next((codec for codec in codecs if codec.name == name), None)
+
+    if 'nvidia' in gpu_name.lower() and (codec := find(HEVC_NVENC_CODEC.name)) is not None:
+        logger.info("Preferred HEVC codec: %s", codec)
+        return Ok(codec)
 
     # On Apple Silicon, libx265 seems to faster than hevc_videotoolbox
     # So prefer libx265
-    if LIBX265_CODEC in codecs:
-        logger.info("Preferred HEVC codec: %s", LIBX265_CODEC)
-        return Ok(LIBX265_CODEC)
+    if (codec := find(LIBX265_CODEC.name)) is not None:
+        logger.info("Preferred HEVC codec: %s", codec)
+        return Ok(codec)
 
     return Err("Cannot find supported HEVC codec")
@@ -9,16 +9,24 @@
 import platform
 import time
 from result import Result, Err, Ok
-from ffmpeg import VideoTrack, get_video_tracks, FFMpegRemuxer, Codec, \
-    get_container_metadata
+from codec import KNOWN_CODECS
+from ffmpeg import VideoTrack, FFMpegRemuxer, Codec, tracks_from_probe, \
+    metadata_from_probe, ProgressSample
 import logging
 import os
-import shutil
 from typing import Callable, Any, List, Optional
 from __version__ import __version__
 
+from probe import backend
+from inplace import can_edit_in_place, edit_in_place
+from journal import get_journal
+from placement import check_free_space, place_output, CHUNKED_SPACE_FACTOR, RESUME_SPACE_FACTOR
+from probe.cache import ProbeCache
+from resume import can_resume, encode_resumed, save_resume_info, remove_resume_info
+from segments import can_chunk, encode_chunked
 from track import Track
-from utils import unique_bak_name, pretty_date
+from tuning import default_preset
+from utils import pretty_date
 
 logger = logging.getLogger(__name__)
 
@@ -111,17 +119,20 @@ class Container:
         self.__file = file
 
         self.__codec = codec
-        self.__preset = codec.preferred_preset
+        self.__preset = default_preset(codec)
         self.__tune = codec.preferred_tune
         self.__profile = codec.preferred_profile
 
-        # Will be set by parse()
+        # Will be set by parse_summary() or parse()
         self.__tracks = []
         self.__container = None
         self.__duration_frames = None
         self.__duration_seconds = None
         self.__fps = None
         self.__metadata = None
+        self.__complete = False  # Tracks and metadata come from a full probe
+        self.__identity = None  # (size, mtime_ns) at the moment of probing
+        self.__processed_by = None  # Signature of trimmer that wrote the file
 
     @property
     def file(self) -> str:
@@ -134,7 +145,7 @@ class Container:
     @codec.setter
     def codec(self, codec: Codec):
         self.__codec = codec
-        self.__preset = codec.preferred_preset
+        self.__preset = default_preset(codec)
         self.__tune = codec.preferred_tune
         self.__profile = codec.preferred_profile
 
@@ -198,22 +209,46 @@ class Container:
     def metadata(self) -> dict:
         return self.__metadata
 
-    def parse(self, ffprobe: str) -> Result[Any, str]:
-        self.__container = self.__get_container_type(self.file)
-        if self.__container.is_err():
-            return Err(f"Unsupported container")
-        self.__container = self.__container.unwrap()
+    @property
+    def complete(self) -> bool:
+        return self.__complete
+
+    @property
+    def processed_by(self) -> Optional[str]:
+        # Set if the file is an output of trimmer: the tag in Matroska and
+        # MP4/MOV, the journal's record of outputs for the rest
+        return self.__processed_by
+
+    @staticmethod
+    def __get_identity(file: str) -> Optional[tuple]:
+        try:
+            st = os.stat(file)
+        except OSError as e:
+            logger.warning('Unable to stat %s: %s', file, e)
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def is_stale(self) -> bool:
+        # File was modified (or removed) since it was probed
+        return self.__identity is None or self.__identity != self.__get_identity(self.file)
 
-        self.__metadata = get_container_metadata(ffprobe, self.file)
+    def __load(self, data: dict, complete: bool, title: Optional[str] = None) -> Result[Any, str]:
+
+        self.__metadata = metadata_from_probe(data)
         if self.__metadata.is_err():
             logging.warning(f"Unable to get container metadata: {self.__metadata.unwrap_err()}")
             self.__metadata = {}
         else:
             self.__metadata = self.__metadata.unwrap()
+        self.__processed_by = self.__metadata.get('TRIMMER_VERSION', None)
+        if self.__processed_by is None and self.__identity is not None and (journal := get_journal()) is not None:
+            self.__processed_by = journal.output_signature(self.file, *self.__identity)
+        if title is not None:
+            self.__metadata['title'] = title  # Edited by the user before the full parse
         self.__metadata['TRIMMER_VERSION'] = self.__get_signature()
         logger.debug('Metadata: %s', self.__metadata)
 
-        self.__tracks = get_video_tracks(ffprobe, self.file)
+        self.__tracks = tracks_from_probe(data, self.file)
         if self.__tracks.is_err():
             return Err(f"Unable to get list of tracks: {self.__tracks.unwrap_err()}")
         self.__tracks = self.__tracks.unwrap()
@@ -222,14 +257,131 @@ class Container:
         self.__estimate_duration()
         logger.debug('Duration in frames: %s', self.duration_frames)
 
+        self.__complete = complete
         return Ok(None)
 
-    def remux(self, ffmpeg: str, on_progress: Callable[[int, float], None]) -> Result[Any, str]:
-        logger.debug('Processing file: %s', self.file)
+    def __prepare(self) -> Result[Any, str]:
+        container = self.__get_container_type(self.file)
+        if container.is_err():
+            return Err(f"Unsupported container")
+        # Keep the container chosen by the user when parsing again
+        if self.__container is None:
+            self.__container = container.unwrap()
 
-        outfile = self.file + '.trimmed.' + self.container.ext
-        logger.debug('Output file: %s', outfile)
+        # Stat before probing, so a file modified while it is probed
+        # is seen as stale afterwards
+        self.__identity = self.__get_identity(self.file)
+        return Ok(None)
+
+    def parse_summary(self, ffprobe: str, cache: Optional[ProbeCache] = None) -> Result[Any, str]:
+        # Cheap parse that is enough for the files table. Track details
+        # (frame rates, channels, exact durations) may be incomplete until parse()
+        if (res := self.__prepare()).is_err():
+            return res
+
+        if cache is not None:
+            data = cache.summary(ffprobe, self.file)
+        else:
+            data = backend.summary(ffprobe, self.file)
+        if data.is_err():
+            return Err(f"Unable to probe file: {data.unwrap_err()}")
+        data, complete = data.unwrap()
+
+        return self.__load(data, complete)
 
+    def parse(self, ffprobe: str, cache: Optional[ProbeCache] = None,
+              title: Optional[str] = None) -> Result[Any, str]:
+        if (res := self.__prepare()).is_err():
+            return res
+
+        if cache is not None:
+            data = cache.probe(ffprobe, self.file)
+        else:
+            data = backend.probe(ffprobe, self.file)
+        if data.is_err():
+            return Err(f"Unable to probe file: {data.unwrap_err()}")
+
+        return self.__load(data.unwrap(), True, title)
+
+    def ensure_parsed(self, ffprobe: str, cache: Optional[ProbeCache] = None) -> Result[Any, str]:
+        # Full parse on demand. Edits of tracks are lost if the file
+        # was changed on disk, since its tracks may be different now
+        if self.__complete and not self.is_stale():
+            return Ok(None)
+
+        title = None
+        if self.is_stale():
+            logger.warning('File %s was changed since it was opened, parsing again', self.file)
+        elif self.__metadata is not None:
+            title = self.title
+
+        logger.debug('Full parse of %s', self.file)
+        return self.parse(ffprobe, cache, title)
+
+    # Files that changed size or were touched since then are not the ones
+    # the edits were made for. Network filesystems round mtime differently
+    IDENTITY_MTIME_TOLERANCE_NS = 2_000_000_000
+
+    def to_dict(self) -> dict:
+        # Only the file and the user's edits are stored,
+        # tracks are probed again by from_dict()
+        return {
+            'file': self.file,
+            'identity': list(self.__identity) if self.__identity is not None else None,
+            'codec': self.codec.name,
+            'preset': self.preset,
+            'tune': self.tune,
+            'profile': self.profile,
+            'container': self.container.ext,
+            'metadata': dict(self.metadata),
+            'tracks': [{
+                'index': track.index,
+                'keep': track.keep,
+                'language': track.language,
+                'title': track.title,
+            } for track in self.tracks],
+        }
+
+    @staticmethod
+    def from_dict(data: dict, ffprobe: str, cache: Optional[ProbeCache] = None,
+                  file: Optional[str] = None) -> Result['Container', str]:
+        # file overrides the stored path, e.g. the same share mounted elsewhere
+        file = file or data['file']
+        codec = next((codec for codec in KNOWN_CODECS if codec.name == data['codec']), None)
+        if codec is None:
+            return Err(f'Unknown codec: {data["codec"]}')
+
+        container = Container(file, codec)
+        container.preset = data['preset']
+        container.tune = data['tune']
+        container.profile = data['profile']
+        container.container = next((c for c in SUPPORTED_CONTAINERS if c.ext == data['container']), None)
+        if container.container is None:
+            return Err(f'Unsupported container: {data["container"]}')
+
+        if (res := container.parse(ffprobe, cache)).is_err():
+            return Err(res.unwrap_err())
+
+        if data['identity'] is not None:
+            size, mtime_ns = data['identity']
+            if container.__identity is None or container.__identity[0] != size or \
+                    abs(container.__identity[1] - mtime_ns) > Container.IDENTITY_MTIME_TOLERANCE_NS:
+                return Err(f'File {file} was changed since it was queued')
+
+        container.__metadata = dict(data['metadata'])
+        container.__metadata['TRIMMER_VERSION'] = Container.__get_signature()
+        tracks = {track.index: track for track in container.tracks}
+        for edit in data['tracks']:
+            track = tracks.get(edit['index'])
+            if track is None:
+                return Err(f'File {file} has no track {edit["index"]}')
+            track.keep = edit['keep']
+            track.language = edit['language']
+            track.title = edit['title']
+
+        return Ok(container)
+
+    def __remux_single(self, ffmpeg: str, outfile: str, on_progress: Callable[[ProgressSample], None]) -> Result[Any, str]:
         ffmpeg = FFMpegRemuxer(ffmpeg, self.file)
         ffmpeg.set_format_metadata(self.metadata)
         ffmpeg.audio_as_is()
@@ -245,26 +397,102 @@ class Container:
             if track.keep:
                 ffmpeg.keep_track(track)
 
-        if (res := ffmpeg.process(outfile, on_progress)).is_err():
+        return ffmpeg.process(outfile, on_progress)
+
+    def remux(self, ffmpeg: str, on_progress: Callable[[ProgressSample], None], chunks: int = 0,
+              ffprobe: Optional[str] = None) -> Result[str, str]:
+        # chunks > 1 encodes the video as that many segments in parallel.
+        # With ffprobe, an encode interrupted by a crash or reboot is resumed.
+        # Returns the backup strategy of the original
+        logger.debug('Processing file: %s', self.file)
+
+        if can_edit_in_place(self):
+            # Nothing to encode or drop, only metadata changes
+            if (res := edit_in_place(self)).is_ok():
+                logger.info('File %s edited in place', self.file)
+                return res
+            logger.warning('Unable to edit %s in place, remuxing: %s', self.file, res.unwrap_err())
+
+        outfile = self.output_file()
+        if (res := self.encode(ffmpeg, outfile, on_progress, chunks, ffprobe)).is_err():
+            return res
+        return self.place(outfile)
+
+    def output_file(self, attempt: Optional[str] = None) -> str:
+        # Written next to the file, replaces it when complete.
+        # attempt separates outputs of several workers, see distributed.py
+        if attempt is not None:
+            return f'{self.file}.trimmed.{attempt}.{self.container.ext}'
+        return self.file + '.trimmed.' + self.container.ext
+
+    def encode(self, ffmpeg: str, outfile: str, on_progress: Callable[[ProgressSample], None], chunks: int = 0,
+               ffprobe: Optional[str] = None) -> Result[Any, str]:
+        # First step of remux(): writes outfile, removes it on failure
+        logger.debug('Output file: %s', outfile)
+
+        # Outputs are rarely larger than the original
+        try:
+            size = os.path.getsize(self.file)
+        except OSError as e:
+            return Err(f'Unable to get size of {self.file}: {e}')
+
+        res = None
+        if ffprobe is not None and can_resume(self, outfile):
+            if (space := check_free_space(outfile, size * RESUME_SPACE_FACTOR)).is_err():
+                logger.warning('Unable to resume %s, encoding from the start: %s', self.file, space.unwrap_err())
+            else:
+                logger.info('Found partial output %s, resuming', outfile)
+                res = encode_resumed(ffmpeg, ffprobe, self, outfile, on_progress)
+                if res.is_err():
+                    logger.warning('Unable to resume %s, encoding from the start: %s', self.file, res.unwrap_err())
+                    res = None
+
+        chunked = res is None and can_chunk(self, chunks)
+        if chunked and (space := check_free_space(outfile, size * CHUNKED_SPACE_FACTOR)).is_err():
+            logger.warning('Encoding %s in one piece: %s', self.file, space.unwrap_err())
+            chunked = False
+
+        if chunked:
+            logger.info('Encoding %s in %d chunks', self.file, chunks)
+            res = encode_chunked(ffmpeg, self, outfile, chunks, on_progress)
+        elif res is None:
+            if (space := check_free_space(outfile, size)).is_err():
+                return Err(space.unwrap_err())
+            save_resume_info(self, outfile)
+            res = self.__remux_single(ffmpeg, outfile, on_progress)
+
+        if res.is_err():
             logger.error('Failed to process file %s', self.file)
             try:
                 os.remove(outfile)
             except Exception as _:
                 pass
+            remove_resume_info(outfile)
 
             return Err(f'Remuxer failed: {res.unwrap_err()}')
+        remove_resume_info(outfile)
 
         logger.info('File %s processed successfully', self.file)
-
-        # Backup original file
-        bak = unique_bak_name(self.file)
-        logger.info('Copy %s -> %s', self.file, bak)
-        shutil.move(self.file, bak)
-
-        # Replace original file with the trimmed one
-        noext = os.path.splitext(self.file)[0]
-        destfile = f'{noext}.{self.container.ext}'
-        logger.info('Move %s -> %s', outfile, destfile)
-        shutil.move(outfile, destfile)
         return Ok(None)
 
+    def place(self, outfile: str) -> Result[str, str]:
+        # Second step of remux(): backs up the file and replaces it with outfile.
+        # Returns the backup strategy, see placement.py
+        destfile = self.output_destination()
+        if (res := place_output(self.file, outfile, destfile)).is_err():
+            return Err(f'Output {outfile} was not placed: {res.unwrap_err()}')
+        self.record_output()
+        _, strategy = res.unwrap()
+        return Ok(strategy)
+
+    def output_destination(self) -> str:
+        # Where place() puts the output
+        return f'{os.path.splitext(self.file)[0]}.{self.container.ext}'
+
+    def record_output(self):
+        # Remembers the placed output as processed, see processed_by
+        destfile = self.output_destination()
+        if (journal := get_journal()) is None or (identity := self.__get_identity(destfile)) is None:
+            return
+        journal.add_output(destfile, *identity, self.metadata['TRIMMER_VERSION'])
+
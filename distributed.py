@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+
+#
+# @file distributed.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Distributed encoding on several machines that see the same files
+# (e.g. a NAS). The coordinator owns the queue, workers connect to it
+# over TCP, pull one job at a time and encode it locally.
+#
+# Protocol: one JSON object per line.
+#   worker -> coordinator: hello, request, heartbeat, progress, commit, result
+#   coordinator -> worker: job, idle (nothing to do now, ask again), commit, done
+# A job whose worker disconnects or stops sending heartbeats goes back
+# to the queue. The lost worker may still be running (e.g. a network
+# partition), so every assignment has its own token: outputs are written
+# under it, and the original is replaced only if the coordinator confirms
+# (commit) that the token is still the job's current one. Workers stop
+# encoding as soon as they lose the coordinator.
+# There is no authentication: workers overwrite whatever files the
+# coordinator names, so serve on trusted networks only.
+#
+
+import ipaddress
+import json
+import logging
+import os
+import platform
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, List, Optional, Tuple, Any
+
+from result import Result, Ok, Err
+
+from container import Container
+from ffmpeg import ProgressSample
+from inplace import can_edit_in_place, edit_in_place
+from probe.cache import ProbeCache
+from resume import remove_resume_info
+from scheduler import classify, CPU_SLOT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 47800
+
+HEARTBEAT_INTERVAL = 5
+# Worker is considered lost after that many seconds without a message
+HEARTBEAT_TIMEOUT = 30
+# Worker asks again after that many seconds when there is nothing to do
+IDLE_INTERVAL = 5
+# Job that lost that many workers is probably killing them
+MAX_ATTEMPTS = 3
+
+MAX_MESSAGE_LENGTH = 16 * 1024 * 1024
+
+
+def parse_address(address: str, default_host: str = DEFAULT_HOST) -> Tuple[str, int]:
+    # 'host:port', 'host' or 'port'
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        if address.isdigit():
+            return default_host, int(address)
+        return address, DEFAULT_PORT
+    return host or default_host, int(port)
+
+
+class Connection:
+    # JSON lines over a socket. Sends may come from several threads
+    # (worker heartbeats and progress), receives from one
+    def __init__(self, sock: socket.socket):
+        self.__sock = sock
+        self.__reader = sock.makefile('rb')
+        self.__lock = threading.Lock()
+
+    def send(self, message: dict):
+        data = json.dumps(message).encode('utf-8') + b'\n'
+        with self.__lock:
+            self.__sock.sendall(data)
+
+    def receive(self) -> Optional[dict]:
+        # None when the other side has closed the connection
+        line = self.__reader.readline(MAX_MESSAGE_LENGTH)
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.__sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.__reader.close()
+        self.__sock.close()
+
+
+class Job:
+    def __init__(self, index: int, container: Container, chunks: int):
+        self.index = index
+        self.container = container
+        self.chunks = chunks
+        self.attempts = 0
+        self.token = ''  # Of the current assignment
+        self.connection: Optional[Connection] = None  # Worker it is assigned to
+        self.worker = ''
+        self.last_seen = 0.0
+
+    def __str__(self):
+        return f'Job({self.index}, {self.container.file}, attempts={self.attempts}, worker={self.worker})'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class Coordinator:
+    # Same interface as Scheduler, but the jobs run on the workers.
+    # Slot callback gets the name of the worker
+    def __init__(self, ffprobe: str, cache: Optional[ProbeCache], address: Tuple[str, int], chunks: int = 0):
+        self.__ffprobe = ffprobe
+        self.__cache = cache
+        self.__address = address
+        self.__chunks = chunks
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.__address
+
+    def run(self, files: List[Container],
+            on_status: Callable[[int, str, Optional[str]], None],
+            on_slot: Callable[[int, str], None],
+            on_progress: Callable[[int, ProgressSample], None],
+            on_error: Callable[[str], None]):
+        # Blocks until every job is done
+        lock = threading.Condition()
+        pending = deque()
+        assigned: List[Job] = []
+        remaining = 0
+
+        for index, container in enumerate(files):
+            # Workers get the user's edits, so tracks must be known here
+            if (res := container.ensure_parsed(self.__ffprobe, self.__cache)).is_err():
+                on_status(index, 'error', None)
+                on_error(f'Failed to parse file {container.file}: {res.unwrap_err()}')
+                continue
+            chunks = self.__chunks if classify(container) == CPU_SLOT else 0
+            pending.append(Job(index, container, chunks))
+            remaining += 1
+
+        def finish(job: Job, status: str, error: Optional[str] = None, backup: Optional[str] = None):
+            nonlocal remaining
+            # Under the lock
+            job.connection = None
+            assigned.remove(job)
+            remaining -= 1
+            lock.notify_all()
+            on_status(job.index, status, backup)
+            if error is not None:
+                on_error(f'Failed to process file {job.container.file}: {error}')
+
+        def requeue(job: Job, reason: str):
+            # Under the lock
+            logger.warning('Worker %s lost job %s: %s', job.worker, job.container.file, reason)
+            if job.attempts >= MAX_ATTEMPTS:
+                finish(job, 'error', f'{reason}. Gave up after {job.attempts} attempts')
+                return
+            job.connection = None
+            assigned.remove(job)
+            pending.appendleft(job)
+            on_slot(job.index, '')
+            on_status(job.index, 'pending', None)
+
+        def serve(connection: Connection, address: Tuple[str, int]):
+            name = f'{address[0]}:{address[1]}'
+            job: Optional[Job] = None
+            try:
+                while (message := connection.receive()) is not None:
+                    kind = message.get('type')
+                    with lock:
+                        if job is not None and job.connection is not connection:
+                            job = None  # Was given to another worker meanwhile
+                        if job is not None:
+                            job.last_seen = time.monotonic()
+
+                        if kind == 'hello':
+                            name = f'{message.get("name") or address[0]} ({address[0]})'
+                            logger.info('Worker %s connected', name)
+                        elif kind == 'request':
+                            if len(pending) != 0:
+                                job = pending.popleft()
+                                job.attempts += 1
+                                job.token = uuid.uuid4().hex[:12]
+                                job.connection = connection
+                                job.worker = name
+                                job.last_seen = time.monotonic()
+                                assigned.append(job)
+                                logger.info('Job %s -> %s', job.container.file, name)
+                                connection.send({'type': 'job', 'id': job.index, 'token': job.token,
+                                                 'chunks': job.chunks, 'container': job.container.to_dict()})
+                                on_slot(job.index, name)
+                                on_status(job.index, 'working', None)
+                            elif remaining == 0:
+                                connection.send({'type': 'done'})
+                            else:
+                                # Jobs of other workers may still come back
+                                connection.send({'type': 'idle'})
+                        elif kind == 'progress':
+                            if job is not None and job.index == message.get('id'):
+                                on_progress(job.index, ProgressSample.from_dict(message['sample']))
+                        elif kind == 'commit':
+                            # Only the current assignment may replace the original
+                            ok = job is not None and job.index == message.get('id') and \
+                                job.token == message.get('token')
+                            if not ok:
+                                logger.warning('Worker %s was late with job %s', name, message.get('id'))
+                            connection.send({'type': 'commit', 'id': message.get('id'), 'ok': ok})
+                        elif kind == 'result':
+                            if job is not None and job.index == message.get('id'):
+                                if message.get('ok'):
+                                    # The worker's journal is on another machine
+                                    job.container.record_output()
+                                    finish(job, 'done', backup=message.get('backup'))
+                                else:
+                                    finish(job, 'error', message.get('error', 'unknown error'))
+                                job = None
+                        elif kind != 'heartbeat':
+                            logger.warning('Unknown message from %s: %s', name, kind)
+            except (OSError, ValueError) as e:
+                logger.warning('Connection to worker %s failed: %s', name, e)
+            finally:
+                connection.close()
+                with lock:
+                    if job is not None and job.connection is connection:
+                        requeue(job, 'worker disconnected')
+                logger.info('Worker %s disconnected', name)
+
+        host, port = self.__address
+        try:
+            is_loopback = ipaddress.ip_address(host).is_loopback
+        except ValueError:
+            is_loopback = host == 'localhost'
+        if not is_loopback:
+            logger.warning('Serving jobs on %s:%d. Anyone who can connect can get the files processed', host, port)
+
+        server = socket.create_server((host, port))
+        # Closing the socket does not wake up accept() everywhere
+        server.settimeout(1)
+        closing = threading.Event()
+        connections: List[Connection] = []
+
+        def accept():
+            while not closing.is_set():
+                try:
+                    sock, address = server.accept()
+                except socket.timeout:
+                    continue
+                except OSError as e:
+                    logger.error('Unable to accept workers: %s', e)
+                    return
+                sock.settimeout(None)
+                connection = Connection(sock)
+                with lock:
+                    connections.append(connection)
+                threading.Thread(target=serve, args=(connection, address),
+                                 name=f'coordinator-{address[0]}:{address[1]}', daemon=True).start()
+
+        logger.info('Coordinating %d jobs on %s:%d', remaining, host, port)
+        accept_thread = threading.Thread(target=accept, name='coordinator-accept', daemon=True)
+        accept_thread.start()
+        try:
+            with lock:
+                while remaining > 0:
+                    lock.wait(1)
+                    now = time.monotonic()
+                    for job in list(assigned):
+                        if now - job.last_seen > HEARTBEAT_TIMEOUT:
+                            # Closing makes the worker's serve() thread exit
+                            job.connection.close()
+                            requeue(job, f'no heartbeat for {HEARTBEAT_TIMEOUT} s')
+        finally:
+            closing.set()
+            accept_thread.join()
+            server.close()
+            # Idle workers get 'done' on their next request, give them the time
+            time.sleep(IDLE_INTERVAL + 1)
+            with lock:
+                for connection in connections:
+                    connection.close()
+
+        logger.info('All files processed')
+
+
+def run_worker(ffmpeg: str, ffprobe: str, address: Tuple[str, int],
+               name: Optional[str] = None, path_map: Optional[Tuple[str, str]] = None) -> Result[Any, str]:
+    # Processes jobs until the coordinator has no more of them.
+    # path_map replaces the coordinator's path prefix with the local one
+    name = name or platform.node()
+    try:
+        connection = Connection(socket.create_connection(address))
+    except OSError as e:
+        return Err(f'Unable to connect to {address[0]}:{address[1]}: {e}')
+    logger.info('Connected to %s:%d as %s', *address, name)
+
+    stop = threading.Event()
+    lost = threading.Event()
+    def heartbeat():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                connection.send({'type': 'heartbeat'})
+            except OSError as e:
+                logger.error('Coordinator is lost: %s', e)
+                lost.set()
+                return
+    threading.Thread(target=heartbeat, name='worker-heartbeat', daemon=True).start()
+
+    def discard(outfile: str):
+        try:
+            os.remove(outfile)
+        except OSError:
+            pass
+        remove_resume_info(outfile)
+
+    try:
+        connection.send({'type': 'hello', 'name': name})
+        while True:
+            connection.send({'type': 'request'})
+            message = connection.receive()
+            if message is None:
+                return Err('Coordinator closed the connection')
+            kind = message.get('type')
+            if kind == 'done':
+                logger.info('No more jobs')
+                return Ok(None)
+            if kind == 'idle':
+                time.sleep(IDLE_INTERVAL)
+                continue
+            if kind != 'job':
+                return Err(f'Unexpected message from the coordinator: {kind}')
+
+            job_id = message['id']
+            token = message.get('token', '')
+            data = message['container']
+            file = data['file']
+            if path_map is not None and file.startswith(path_map[0]):
+                file = path_map[1] + file[len(path_map[0]):]
+            logger.info('Job %d: %s', job_id, file)
+
+            def on_progress(sample: ProgressSample):
+                # Raising kills ffmpeg and aborts the job, the coordinator
+                # gives it to someone else anyway
+                if lost.is_set():
+                    raise ConnectionError('Coordinator is lost')
+                connection.send({'type': 'progress', 'id': job_id, 'sample': sample.to_dict()})
+
+            res = Container.from_dict(data, ffprobe, file=file)
+            encode = res.is_ok()
+            if encode and can_edit_in_place(container := res.unwrap()):
+                # Same edit whichever worker does it
+                if (res := edit_in_place(container)).is_ok():
+                    encode = False
+                else:
+                    logger.warning('Unable to edit %s in place, remuxing: %s', file, res.unwrap_err())
+            if encode:
+                # Output of this assignment only, never resumed by another one
+                outfile = container.output_file(token)
+                try:
+                    res = container.encode(ffmpeg, outfile, on_progress, message.get('chunks', 0), ffprobe)
+                except BaseException:
+                    discard(outfile)
+                    raise
+                if res.is_ok():
+                    connection.send({'type': 'commit', 'id': job_id, 'token': token})
+                    reply = connection.receive()
+                    if reply is not None and reply.get('type') == 'commit' and reply.get('ok'):
+                        res = container.place(outfile)
+                    else:
+                        discard(outfile)
+                        res = Err('The job was given to another worker')
+            if res.is_err():
+                logger.error('Job %d failed: %s', job_id, res.unwrap_err())
+                connection.send({'type': 'result', 'id': job_id, 'ok': False, 'error': res.unwrap_err()})
+            else:
+                connection.send({'type': 'result', 'id': job_id, 'ok': True, 'backup': res.unwrap()})
+    except (OSError, ValueError) as e:
+        return Err(f'Connection to the coordinator failed: {e}')
+    finally:
+        stop.set()
+        connection.close()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+#
+# @file encoders.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Encoder capabilities as the ffmpeg binary reports them: the encoders
+# it was built with (ffmpeg -encoders) and their presets, tunes, profiles,
+# pixel formats and threading (ffmpeg -h encoder=<name>). Builds differ,
+# e.g. newer NVENC has tunes older ones do not, so the codec tables are
+# completed with what the binary supports. Results are cached by the path,
+# size and mtime of the binary, so only a new ffmpeg is asked again.
+#
+
+import functools
+import json
+import logging
+import os
+import re
+import threading
+from typing import Optional, List, Dict, Set
+
+from result import Result, Ok, Err
+
+from codec import Codec
+from utils import run, get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+#  V....D libx265              libx265 H.265 / HEVC (codec hevc)
+ENCODER_LINE_RE = re.compile(r'^\s*[VAS][F.][S.][X.][B.][D.]\s+(?P<name>\S+)\s')
+#   Supported pixel formats: yuv420p nv12 p010le
+CAPABILITY_RE = re.compile(r'^\s+(?P<name>[A-Za-z ]+):\s*(?P<value>.*)$')
+#   -preset            <int>        E..V....... Set the encoding preset (from 0 to 18) (default p4)
+OPTION_RE = re.compile(r'^  -(?P<name>\S+)\s+<(?P<type>[^>]+)>\s+[E.][D.][F.][V.][A.][S.]\S*\s*(?P<help>.*)$')
+#      slow            1            E..V....... hq 2 passes
+CONSTANT_RE = re.compile(r'^\s{4,}(?P<name>[^-\s]\S*)\s+(?:\S+\s+)?[E.][D.][F.][V.][A.][S.]\S*')
+DEFAULT_RE = re.compile(r'\(default (?P<value>[^)]*)\)')
+
+
+def parse_encoders(output: str) -> Set[str]:
+    # Exact names. The legend before the '------' line is skipped
+    names = set()
+    started = False
+    for line in output.splitlines():
+        if not started:
+            started = line.strip().startswith('---')
+            continue
+        if (m := ENCODER_LINE_RE.match(line)) is not None:
+            names.add(m.group('name'))
+    return names
+
+
+def parse_encoder_help(output: str) -> dict:
+    # {'pix_fmts': [...], 'threading': ..., 'options': {name: {'default': ..., 'values': [...]}}}
+    data = {'pix_fmts': [], 'threading': None, 'options': {}}
+    option = None
+    for line in output.splitlines():
+        if (m := OPTION_RE.match(line)) is not None:
+            default = DEFAULT_RE.search(m.group('help'))
+            option = {'default': default.group('value').strip('"') if default is not None else None, 'values': []}
+            data['options'][m.group('name')] = option
+        elif option is not None and (m := CONSTANT_RE.match(line)) is not None:
+            option['values'].append(m.group('name'))
+        elif (m := CAPABILITY_RE.match(line)) is not None:
+            option = None
+            if m.group('name') == 'Supported pixel formats':
+                data['pix_fmts'] = m.group('value').split()
+            elif m.group('name') == 'Threading capabilities':
+                data['threading'] = m.group('value').strip()
+        else:
+            option = None
+    return data
+
+
+def probe_encoder(ffmpeg: str, name: str) -> Result[dict, str]:
+    code, result = run([ffmpeg, '-hide_banner', '-h', f'encoder={name}'])
+    if code != 0:
+        return Err(f'Failed to get options of {name}: {result.strip()}')
+    return Ok(parse_encoder_help(result))
+
+
+def complete_codec(codec: Codec, capabilities: dict) -> Codec:
+    # Values the encoder lists, in its order. Options it takes as free
+    # strings (libx265 presets, tunes and profiles) keep the table ones
+    def choose(option: str, values: List[str], preferred: str):
+        parsed = capabilities['options'].get(option)
+        if parsed is None or len(parsed['values']) == 0:
+            return values, preferred
+        if preferred not in parsed['values']:
+            preferred = parsed['default'] if parsed['default'] in parsed['values'] else parsed['values'][0]
+        return parsed['values'], preferred
+
+    presets, preset = choose('preset', codec.presets, codec.preferred_preset)
+    tunes, tune = choose('tune', codec.tunes, codec.preferred_tune)
+    profiles, profile = choose('profile', codec.profiles, codec.preferred_profile)
+    return Codec(codec.name, presets, preset, tunes, tune, profiles, profile,
+                 capabilities['pix_fmts'], capabilities['threading'])
+
+
+class EncoderCache:
+    SCHEMA_VERSION = 1
+    DEFAULT_FILE = 'encoders.json'
+
+    def __init__(self, path: Optional[str] = None):
+        # {ffmpeg path: {'schema': ..., 'size': ..., 'mtime_ns': ..., 'encoders': [...], 'capabilities': {...}}}
+        self.__path = path or os.path.join(get_cache_dir(), self.DEFAULT_FILE)
+        self.__lock = threading.Lock()
+        self.__data = {}
+        if os.path.exists(self.__path):
+            with open(self.__path, 'r', encoding='utf-8') as f:
+                self.__data = json.load(f)
+            if not isinstance(self.__data, dict):
+                raise ValueError(f'{self.__path} is not an encoder cache')
+
+    @staticmethod
+    def identity(ffmpeg: str) -> Optional[dict]:
+        try:
+            st = os.stat(ffmpeg)
+        except OSError:
+            return None
+        return {'schema': EncoderCache.SCHEMA_VERSION, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+    def get(self, ffmpeg: str) -> Optional[dict]:
+        identity = self.identity(ffmpeg)
+        with self.__lock:
+            entry = self.__data.get(os.path.abspath(ffmpeg))
+        if identity is None or not isinstance(entry, dict) or \
+                any(entry.get(key) != value for key, value in identity.items()):
+            return None
+        return entry
+
+    def put(self, ffmpeg: str, encoders: List[str], capabilities: Dict[str, dict]):
+        if (identity := self.identity(ffmpeg)) is None:
+            return
+        with self.__lock:
+            self.__data[os.path.abspath(ffmpeg)] = {**identity, 'encoders': encoders, 'capabilities': capabilities}
+            tmp = self.__path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.__data, f, indent=2)
+            os.replace(tmp, self.__path)
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoder_cache() -> Optional[EncoderCache]:
+    # Without it ffmpeg is asked on every start
+    try:
+        return EncoderCache()
+    except (OSError, ValueError) as e:
+        logger.warning('Encoder cache disabled: %s', e)
+        return None
+
+
+def get_encoder_capabilities(ffmpeg: str, names: List[str],
+                             cache: Optional[EncoderCache]) -> Result[Dict[str, dict], str]:
+    # Capabilities of the encoders out of names that ffmpeg has
+    if cache is not None and (entry := cache.get(ffmpeg)) is not None and \
+            all(name in entry['capabilities'] for name in names if name in entry['encoders']):
+        return Ok({name: entry['capabilities'][name] for name in names if name in entry['capabilities']})
+
+    code, result = run([ffmpeg, '-hide_banner', '-encoders'])
+    if code != 0:
+        return Err(f'Failed to get codecs: {result.strip()}')
+    encoders = parse_encoders(result)
+
+    capabilities = {}
+    complete = True
+    for name in names:
+        if name not in encoders:
+            continue
+        if (res := probe_encoder(ffmpeg, name)).is_err():
+            # Still usable with the table options, and asked again next time
+            logger.warning('%s', res.unwrap_err())
+            capabilities[name] = {'pix_fmts': [], 'threading': None, 'options': {}}
+            complete = False
+            continue
+        capabilities[name] = res.unwrap()
+        logger.debug('Capabilities of %s: %s', name, capabilities[name])
+
+    if cache is not None and complete:
+        try:
+            cache.put(ffmpeg, sorted(encoders), capabilities)
+        except OSError as e:
+            logger.warning('Unable to save encoder cache: %s', e)
+    return Ok(capabilities)
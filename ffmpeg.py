@@ -6,49 +6,136 @@
 # @author Maxim Kurylko <vk_vm@ukr.net>
 #
 
+import functools
 import json
+import os
 import platform
 import re
 import subprocess
 import logging
+import threading
+from collections import deque
 from codec import Codec, KNOWN_CODECS
-from typing import Optional, List, Callable, Any, Dict
+from typing import Optional, List, Callable, Any, Dict, Tuple
 from result import Result, Ok, Err
 import atexit
 
+from encoders import get_encoder_capabilities, get_encoder_cache, complete_codec
 from track import Track, VideoTrack, AudioTrack, SubtitleTrack
-from utils import run, pretty_errno
+from utils import run, pretty_errno, is_crash_code, is_network_path
 
 # 02:27:57.535000000
 FFMPEG_DURATION_RE = re.compile(r'(?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d+\.\d+)')
 # 24000/1001
 FFMPEG_FRAME_RATE_RE = re.compile(r'(?P<dividend>\d+)/(?P<divisor>\d+)')
+# Seconds, plus the time to read the probed data at the rates below.
+# Probes of a pool share the link, so the rates are pessimistic
+PROBE_TIMEOUT = 60
+LOCAL_PROBE_RATE = 10 * 1024 * 1024  # Bytes per second
+NETWORK_PROBE_RATE = 1024 * 1024
+DEFAULT_PROBESIZE = 5_000_000
 
 logger = logging.getLogger(__name__)
 
 def get_supported_hevc_codecs(ffmpeg: str) -> Result[List[Codec], str]:
-    args = [ffmpeg, '-hide_banner', '-encoders']
-
-    code, result = run(args)
-    if code != 0:
-        return Err(f'Failed to get codecs: {result.strip()}')
-
-    codecs = []
-    for line in result.split('\n'):
-        for codec in KNOWN_CODECS:
-            if codec.name in line:
-                codecs.append(codec)
-                break
+    res = get_encoder_capabilities(ffmpeg, [codec.name for codec in KNOWN_CODECS], get_encoder_cache())
+    if res.is_err():
+        return Err(res.unwrap_err())
+    capabilities = res.unwrap()
 
-    return Ok(codecs)
+    return Ok([complete_codec(codec, capabilities[codec.name])
+               for codec in KNOWN_CODECS if codec.name in capabilities])
 
-def get_container_metadata(ffprobe: str, file: str) -> Result[dict, str]:
-    args = [ffprobe, '-v', 'error', '-show_entries', 'format_tags', '-of', 'json', file]
-    code, result = run(args)
+@functools.lru_cache(maxsize=None)
+def get_ffprobe_version(ffprobe: str) -> Result[str, str]:
+    code, result = run([ffprobe, '-version'])
     if code != 0:
-        return Err(f'Failed to get metadata: {result.strip()}')
+        return Err(f'Failed to get ffprobe version: {result.strip()}')
+
+    # ffprobe version 7.1 Copyright (c) 2007-2024 the FFmpeg developers
+    return Ok(result.strip().split('\n')[0])
+
+class ProbeAborted(Exception):
+    # ffprobe hung or crashed on the file. Unlike ordinary probe errors,
+    # such files should not be probed again automatically
+    pass
+
+class ProbeTimeout(ProbeAborted):
+    # May be a slow share rather than a broken file
+    pass
+
+def probe_timeout(file: str, probesize: Optional[int]) -> float:
+    rate = NETWORK_PROBE_RATE if is_network_path(file) else LOCAL_PROBE_RATE
+    return PROBE_TIMEOUT + (probesize if probesize is not None else DEFAULT_PROBESIZE) / rate
+
+def run_ffprobe(args: List[str], timeout: float) -> Result[dict, str]:
+    try:
+        code, result = run(args, timeout)
+    except subprocess.TimeoutExpired:
+        raise ProbeTimeout(f'ffprobe timed out after {timeout:.0f} s')
+    if is_crash_code(code):
+        raise ProbeAborted(f'ffprobe crashed with code {code}')
+    if code != 0:
+        return Err(f'Failed to probe file: {result.strip()}')
 
-    data = json.loads(result)
+    try:
+        data = json.loads(result)
+    except json.JSONDecodeError as e:
+        return Err(f'Failed to parse ffprobe output: {e}')
+
+    return Ok(data)
+
+def probe_file(ffprobe: str, file: str,
+               probesize: Optional[int] = None,
+               analyzeduration: Optional[int] = None) -> Result[dict, str]:
+    # Single ffprobe call: every stream and the format section at once.
+    # Both tracks and container metadata are built from this document,
+    # so the file headers are read only once.
+    # Analysis limits are ffprobe defaults unless given, see probe.policy
+    args = [ffprobe, '-v', 'error']
+    if probesize is not None:
+        args += ['-probesize', str(probesize)]
+    if analyzeduration is not None:
+        args += ['-analyzeduration', str(analyzeduration)]
+    args += ['-show_streams', '-show_format', '-of', 'json', file]
+    return run_ffprobe(args, probe_timeout(file, probesize))
+
+def probe_file_summary(ffprobe: str, file: str) -> Result[dict, str]:
+    # Same document as probe_file(), but ffprobe stops after the headers:
+    # codecs, languages and titles are there, frame rates and channels may be not
+    args = [ffprobe, '-v', 'error',
+            '-probesize', '262144', '-analyzeduration', '0',
+            '-show_entries', 'format=duration:format_tags'
+                             ':stream=index,codec_type,codec_name,r_frame_rate,channels,duration'
+                             ':stream_tags:stream_disposition=attached_pic',
+            '-of', 'json', file]
+    return run_ffprobe(args, probe_timeout(file, 262144))
+
+def probe_video_packets(ffprobe: str, file: str) -> Result[List[Tuple[float, float, bool]], str]:
+    # (pts, duration, keyframe) in seconds of the first video stream, in
+    # decode order. Reads the whole file (demuxing only), so no timeout.
+    # Truncated files are fine, ffprobe stops at the broken tail
+    args = [ffprobe, '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,duration_time,flags', '-of', 'csv=p=0', file]
+    code, result = run(args)
+    if code != 0 and is_crash_code(code):
+        return Err(f'Failed to read packets: ffprobe crashed with code {code}')
+
+    packets = []
+    for line in result.splitlines():
+        fields = line.split(',')
+        if len(fields) != 3:
+            continue  # Error messages of the broken tail
+        pts, duration, flags = fields
+        try:
+            packets.append((float(pts), float(duration), 'K' in flags))
+        except ValueError:  # N/A
+            continue
+    if len(packets) == 0:
+        return Err(f'No video packets: {result.strip()[-1000:]}')
+    return Ok(packets)
+
+def metadata_from_probe(data: dict) -> Result[dict, str]:
     if 'format' not in data:
         return Err('No format in metadata')
 
@@ -57,6 +144,13 @@ def get_container_metadata(ffprobe: str, file: str) -> Result[dict, str]:
 
     return Ok(data['format']['tags'])
 
+def get_container_metadata(ffprobe: str, file: str) -> Result[dict, str]:
+    data = probe_file(ffprobe, file)
+    if data.is_err():
+        return Err(f'Failed to get metadata: {data.unwrap_err()}')
+
+    return metadata_from_probe(data.unwrap())
+
 def get_container_duration_seconds(ffprobe: str, file: str) -> Result[float, str]:
     args = [ffprobe, '-v', 'error', '-show_entries', 'format=duration',
          '-of', 'default=noprint_wrappers=1:nokey=1', file]
@@ -87,8 +181,8 @@ def get_container_duration_frames(ffprobe: str, file: str) -> Result[int, str]:
     logger.debug('Frame rate: %f, duration: %f', frame_rate, duration_sec.unwrap())
     return Ok(int(frame_rate * duration_sec.unwrap()))
 
-def get_video_tracks(ffprobe: str, file: str) -> Result[List['Track'], str]:
-    def duration_to_secs(duration: str) -> float:
+def tracks_from_probe(data: dict, file: str) -> Result[List['Track'], str]:
+    def duration_to_secs(duration: str, type: str) -> float:
         match = FFMPEG_DURATION_RE.match(duration)
         if match is None:
             logger.warning(
@@ -101,9 +195,9 @@ def get_video_tracks(ffprobe: str, file: str) -> Result[List['Track'], str]:
                 int(match.group('minutes')) * 60 + \
                 float(match.group('seconds'))
 
-    def frame_rate_to_float(frame_rate: str) -> float:
+    def frame_rate_to_float(frame_rate: str, type: str) -> float:
         match = FFMPEG_FRAME_RATE_RE.match(frame_rate)
-        if match is None:
+        if match is None or int(match.group('divisor')) == 0:
             logger.warning(
                 'Invalid frame rate: %s while processing %s (stream type %s)',
                 frame_rate, file, type)
@@ -111,114 +205,202 @@ def get_video_tracks(ffprobe: str, file: str) -> Result[List['Track'], str]:
 
         return int(match.group('dividend')) / int(match.group('divisor'))
 
-    def process_streams(
-            type: str,
-            add_tags: str,
-            add_entries: str,
-            parser: callable) -> Result[List[Track], str]:
-
-        args = [
-            ffprobe,
-            '-v', 'error',
-            '-select_streams', type,
-            '-show_entries', f'stream={add_entries},duration,index,codec_name:stream_tags=language,duration,title{add_tags}',
-            '-of', 'json',
-            file
-        ]
-        code, result = run(args)
-        if code != 0:
-            return Err(f'Failed to get {type} streams: {result.strip()}')
-
-        tracks = []
-        data = json.loads(result)
-        for stream in data['streams']:
-            index = stream['index']
-            codec = stream['codec_name']
-
-            def select_tag(tag: str) -> Optional[str]:
-                if 'tags' not in stream:
-                    logger.warning('No tags in stream %d while processing %s (stream type %s)', index, file, type)
-                    return None
-                if tag not in stream['tags']:
-                    logger.warning('No tag %s in stream %d while processing %s (stream type %s)', tag, index, file, type)
-                    return None
-                return stream['tags'][tag]
-            if (title := select_tag('title')) is None:
-                title = "default"
-            if (language := select_tag('language')) is None:
-                language = "und"
-            if (duration := select_tag('DURATION')) is None:
-                if 'duration' not in stream:
-                    logger.warning('No duration in stream %d while processing %s (stream type %s)', index, file, type)
-                    duration = 0
-                else:
-                    duration = float(stream['duration'])
+    # Same per-type builders as the old per-type ffprobe calls.
+    # Data streams ('d') and attachments were never part of the track list
+    parsers = {
+        'video': lambda index, codec, language, title, duration, stream: VideoTrack(
+            index, codec, language, title, duration,
+            frame_rate_to_float(stream.get('r_frame_rate', '0/0'), 'video')),
+        'audio': lambda index, codec, language, title, duration, stream: AudioTrack(
+            index, codec, language, title, duration,
+            stream.get('channels', 0)),
+        'subtitle': lambda index, codec, language, title, duration, _: SubtitleTrack(
+            index, codec, language, title, duration),
+    }
+
+    # Keep the old ordering: video, then audio, then subtitles
+    grouped = {type: [] for type in parsers}
+    for stream in data.get('streams', []):
+        type = stream.get('codec_type')
+        if type not in parsers:
+            continue
+
+        # Matches '-select_streams V': cover arts are not real video tracks
+        if type == 'video' and stream.get('disposition', {}).get('attached_pic', 0) == 1:
+            continue
+
+        index = stream['index']
+        codec = stream.get('codec_name', 'unknown')
+
+        def select_tag(tag: str) -> Optional[str]:
+            if 'tags' not in stream:
+                logger.warning('No tags in stream %d while processing %s (stream type %s)', index, file, type)
+                return None
+            if tag not in stream['tags']:
+                logger.warning('No tag %s in stream %d while processing %s (stream type %s)', tag, index, file, type)
+                return None
+            return stream['tags'][tag]
+        if (title := select_tag('title')) is None:
+            title = "default"
+        if (language := select_tag('language')) is None:
+            language = "und"
+        if (duration := select_tag('DURATION')) is None:
+            if 'duration' not in stream:
+                logger.warning('No duration in stream %d while processing %s (stream type %s)', index, file, type)
+                duration = 0
             else:
-                duration = duration_to_secs(duration)
-
-            tracks.append(parser(index, codec, language, title, duration, stream))
-
-        return Ok(tracks)
+                duration = float(stream['duration'])
+        else:
+            duration = duration_to_secs(duration, type)
 
-    tracks = []
-    # Process video
-    res = process_streams(
-            'V',
-            '',
-            'r_frame_rate,',
-            lambda index, codec, language, title, duration, data: VideoTrack(
-                index, codec, language, title, duration,
-                frame_rate_to_float(data['r_frame_rate'])))
-    if res.is_err():
-        return res
-    tracks.extend(res.unwrap())
-
-    # Process audio
-    res = process_streams(
-            'a',
-            '',
-            'channels,',
-            lambda index, codec, language, title, duration, data: AudioTrack(
-                index, codec, language, title, duration,
-                data['channels']))
-    if res.is_err():
-        return res
-    tracks.extend(res.unwrap())
-
-    # Process subtitles
-    res = process_streams(
-            's',
-            '',
-            '',
-            lambda index, codec, language, title, duration, _: SubtitleTrack(
-                index, codec, language, title, duration))
-    if res.is_err():
-        return res
-    tracks.extend(res.unwrap())
-
-    # Process attachments
-    res = process_streams(
-            'd',
-            '',
-            '',
-            lambda index, codec, language, title, duration, _: Track(
-                index, codec, language, title, duration))
-    if res.is_err():
-        return res
+        grouped[type].append(parsers[type](index, codec, language, title, duration, stream))
 
+    tracks = [track for type in parsers for track in grouped[type]]
     if len(tracks) == 0:
         return Err('No tracks found')
 
     return Ok(tracks)
 
+def get_video_tracks(ffprobe: str, file: str) -> Result[List['Track'], str]:
+    data = probe_file(ffprobe, file)
+    if data.is_err():
+        return Err(f'Failed to get streams: {data.unwrap_err()}')
+
+    return tracks_from_probe(data.unwrap(), file)
+
+class ProgressSample:
+    # One '-progress' block. Values ffmpeg reports as N/A stay at 0
+    __slots__ = ('frame', 'fps', 'out_time_us', 'speed', 'total_size',
+                 'bitrate', 'dup_frames', 'drop_frames', 'end')
+
+    def __init__(self):
+        self.frame = 0
+        self.fps = 0.0
+        self.out_time_us = 0
+        self.speed = 0.0  # Relative to realtime
+        self.total_size = 0  # Bytes written so far
+        self.bitrate = 0.0  # kbit/s
+        self.dup_frames = 0
+        self.drop_frames = 0
+        self.end = False  # progress=end, the last block
+
+    @property
+    def out_time_seconds(self) -> float:
+        return self.out_time_us / 1_000_000
+
+    def percent(self, duration_seconds: float, duration_frames: int = 0) -> float:
+        # Time based: frame counts are wrong for VFR video and
+        # stream copies. Frames are only a fallback
+        if self.end:
+            return 100
+        if duration_seconds and self.out_time_us > 0:
+            return min(self.out_time_seconds / duration_seconds * 100, 100)
+        if duration_frames and self.frame > 0:
+            return min(self.frame / duration_frames * 100, 100)
+        return 0
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @staticmethod
+    def from_dict(data: dict) -> 'ProgressSample':
+        sample = ProgressSample()
+        for name in ProgressSample.__slots__:
+            if name in data:
+                setattr(sample, name, data[name])
+        return sample
+
+    def __str__(self):
+        return (f'ProgressSample(frame={self.frame}, fps={self.fps}, out_time_us={self.out_time_us}, '
+                f'speed={self.speed}x, size={self.total_size}, bitrate={self.bitrate}kbit/s, '
+                f'dup={self.dup_frames}, drop={self.drop_frames}, end={self.end})')
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class ProgressParser:
+    # Parses 'key=value' lines of 'ffmpeg -progress' output. Runs for every
+    # line of every encode, so it works on raw bytes: no decoding, no regex,
+    # one sample object per block
+    __slots__ = ('sample',)
+
+    @staticmethod
+    def __number(value: bytes, suffix: bytes, convert: Callable):
+        if value.endswith(suffix):
+            value = value[:len(value) - len(suffix)]
+        try:
+            return convert(value)
+        except ValueError:  # N/A
+            return None
+
+    # key -> (attribute, unit suffix, converter)
+    FIELDS = {
+        b'frame': ('frame', b'', int),
+        b'fps': ('fps', b'', float),
+        b'out_time_us': ('out_time_us', b'', int),
+        b'speed': ('speed', b'x', float),
+        b'total_size': ('total_size', b'', int),
+        b'bitrate': ('bitrate', b'kbits/s', float),
+        b'dup_frames': ('dup_frames', b'', int),
+        b'drop_frames': ('drop_frames', b'', int),
+    }
+
+    def __init__(self):
+        self.sample = ProgressSample()
+
+    def feed(self, line: bytes) -> Optional[ProgressSample]:
+        # Returns the sample once its block is complete
+        key, sep, value = line.partition(b'=')
+        if not sep:
+            return None
+        value = value.strip()
+
+        if key == b'progress':
+            sample = self.sample
+            sample.end = value == b'end'
+            self.sample = ProgressSample()
+            return sample
+
+        if (field := self.FIELDS.get(key)) is not None:
+            attribute, suffix, convert = field
+            if (number := self.__number(value, suffix, convert)) is not None:
+                setattr(self.sample, attribute, number)
+        return None
+
+
 class FFMpegRemuxer:
-    # frame=2567
-    FFMPEG_PROCESSED_FRAMES_RE = re.compile(r'frame=(?P<frame>\d+)')
-    # fps=13.90
-    FFMPEG_FPS_RE = re.compile(r'fps=(?P<fps>\d+\.\d+)')
+    # Last stderr lines kept for the error message
+    STDERR_TAIL_LINES = 200
+    # Longer lines are split. Bounds memory on garbage without newlines
+    MAX_LINE_LENGTH = 64 * 1024
+    # Their muxer drops custom tags (TRIMMER_VERSION) unless asked to keep them
+    MOV_EXTENSIONS = ('.mp4', '.mov')
+
+    def __init__(self, ffmpeg: str, file: str, input_options: Optional[List[str]] = None):
+        self.args = [ffmpeg] + (input_options or []) + ['-i', file, '-y']
+        self.custom_tags = False
+
+    def add_input(self, file: str) -> 'FFMpegRemuxer':
+        # Next input, its streams are referred to as '1:...', '2:...'
+        self.args.extend(['-i', file])
+        return self
+
+    def map_stream(self, spec: str) -> 'FFMpegRemuxer':
+        self.args.extend(['-map', spec])
+        return self
 
-    def __init__(self, ffmpeg: str, file: str):
-        self.args = [ffmpeg, '-i', file, '-y']
+    def copy_all(self) -> 'FFMpegRemuxer':
+        self.args.extend(['-c', 'copy'])
+        return self
+
+    def set_stream_metadata(self, output_index: int, key: str, value: str) -> 'FFMpegRemuxer':
+        self.args.extend([f'-metadata:s:{output_index}', f'{key}={value}'])
+        return self
+
+    def output_options(self, options: List[str]) -> 'FFMpegRemuxer':
+        self.args.extend(options)
+        return self
 
     def audio_as_is(self) -> 'FFMpegRemuxer':
         self.args.extend(['-c:a', 'copy'])
@@ -246,9 +428,12 @@ class FFMpegRemuxer:
     def set_format_metadata(self, data: Dict[str, str]) -> 'FFMpegRemuxer':
         for key, value in data.items():
             self.args.extend(['-metadata', f'{key}={value}'])
+        self.custom_tags = True
         return self
 
-    def process(self, output_file: str, on_progress: Callable[[int, float], None]) -> Result[Any, str]:
+    def process(self, output_file: str, on_progress: Callable[[ProgressSample], None]) -> Result[Any, str]:
+        if self.custom_tags and os.path.splitext(output_file)[1].lower() in self.MOV_EXTENSIONS:
+            self.args.extend(['-movflags', 'use_metadata_tags'])
         self.args.append(output_file)
 
         # Track progress
@@ -258,13 +443,11 @@ class FFMpegRemuxer:
         self.args.append('error')
 
         logger.debug('Running ffmpeg: [%s]', ' '.join(self.args))
+        # Binary pipes: output of a broken file is not always valid UTF-8
         process = subprocess.Popen(self.args,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE,
-                               universal_newlines=True,
-                               encoding='utf-8',
-                               creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0,
-                               bufsize=1)
+                               creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0)
 
         pid = process.pid
         # Kill the process if the parent is killed
@@ -276,44 +459,44 @@ class FFMpegRemuxer:
                 process.kill()
         atexit.register(kill_child)
 
-        frame = 0
-        fps = 0
-        updated = True
-        while True:
-            # Print stdout
-            line = process.stdout.readline()
-            if line == '' and process.poll() is not None:
-                break
-            if line:
-                if (match := self.FFMPEG_PROCESSED_FRAMES_RE.match(line)) is not None:
-                    new_frame = int(match.group('frame'))
-                    updated = updated or new_frame != frame
-                    frame = new_frame
-                if (match := self.FFMPEG_FPS_RE.match(line)) is not None:
-                    new_fps = float(match.group('fps'))
-                    updated = updated or new_fps != fps
-                    fps = new_fps
-
-                if updated:
-                    on_progress(frame, fps)
-                    updated = False
-                logger.debug(line.strip())
-
-        # Read stderr
-        stderr = ''
-        while True:
-            line = process.stderr.readline()
-            if line == '' and process.poll() is not None:
-                break
-            if line:
-                stderr += line
-                logger.debug(line.strip())
+        # stderr is drained in its own thread while stdout is parsed here.
+        # Otherwise a full stderr pipe (lots of warnings on broken timestamps)
+        # blocks ffmpeg forever. Only the tail is kept for the error message
+        stderr = deque(maxlen=self.STDERR_TAIL_LINES)
+        def drain_stderr():
+            for line in iter(lambda: process.stderr.readline(self.MAX_LINE_LENGTH), b''):
+                line = line.decode('utf-8', errors='replace').rstrip()
+                stderr.append(line)
+                logger.debug(line)
+        stderr_thread = threading.Thread(target=drain_stderr, name=f'ffmpeg-stderr-{pid}', daemon=True)
+        stderr_thread.start()
+
+        parser = ProgressParser()
+        try:
+            for line in iter(lambda: process.stdout.readline(self.MAX_LINE_LENGTH), b''):
+                if (sample := parser.feed(line)) is not None:
+                    logger.debug('%s', sample)
+                    on_progress(sample)
+        except BaseException:
+            # on_progress aborted the job (e.g. the coordinator is lost),
+            # ffmpeg must not keep writing the output
+            logger.warning('Progress callback failed. Killing child process: %d', pid)
+            process.kill()
+            process.wait()
+            stderr_thread.join()
+            process.stdout.close()
+            process.stderr.close()
+            atexit.unregister(kill_child)
+            raise
 
         process.wait()
+        stderr_thread.join()
+        process.stdout.close()
+        process.stderr.close()
+        atexit.unregister(kill_child)
 
         if process.returncode == 0:
             return Ok(None)
 
-        atexit.unregister(kill_child)
-
+        stderr = '\n'.join(stderr)
         return Err(f'Failed to process file. Exit code: {process.returncode} ({process.returncode} - {pretty_errno(process.returncode)}): {stderr.strip()}')
@@ -13,6 +13,7 @@ from PyQt5 import QtWidgets
 
 from container import ContainerType
 from ffmpeg import Codec
+from tuning import default_preset
 
 logger = logging.getLogger(__name__)
 
@@ -47,7 +48,7 @@ class BatchEncodingOptionsDialog(QtWidgets.QDialog):
         gridlayout.addWidget(self.preset_radio, 1, 0)
         self.preset_select = QtWidgets.QComboBox()
         self.preset_select.addItems(preferred_codec.presets)
-        self.preset_select.setCurrentText(preferred_codec.preferred_preset)
+        self.preset_select.setCurrentText(default_preset(preferred_codec))
         self.preset_select.setEnabled(False)
         self.preset_radio.toggled.connect(lambda: self.preset_select.setEnabled(self.preset_radio.isChecked()))
         self.preset_radio.setChecked(True)
@@ -11,15 +11,19 @@ import os
 import platform
 import time
 from abc import abstractmethod
-from typing import List
+from collections import Counter
+from typing import List, Tuple, Any, Optional, Union, Callable
 
 from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtWidgets import QAction
+from result import Result, Ok, Err
 
 from __version__ import __version__
+from cli import open_staging
 from codec import prefer_hevc_codec
 from container import Container, SUPPORTED_CONTAINERS, PREFERRED_CONTAINER
-from ffmpeg import VideoTrack, AudioTrack, SubtitleTrack, get_supported_hevc_codecs
+from ffmpeg import VideoTrack, AudioTrack, SubtitleTrack, get_supported_hevc_codecs, \
+    get_ffprobe_version, ProgressSample
 from gui.backup_tool_dialog import BackupTool
 from gui.batch_encoding_dialog import BatchEncodingOptionsDialog
 from gui.batch_title_tool_dialog import BatchTitleToolDialog
@@ -29,10 +33,21 @@ from gui.icons import render_svg, AUDIO_FILTER_ICON, VIDEO_FILTER_ICON, \
     SUBTITLE_FILTER_ICON, BACKUP_TOOL_ICON, ADD_FILES_ICON, \
     ADD_DIRECTORY_ICON, REMOVE_ICON, REMOVE_ALL_ICON, KEEP_ALL_ICON, \
     KEEP_NONE_ICON, BATCH_ENCODING_OPTIONS_ICON, PROCESS_ICON, \
-    BATCH_TITLE_TOOL_ICON, SERIES_RENAME_TOOL_ICON
+    BATCH_TITLE_TOOL_ICON, SERIES_RENAME_TOOL_ICON, UNDO_ICON, RESTORE_ICON
 from gui.series_tool_dialog import SeriesTool
+from gui.slots_dialog import SlotsDialog
 from gui.windows_taskbar_progress import WindowsTaskbarProgress
+from probe.cache import ProbeCache
+from probe.pool import ProbePool
+from probe.quarantine import get_quarantine
+from progress import ProgressAggregator, OverallProgress
+from scheduler import Scheduler, SlotConfig
+from selection import collect_files, filter_tracks
+from distributed import Coordinator
+from journal import get_journal
+from placement import backups_summary
 from track import Track, AttachmentTrack
+from tuning import default_preset
 from utils import pretty_duration, pretty_size, get_gpu_name, ETACalculator, \
     find_ffmpeg, find_ffprobe, pretty_date, suspend_os
 
@@ -83,17 +98,99 @@ class CustomTableWidgetItem(QtWidgets.QTableWidgetItem):
         super().__init__(text)
         self.custom_data = custom_data
 
+class FileOpener(QtCore.QObject):
+    opened = QtCore.pyqtSignal(str, object)
+    failed = QtCore.pyqtSignal(str, str)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, pool: ProbePool, files: List[str]):
+        super().__init__()
+        self.pool = pool
+        self.files = files
+
+    def run(self):
+        def on_result(file, res):
+            if res.is_ok():
+                self.opened.emit(file, res.unwrap())
+            else:
+                self.failed.emit(file, res.unwrap_err())
+
+        self.pool.open(self.files, on_result)
+        self.finished.emit()
+
+class FileCompleter(QtCore.QObject):
+    completed = QtCore.pyqtSignal(object, object)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, pool: ProbePool, files: List[Container]):
+        super().__init__()
+        self.pool = pool
+        self.files = files
+
+    def run(self):
+        self.pool.complete(self.files, lambda container, res: self.completed.emit(container, res))
+        self.finished.emit()
+
+class JobRestorer(QtCore.QObject):
+    restored = QtCore.pyqtSignal(object, object)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, pool: ProbePool, settings: List[dict]):
+        super().__init__()
+        self.pool = pool
+        self.settings = settings
+
+    def run(self):
+        self.pool.restore(self.settings, lambda settings, res: self.restored.emit(settings, res))
+        self.finished.emit()
+
 class MainWindow(QtWidgets.QMainWindow):
+    # Process tab is refreshed at most this often, no matter how many jobs run
+    PROGRESS_INTERVAL_MS = 100
+
     def popup_error(self, message: str):
         QtWidgets.QMessageBox.critical(self, 'Error', message)
 
-    def __init__(self, files: list[str]):
+    def __init__(self, files: list[str], serve: Optional[Tuple[str, int]] = None,
+                 scratch: Optional[Tuple[str, Optional[float]]] = None):
         super().__init__()
+        # Address to serve jobs to remote workers on, None - process locally
+        self.serve = serve
+        # Local scratch directory and its budget in GB for files on network shares, see staging.py
+        self.scratch = scratch
         self.init_ui()
         self.files: List[Container] = []
+        # (file, error) pairs. Shown below the containers in the files table
+        self.failed_files: List[Tuple[str, str]] = []
+
+        self.opener = None
+        self.opening_pool = None
+        self.opening_thread = None
+        self.opening_files = set()
+        self.pending_files = []
+        self.opening_done = 0
+        self.opening_total = 0
+
+        # Full parse before track-wide actions, see ensure_all_parsed()
+        self.completer = None
+        self.completing_pool = None
+        self.completing_thread = None
+        self.completing_progress = None
+        self.completing_failed = []
+        self.completing_action = None
+
+        # Loading of an interrupted batch, see resume_batch()
+        self.restorer = None
+        self.restoring_pool = None
+        self.restoring_thread = None
+        self.restoring_progress = None
+        self.restoring_batch = None
+        self.restoring_jobs = []
+        self.restoring_results = {}
 
         self.processing_thread = QtCore.QThread()
         self.worker = None
+        self.slots = SlotConfig.default()
         self.windows_taskbar_progress = None
 
         self.ffmpeg = find_ffmpeg()
@@ -108,6 +205,16 @@ class MainWindow(QtWidgets.QMainWindow):
             raise SystemExit
         self.ffprobe = self.ffprobe.unwrap()
 
+        # Cache is optional: without it every file is probed again
+        self.probe_cache = None
+        if (ffprobe_version := get_ffprobe_version(self.ffprobe)).is_err():
+            logger.warning('Probe cache disabled: %s', ffprobe_version.unwrap_err())
+        else:
+            try:
+                self.probe_cache = ProbeCache(ffprobe_version.unwrap())
+            except Exception as e:
+                logger.warning('Probe cache disabled: %s', e)
+
         self.gpu_name = get_gpu_name()
         if self.gpu_name.is_err():
             self.popup_error(f"Unable to get GPU name: {self.gpu_name.err()}")
@@ -153,112 +260,280 @@ class MainWindow(QtWidgets.QMainWindow):
         files = []
         for token in tokens:
             if os.path.isdir(token):
-                files += self.collect_files(token, True)
+                files += collect_files(token, True)
             else:
                 files.append(token)
 
         self.open_files(files)
 
-    def open_file(self, file: str):
-        for f in self.files:
-            if f.file == file:
-                logger.info('File %s already opened', file)
-                return
-
-        logger.info('Opening file: %s', file)
-        container = Container(file, self.preferred_codec)
-        try:
-            if (res := container.parse(self.ffprobe)).is_err():
-                self.popup_error(f'Failed to parse file {file}: {res.unwrap_err()}')
-                return
-        except Exception as e:
-            self.popup_error(f'Error parsing file {file}: {e}')
-            logger.exception('Error parsing file %s: %s', file, e)
+    def set_taskbar_progress(self, visible: bool, value: float = 0):
+        # Files passed on the command line are opened before the window is shown
+        if self.windows_taskbar_progress is None:
             return
+        self.windows_taskbar_progress.set_progress(value)
+        self.windows_taskbar_progress.set_visible(visible)
+
+    def on_file_opened(self, file: str, container: Container):
+        logger.info('Opened file: %s', file)
+        self.opening_files.discard(file)
+        self.opening_done += 1
 
         self.files.append(container)
+        row = len(self.files) - 1
+        self.files_table.blockSignals(True)
+        self.files_table.insertRow(row)
+        self.fill_file_row(row, container)
+        self.files_table.blockSignals(False)
+
         self.files_count_changed()
+        self.update_opening_status()
 
-    def update_files_table(self):
+    def on_file_failed(self, file: str, error: str):
+        logger.error('Failed to open file %s: %s', file, error)
+        self.opening_files.discard(file)
+        self.opening_done += 1
+
+        self.failed_files.append((file, error))
+        row = self.files_table.rowCount()
         self.files_table.blockSignals(True)
-        self.files_table.setRowCount(len(self.files))
-        for i, container in enumerate(self.files):
-            self.files_table.setItem(i, 0, CustomTableWidgetItem(os.path.basename(container.file), container))
-            self.files_table.item(i, 0).setFlags(self.files_table.item(i, 0).flags() & ~QtCore.Qt.ItemIsEditable)
-
-            self.files_table.setItem(i, 1, CustomTableWidgetItem(container.title, container))
-            self.files_table.item(i, 1).setFlags(self.files_table.item(i, 0).flags() | QtCore.Qt.ItemIsEditable)
-
-            codec_select = QtWidgets.QComboBox()
-            for codec in self.supported_codecs:
-                codec_select.addItem(codec.name, codec)
-            codec_select.setCurrentText(container.codec.name)
-            self.files_table.setCellWidget(i, 2, codec_select)
-
-            preset_select = QtWidgets.QComboBox()
-            preset_select.addItems(container.codec.presets)
-            preset_select.setCurrentText(container.preset)
-            def update_preset(preset, f=container):
-                f.preset = preset
-                self.on_file_selected()
-            preset_select.currentTextChanged.connect(update_preset)
-            self.files_table.setCellWidget(i, 3, preset_select)
-
-            tune_select = QtWidgets.QComboBox()
-            tune_select.addItems(container.codec.tunes)
-            tune_select.setCurrentText(container.tune)
-            def update_tune(tune, f=container):
-                f.tune = tune
-                self.on_file_selected()
-            tune_select.currentTextChanged.connect(update_tune)
-            self.files_table.setCellWidget(i, 4, tune_select)
-
-            profile_select = QtWidgets.QComboBox()
-            profile_select.addItems(container.codec.profiles)
-            profile_select.setCurrentText(container.profile)
-            def update_profile(profile, f=container):
-                f.profile = profile
-                self.on_file_selected()
-            profile_select.currentTextChanged.connect(update_profile)
-            self.files_table.setCellWidget(i, 5, profile_select)
-
-            container_select = QtWidgets.QComboBox()
-            container_select.addItems([c.ext for c in SUPPORTED_CONTAINERS])
-            container_select.setCurrentText(container.container.ext)
-            def update_container(container, f=container):
-                f.container = next((c for c in SUPPORTED_CONTAINERS if c.ext == container), None)
-                self.on_file_selected()
-            container_select.currentTextChanged.connect(update_container)
-            self.files_table.setCellWidget(i, 6, container_select)
+        self.files_table.insertRow(row)
+        self.fill_failed_row(row, file, error)
+        self.files_table.blockSignals(False)
 
-            def update_codec(codec_name, f=container, codec_select=codec_select, preset_select=preset_select, tune_select=tune_select, profile_select=profile_select):
-                codec = next((c for c in self.supported_codecs if c.name == codec_name), None)
+        self.files_count_changed()
+        self.update_opening_status()
 
-                f.codec = codec
-                f.preset = codec.preferred_preset
-                f.tune = codec.preferred_tune
-                f.profile = codec.preferred_profile
+    def update_opening_status(self):
+        if self.opener is None:
+            return
+        percent = self.opening_done / self.opening_total * 100 if self.opening_total else 0
+        self.statusBar().showMessage(f'Opening files: {self.opening_done}/{self.opening_total}')
+        self.set_taskbar_progress(True, percent)
+
+    def start_opening(self):
+        files = self.pending_files
+        self.pending_files = []
+
+        self.opening_pool = ProbePool(self.ffprobe, self.preferred_codec, self.probe_cache)
+        self.opener = FileOpener(self.opening_pool, files)
+        self.opening_thread = QtCore.QThread()
+        self.opener.opened.connect(self.on_file_opened)
+        self.opener.failed.connect(self.on_file_failed)
+        self.opener.moveToThread(self.opening_thread)
+
+        self.opening_thread.started.connect(self.opener.run)
+        self.opener.finished.connect(self.opening_thread.quit)
+        self.opener.finished.connect(self.opener.deleteLater)
+        self.opening_thread.finished.connect(self.opening_thread.deleteLater)
+        self.opening_thread.finished.connect(self.opening_finished)
+
+        self.cancel_opening_action.setEnabled(True)
+        self.files_count_changed()
+        self.update_opening_status()
+        self.opening_thread.start()
 
-                preset_select.clear()
-                preset_select.addItems(codec.presets)
-                preset_select.setCurrentText(codec.preferred_preset)
+    def opening_finished(self):
+        cancelled = self.opening_pool.cancelled
+        self.opener = None
+        self.opening_pool = None
+        self.opening_thread = None
 
-                tune_select.clear()
-                tune_select.addItems(codec.tunes)
-                tune_select.setCurrentText(codec.preferred_tune)
+        if len(self.pending_files) != 0 and not cancelled:
+            self.start_opening()
+            return
 
-                profile_select.clear()
-                profile_select.addItems(codec.profiles)
-                profile_select.setCurrentText(codec.preferred_profile)
+        self.opening_files.clear()
+        self.pending_files = []
+        self.opening_done = 0
+        self.opening_total = 0
+        self.cancel_opening_action.setEnabled(False)
+        self.files_count_changed()
+        self.set_taskbar_progress(False)
+        self.statusBar().showMessage(
+            f'Opened {len(self.files)} files' +
+            (f', {len(self.failed_files)} failed' if len(self.failed_files) != 0 else '') +
+            ('. Cancelled' if cancelled else ''))
+
+    def cancel_opening(self):
+        logger.info('Cancel opening')
+        self.pending_files = []
+        if self.opening_pool is not None:
+            self.opening_pool.cancel()
+
+    def ensure_parsed(self, container: Container, row: int) -> Result[Any, str]:
+        # Opened files only have a summary parse, the full one
+        # is done the first time the file is selected
+        if container.complete and not container.is_stale():
+            return Ok(None)
+
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            res = container.ensure_parsed(self.ffprobe, self.probe_cache)
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+        if res.is_ok():
+            self.files_table.blockSignals(True)
+            self.fill_file_row(row, container)
+            self.files_table.blockSignals(False)
+        return res
+
+    def ensure_all_parsed(self, action: Callable[[], None]):
+        # Track-wide actions need every file fully parsed. Files are parsed
+        # in the background, the action is applied when they are, unless cancelled
+        files = [container for container in self.files if not container.complete or container.is_stale()]
+        if len(files) == 0:
+            action()
+            return
+        if self.completer is not None:
+            return
 
-                self.on_file_selected()
-            codec_select.currentTextChanged.connect(update_codec)
+        self.completing_failed = []
+        self.completing_action = action
+        self.completing_pool = ProbePool(self.ffprobe, self.preferred_codec, self.probe_cache)
+        self.completing_progress = QtWidgets.QProgressDialog('Parsing files...', 'Cancel', 0, len(files), self)
+        self.completing_progress.setWindowModality(QtCore.Qt.WindowModal)
+        self.completing_progress.setAutoClose(False)
+        self.completing_progress.setAutoReset(False)
+        self.completing_progress.setValue(0)
+        self.completing_progress.canceled.connect(self.completing_pool.cancel)
+
+        self.completer = FileCompleter(self.completing_pool, files)
+        self.completing_thread = QtCore.QThread()
+        self.completer.completed.connect(self.on_file_completed)
+        self.completer.moveToThread(self.completing_thread)
+
+        self.completing_thread.started.connect(self.completer.run)
+        self.completer.finished.connect(self.completing_thread.quit)
+        self.completer.finished.connect(self.completer.deleteLater)
+        self.completing_thread.finished.connect(self.completing_thread.deleteLater)
+        self.completing_thread.finished.connect(self.completing_finished)
+        self.completing_thread.start()
+
+    def on_file_completed(self, container: Container, res: Result[Container, str]):
+        if res.is_err():
+            self.completing_failed.append(f'{os.path.basename(container.file)}: {res.unwrap_err()}')
+        if self.completing_progress is not None:
+            self.completing_progress.setValue(self.completing_progress.value() + 1)
+
+    def completing_finished(self):
+        cancelled = self.completing_pool.cancelled
+        self.completing_progress.canceled.disconnect()
+        self.completing_progress.close()
+        action = self.completing_action
+
+        self.completer = None
+        self.completing_pool = None
+        self.completing_thread = None
+        self.completing_progress = None
+        self.completing_action = None
 
-            self.files_table.setItem(i, 7, QtWidgets.QTableWidgetItem(pretty_duration(container.duration_seconds)))
-            self.files_table.item(i, 7).setFlags(self.files_table.item(i, 7).flags() ^ QtCore.Qt.ItemIsEditable)
+        self.update_files_table()
+        if len(self.completing_failed) != 0 and not cancelled:
+            self.popup_error('Unable to parse files:\n' + '\n'.join(self.completing_failed))
+        if not cancelled:
+            action()
+
+    def fill_file_row(self, i: int, container: Container):
+        self.files_table.setItem(i, 0, CustomTableWidgetItem(os.path.basename(container.file), container))
+        self.files_table.item(i, 0).setFlags(self.files_table.item(i, 0).flags() & ~QtCore.Qt.ItemIsEditable)
+
+        self.files_table.setItem(i, 1, CustomTableWidgetItem(container.title, container))
+        self.files_table.item(i, 1).setFlags(self.files_table.item(i, 0).flags() | QtCore.Qt.ItemIsEditable)
+
+        codec_select = QtWidgets.QComboBox()
+        for codec in self.supported_codecs:
+            codec_select.addItem(codec.name, codec)
+        codec_select.setCurrentText(container.codec.name)
+        self.files_table.setCellWidget(i, 2, codec_select)
+
+        preset_select = QtWidgets.QComboBox()
+        preset_select.addItems(container.codec.presets)
+        preset_select.setCurrentText(container.preset)
+        def update_preset(preset, f=container):
+            f.preset = preset
+            self.on_file_selected()
+        preset_select.currentTextChanged.connect(update_preset)
+        self.files_table.setCellWidget(i, 3, preset_select)
+
+        tune_select = QtWidgets.QComboBox()
+        tune_select.addItems(container.codec.tunes)
+        tune_select.setCurrentText(container.tune)
+        def update_tune(tune, f=container):
+            f.tune = tune
+            self.on_file_selected()
+        tune_select.currentTextChanged.connect(update_tune)
+        self.files_table.setCellWidget(i, 4, tune_select)
+
+        profile_select = QtWidgets.QComboBox()
+        profile_select.addItems(container.codec.profiles)
+        profile_select.setCurrentText(container.profile)
+        def update_profile(profile, f=container):
+            f.profile = profile
+            self.on_file_selected()
+        profile_select.currentTextChanged.connect(update_profile)
+        self.files_table.setCellWidget(i, 5, profile_select)
+
+        container_select = QtWidgets.QComboBox()
+        container_select.addItems([c.ext for c in SUPPORTED_CONTAINERS])
+        container_select.setCurrentText(container.container.ext)
+        def update_container(container, f=container):
+            f.container = next((c for c in SUPPORTED_CONTAINERS if c.ext == container), None)
+            self.on_file_selected()
+        container_select.currentTextChanged.connect(update_container)
+        self.files_table.setCellWidget(i, 6, container_select)
+
+        def update_codec(codec_name, f=container, codec_select=codec_select, preset_select=preset_select, tune_select=tune_select, profile_select=profile_select):
+            codec = next((c for c in self.supported_codecs if c.name == codec_name), None)
+
+            f.codec = codec
+            f.preset = default_preset(codec)
+            f.tune = codec.preferred_tune
+            f.profile = codec.preferred_profile
+
+            preset_select.clear()
+            preset_select.addItems(codec.presets)
+            preset_select.setCurrentText(default_preset(codec))
+
+            tune_select.clear()
+            tune_select.addItems(codec.tunes)
+            tune_select.setCurrentText(codec.preferred_tune)
+
+            profile_select.clear()
+            profile_select.addItems(codec.profiles)
+            profile_select.setCurrentText(codec.preferred_profile)
 
-            self.files_table.setItem(i, 8, QtWidgets.QTableWidgetItem(file_track_summary(container)))
-            self.files_table.item(i, 8).setFlags(self.files_table.item(i, 8).flags() ^ QtCore.Qt.ItemIsEditable)
+            self.on_file_selected()
+        codec_select.currentTextChanged.connect(update_codec)
+
+        self.files_table.setItem(i, 7, QtWidgets.QTableWidgetItem(pretty_duration(container.duration_seconds)))
+        self.files_table.item(i, 7).setFlags(self.files_table.item(i, 7).flags() ^ QtCore.Qt.ItemIsEditable)
+
+        self.files_table.setItem(i, 8, QtWidgets.QTableWidgetItem(file_track_summary(container)))
+        self.files_table.item(i, 8).setFlags(self.files_table.item(i, 8).flags() ^ QtCore.Qt.ItemIsEditable)
+
+        self.files_table.setItem(i, 9, QtWidgets.QTableWidgetItem(''))
+        self.files_table.item(i, 9).setFlags(self.files_table.item(i, 9).flags() ^ QtCore.Qt.ItemIsEditable)
+
+    def fill_failed_row(self, i: int, file: str, error: str):
+        for column in range(self.files_table.columnCount()):
+            self.files_table.removeCellWidget(i, column)
+            self.files_table.setItem(i, column, QtWidgets.QTableWidgetItem(''))
+        self.files_table.setItem(i, 0, CustomTableWidgetItem(os.path.basename(file), None))
+        self.files_table.setItem(i, 9, QtWidgets.QTableWidgetItem(error))
+        self.files_table.item(i, 9).setToolTip(error)
+        for column in range(self.files_table.columnCount()):
+            item = self.files_table.item(i, column)
+            item.setFlags(item.flags() & ~QtCore.Qt.ItemIsEditable)
+            item.setBackground(QtGui.QColor(Colors.get_status_colors()['error']))
+
+    def update_files_table(self):
+        self.files_table.blockSignals(True)
+        self.files_table.setRowCount(len(self.files) + len(self.failed_files))
+        for i, container in enumerate(self.files):
+            self.fill_file_row(i, container)
+        for i, (file, error) in enumerate(self.failed_files):
+            self.fill_failed_row(len(self.files) + i, file, error)
         self.files_table.blockSignals(False)
 
     def on_files_cell_changed(self, row, column):
@@ -272,6 +547,8 @@ class MainWindow(QtWidgets.QMainWindow):
             return
 
         logger.info('Index: %d', index)
+        if index >= len(self.files):
+            return  # Failed files are not editable
         container = self.files[index]
 
         if column == 1:
@@ -313,6 +590,16 @@ class MainWindow(QtWidgets.QMainWindow):
         self.remove_selected_action.setEnabled(True)
 
         container = self.files_table.item(index, 0).custom_data
+        if container is None:
+            # Failed file: show the error instead of tracks
+            self.file_metadata.setText(self.files_table.item(index, 9).text())
+            self.file_tracks.setRowCount(0)
+            return
+
+        if (res := self.ensure_parsed(container, index)).is_err():
+            self.file_metadata.setText(f'Unable to parse file: {res.unwrap_err()}')
+            self.file_tracks.setRowCount(0)
+            return
 
         # Fill metadata
         self.file_metadata.clear()
@@ -377,17 +664,39 @@ class MainWindow(QtWidgets.QMainWindow):
         dialog.exec_()
 
     def open_files(self, list: list[str]):
-        # Notify user that processing is going
-        # I'm to lazy to implement proper progress bar
-        self.windows_taskbar_progress.set_progress(0)
-        self.windows_taskbar_progress.set_visible(True)
+        # Files are probed in the background and streamed into the table
+        opened = set(f.file for f in self.files)
+        retried = set(list)
+        if any(file in retried for file, _ in self.failed_files):
+            # Opening a failed file again is a retry
+            self.failed_files = [(file, error) for file, error in self.failed_files if file not in retried]
+            self.update_files_table()
 
-        for i, file in enumerate(list):
-            self.windows_taskbar_progress.set_progress(i / len(list) * 100)
-            self.open_file(file)
+        files = []
+        for file in list:
+            if file in opened or file in self.opening_files:
+                logger.info('File %s already opened', file)
+                continue
+            self.opening_files.add(file)
+            files.append(file)
 
-        self.windows_taskbar_progress.set_visible(False)
-        self.update_files_table()
+        if len(files) == 0:
+            return
+
+        self.pending_files.extend(files)
+        self.opening_total += len(files)
+        if self.opener is None:
+            self.start_opening()
+
+    def retry_failed(self):
+        # Explicit retry is the only way out of the quarantine
+        logger.info('Retry failed files')
+        files = [file for file, _ in self.failed_files]
+        if (quarantine := get_quarantine()) is not None:
+            for file in files:
+                quarantine.release(file)
+        self.open_files(files)
+        self.files_count_changed()
 
     def add_files(self):
         logger.info('Add files')
@@ -407,20 +716,6 @@ class MainWindow(QtWidgets.QMainWindow):
             files = dialog.selectedFiles()
             self.open_files(files)
 
-    def collect_files(self, dir: str, recursive: bool) -> List[str]:
-        logger.debug('Open directory: %s, recursive: %s', dir, recursive)
-        files = []
-        # Don't use os.walk since its freezes on Windows Network paths
-        for token in os.listdir(dir):
-            path = os.path.join(dir, token)
-            if os.path.isdir(path):
-                if recursive:
-                    files += self.collect_files(path, True)
-            elif any(token.endswith(container.ext) for container in SUPPORTED_CONTAINERS):
-                files.append(path)
-
-        return files
-
     def add_directory(self):
         logger.info('Add directory')
         dialog = QtWidgets.QFileDialog()
@@ -428,7 +723,7 @@ class MainWindow(QtWidgets.QMainWindow):
         if dialog.exec_():
             directories = dialog.selectedFiles()
             for directory in directories:
-                self.open_files(self.collect_files(directory, False))
+                self.open_files(collect_files(directory, False))
 
     def add_directory_recursive(self):
         logger.info('Add directory recursive')
@@ -437,11 +732,12 @@ class MainWindow(QtWidgets.QMainWindow):
         if dialog.exec_():
             directories = dialog.selectedFiles()
             for directory in directories:
-                self.open_files(self.collect_files(directory, True))
+                self.open_files(collect_files(directory, True))
 
     def files_count_changed(self):
         any_file = len(self.files) != 0
-        self.remove_all_action.setEnabled(any_file)
+        self.remove_all_action.setEnabled(any_file or len(self.failed_files) != 0)
+        self.retry_failed_action.setEnabled(len(self.failed_files) != 0)
         self.audio_filter_action.setEnabled(any_file)
         self.video_filter_action.setEnabled(any_file)
         self.subtitle_filter_action.setEnabled(any_file)
@@ -449,7 +745,13 @@ class MainWindow(QtWidgets.QMainWindow):
         self.keep_none_action.setEnabled(any_file)
         self.batch_encoding_options_action.setEnabled(any_file)
         self.batch_title_tool_action.setEnabled(any_file)
-        self.process_action.setEnabled(any_file)
+        # Processing takes the files opened so far, so it waits for the rest
+        opening = self.opener is not None
+        self.process_action.setEnabled(any_file and not opening)
+        # Files can be processed only once per window
+        journal = get_journal()
+        self.resume_batch_action.setEnabled(self.worker is None and not opening and journal is not None and
+                                            journal.unfinished_batch() is not None)
 
     def batch_title_tool(self):
         logger.info('Batch title tool')
@@ -462,40 +764,27 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def remove_selected(self):
         logger.info('Remove selected')
-        self.files.remove(self.files_table.item(self.files_table.currentRow(), 0).custom_data)
-        self.files_table.removeRow(self.files_table.currentRow())
+        row = self.files_table.currentRow()
+        if row >= len(self.files):
+            del self.failed_files[row - len(self.files)]
+        else:
+            self.files.remove(self.files_table.item(row, 0).custom_data)
+        self.files_table.removeRow(row)
         self.files_count_changed()
 
     def remove_all(self):
         logger.info('Remove all')
         self.files = []
+        self.failed_files = []
         self.files_table.setRowCount(0)
         self.files_count_changed()
 
     def filter(self, filters: list[str], negative_logic, t: Track):
-        logger.info('Filters: %s', filters)
-        for container in self.files:
-            for track in container.tracks:
-                if isinstance(track, t):
-                    matches = False
-                    for filter in filters:
-                        if filter.lower() in track.language.lower():
-                            matches = True
-                            break
-                        if filter.lower() in track.title.lower():
-                            matches = True
-                            break
-                        if filter.lower() in track.codec.lower():
-                            matches = True
-                            break
-
-                    if not negative_logic:
-                        track.keep = (matches or any('*' in filter for filter in filters)) and track.keep
-                    else:
-                        track.keep = not matches and track.keep
-
-        self.update_files_table()
-        self.on_file_selected()
+        def apply():
+            filter_tracks(self.files, filters, negative_logic, t)
+            self.update_files_table()
+            self.on_file_selected()
+        self.ensure_all_parsed(apply)
 
     def audio_filter(self):
         logger.info('Audio filter')
@@ -517,17 +806,16 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def keep_all(self):
         logger.info('Keep all')
-        for container in self.files:
-            for track in container.tracks:
-                track.keep = True
-        self.update_files_table()
-        self.on_file_selected()
+        self.ensure_all_parsed(lambda: self.keep_tracks(True))
 
     def keep_none(self):
         logger.info('Keep none')
+        self.ensure_all_parsed(lambda: self.keep_tracks(False))
+
+    def keep_tracks(self, keep: bool):
         for container in self.files:
             for track in container.tracks:
-                track.keep = False
+                track.keep = keep
         self.update_files_table()
         self.on_file_selected()
 
@@ -557,7 +845,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 codec = next((c for c in self.supported_codecs if c.name == codec_name), None)
 
                 f.codec = codec
-                f.preset = codec.preferred_preset
+                f.preset = default_preset(codec)
                 f.tune = codec.preferred_tune
                 f.profile = codec.preferred_profile
 
@@ -575,42 +863,151 @@ class MainWindow(QtWidgets.QMainWindow):
                 logger.error('Unknown result type: %s', dialog.result_type)
 
 
-    def process(self):
+    def slots_options(self):
+        logger.info('Execution slots')
+        dialog = SlotsDialog(self.slots)
+        if dialog.exec_():
+            self.slots = dialog.result
+
+    def resume_batch(self):
+        # Continues the last interrupted batch: finished files are skipped,
+        # the rest are loaded with the settings they were queued with
+        if self.opener is not None:
+            return  # Opened files would be added to the batch's ones
+        journal = get_journal()
+        if journal is None or (batch := journal.unfinished_batch()) is None:
+            return
+        jobs = journal.unfinished_jobs(batch)
+        logger.info('Resume batch %d: %d files left', batch, len(jobs))
+
+        if len(self.files) != 0 or len(self.failed_files) != 0:
+            answer = QtWidgets.QMessageBox.question(
+                self, 'Resume batch', f'{len(jobs)} files of the interrupted batch will replace the opened files. Continue?')
+            if answer != QtWidgets.QMessageBox.Yes:
+                return
+
+        if self.restorer is not None:
+            return
+        self.restoring_batch = batch
+        self.restoring_jobs = jobs
+        self.restoring_results = {}
+        self.restoring_pool = ProbePool(self.ffprobe, None, self.probe_cache)
+        self.restoring_progress = QtWidgets.QProgressDialog('Loading the interrupted batch...', 'Cancel',
+                                                            0, len(jobs), self)
+        self.restoring_progress.setWindowModality(QtCore.Qt.WindowModal)
+        self.restoring_progress.setAutoClose(False)
+        self.restoring_progress.setAutoReset(False)
+        self.restoring_progress.setValue(0)
+        self.restoring_progress.canceled.connect(self.restoring_pool.cancel)
+
+        self.restorer = JobRestorer(self.restoring_pool, [settings for _, settings, _ in jobs])
+        self.restoring_thread = QtCore.QThread()
+        self.restorer.restored.connect(self.on_job_restored)
+        self.restorer.moveToThread(self.restoring_thread)
+
+        self.restoring_thread.started.connect(self.restorer.run)
+        self.restorer.finished.connect(self.restoring_thread.quit)
+        self.restorer.finished.connect(self.restorer.deleteLater)
+        self.restoring_thread.finished.connect(self.restoring_thread.deleteLater)
+        self.restoring_thread.finished.connect(self.restoring_finished)
+        self.restoring_thread.start()
+
+    def on_job_restored(self, settings: dict, res: Result[Container, str]):
+        self.restoring_results[id(settings)] = res
+        if self.restoring_progress is not None:
+            self.restoring_progress.setValue(len(self.restoring_results))
+
+    def restoring_finished(self):
+        cancelled = self.restoring_pool.cancelled
+        self.restoring_progress.canceled.disconnect()
+        self.restoring_progress.close()
+        batch, jobs, results = self.restoring_batch, self.restoring_jobs, self.restoring_results
+
+        self.restorer = None
+        self.restoring_pool = None
+        self.restoring_thread = None
+        self.restoring_progress = None
+        self.restoring_batch = None
+        self.restoring_jobs = []
+        self.restoring_results = {}
+        if cancelled:
+            # The batch stays unfinished and can be resumed later
+            return
+
+        journal = get_journal()
+        files, positions, failed = [], [], []
+        for position, settings, attempts in jobs:
+            res = results.get(id(settings), Err('Not loaded'))
+            if res.is_err():
+                logger.warning('Unable to resume %s (%d attempts): %s', settings['file'], attempts, res.unwrap_err())
+                journal.set_status(batch, position, 'error')
+                failed.append((settings['file'], res.unwrap_err()))
+                continue
+            files.append(res.unwrap())
+            positions.append(position)
+
+        self.files = files
+        self.failed_files = failed
+        self.update_files_table()
+        self.files_count_changed()
+        if len(files) == 0:
+            journal.finish_batch(batch)
+            return
+        self.process((batch, positions))
+
+    def process(self, resumed: Optional[Tuple[int, List[int]]] = None):
+        # resumed - journal batch and positions of self.files in it
+        if self.opener is not None:
+            logger.warning('Files are still being opened, not processing')
+            return
+        # Indices of the scheduler, the journal and the status rows are of this list
+        files = list(self.files)
         # Change tab
         self.main_tabwidget.setCurrentIndex(1)
 
+        journal = get_journal()
+        if resumed is not None:
+            batch, positions = resumed
+        elif journal is not None:
+            batch, positions = journal.start_batch(files), list(range(len(files)))
+        else:
+            batch, positions = None, []
+        self.resume_batch_action.setEnabled(False)
+
         class Worker(QtCore.QObject):
-            ffmpeg_process = QtCore.pyqtSignal(int, int, float)
             file_update = QtCore.pyqtSignal(int, str)
+            backup_update = QtCore.pyqtSignal(str)
+            slot_update = QtCore.pyqtSignal(int, str)
             finished = QtCore.pyqtSignal()
             error_message = QtCore.pyqtSignal(str)
 
-            def __init__(self, files: list[Container], ffmpeg: str):
+            def __init__(self, files: list[Container], scheduler: Union[Scheduler, Coordinator],
+                         aggregator: ProgressAggregator):
                 super().__init__()
                 self.files = files
-                self.ffmpeg = ffmpeg
+                self.scheduler = scheduler
+                self.aggregator = aggregator
+
+            def update_status(self, index: int, status: str, backup: Optional[str]):
+                # Journal first: it must not miss a status the GUI has shown
+                if batch is not None:
+                    journal.set_status(batch, positions[index], status)
+                if backup is not None:
+                    self.backup_update.emit(backup)
+                self.file_update.emit(index, status)
 
             def run(self):
                 logger.info('Processing %d files', len(self.files))
-
-                for i, container in enumerate(self.files):
-                    def on_progress(frame: int, fps: float, index=i):
-                        self.ffmpeg_process.emit(index, frame, fps)
-
-                    self.file_update.emit(i, 'working')
-                    if (res := container.remux(self.ffmpeg, on_progress)).is_err():
-                        self.file_update.emit(i, 'error')
-                        self.error_message.emit(f'Failed to process file {container.file}: {res.unwrap_err()}')
-                    else:
-                        self.file_update.emit(i, 'done')
-
-                logger.info('All files processed')
+                self.scheduler.run(self.files,
+                                   self.update_status,
+                                   self.slot_update.emit,
+                                   self.aggregator.update,
+                                   self.error_message.emit)
                 self.finished.emit()
 
         class FileStatus:
             def __init__(self, file: Container):
                 self.file = file
-                self.total_frames = file.duration_frames
                 self.start_time = time.time()
                 self.eta = ETACalculator(self.start_time, 0)
                 self.set_status('pending')
@@ -625,16 +1022,19 @@ class MainWindow(QtWidgets.QMainWindow):
                     self.start_time = time.time()
                     self.eta.reset(time.time(), 0)
 
-            def update_progress(self, frame: int):
-                if self.total_frames:
-                    self.completed_percent = frame / self.total_frames * 100
+            @property
+            def total_frames(self) -> int:
+                # Known only after the full parse right before remuxing
+                return self.file.duration_frames
+
+            def update_progress(self, sample: ProgressSample):
+                self.completed_percent = sample.percent(self.file.duration_seconds, self.total_frames)
+                if self.completed_percent:
                     self.eta.feed(self.completed_percent)
-                else:
-                    self.completed_percent = 0
                 self.update_time = time.time()
 
         file_statuses = [
-            FileStatus(container) for container in self.files
+            FileStatus(container) for container in files
         ]
 
         self.overall_progress_label.setText('')
@@ -646,6 +1046,10 @@ class MainWindow(QtWidgets.QMainWindow):
 
         start_time = time.time()
         overall_eta = ETACalculator(start_time, 0)
+        overall = OverallProgress(len(file_statuses))
+        backups = Counter()  # Backup strategy -> files
+        # Samples are only stored by the slot threads and picked up by the timer
+        aggregator = ProgressAggregator()
 
         # Forbid changing window size to the contents
         # allowing only manual chanes, to prevent visual glitches
@@ -653,7 +1057,7 @@ class MainWindow(QtWidgets.QMainWindow):
             self.setFixedSize(self.size())
 
         def update_overall_progress():
-            total_percent = sum(status.completed_percent for status in file_statuses) / len(file_statuses)
+            total_percent = overall.percent
             overall_eta.feed(total_percent)
             self.overall_progress.setValue(int(total_percent))
             self.overall_progress_simple_label.setText(
@@ -661,36 +1065,48 @@ class MainWindow(QtWidgets.QMainWindow):
             )
             self.overall_progress_label.setText(
                 f'Time elapsed: {pretty_duration(time.time() - start_time)}. '
-                f'ETA: {pretty_duration(overall_eta.get())}'
+                f'ETA: {pretty_duration(overall_eta.get())}.' + backups_text()
             )
 
             self.windows_taskbar_progress.set_progress(int(total_percent))
 
         def update_file_status_with_gui(index, status):
             file_statuses[index].set_status(status)
-            self.process_table.setItem(index, 1, QtWidgets.QTableWidgetItem(status))
-            self.process_table.item(index, 1).setBackground(QtGui.QColor(Colors.get_status_colors()[status]))
-            self.process_table.setItem(index, 2, QtWidgets.QTableWidgetItem(pretty_date(time.time())))
+            overall.set(index, file_statuses[index].completed_percent)
+            self.process_table.setItem(index, 2, QtWidgets.QTableWidgetItem(status))
+            self.process_table.item(index, 2).setBackground(QtGui.QColor(Colors.get_status_colors()[status]))
+            self.process_table.setItem(index, 3, QtWidgets.QTableWidgetItem(f'{file_statuses[index].completed_percent:.2f}%'))
+            self.process_table.setItem(index, 4, QtWidgets.QTableWidgetItem(pretty_date(time.time())))
             update_overall_progress()
 
-        def on_progress(index, frame: int, fps: float):
-            logger.debug('Progress: %d frames, %f FPS', frame, fps)
+        def backups_text() -> str:
+            return f' Backups: {backups_summary(backups)}.' if len(backups) != 0 else ''
 
-            status = file_statuses[index]
-            status.update_progress(frame)
+        def update_backups_with_gui(strategy):
+            backups[strategy] += 1
+            update_overall_progress()
+
+        def update_file_slot_with_gui(index, slot):
+            self.process_table.setItem(index, 1, QtWidgets.QTableWidgetItem(slot))
 
+        def update_current_progress(index, sample: ProgressSample):
+            status = file_statuses[index]
             self.current_progress.setValue(int(status.completed_percent))
             self.current_progress_simple_label.setText(
                 f'{os.path.basename(status.file.file)} - {status.completed_percent:.2f}%'
             )
-            if status.file.fps != 0:
-                fps_line = f'FPS: {fps:.2f} ({fps / status.file.fps:.2f}x of realtime). '
+            if sample.fps != 0:
+                fps_line = f'FPS: {sample.fps:.2f} ({sample.speed:.2f}x of realtime). '
             else:
-                fps_line = ''
-            if status.total_frames != 0:
-                frames_time = f'{frame}/{status.total_frames} frames processed. '
+                fps_line = f'{sample.speed:.2f}x of realtime. '
+            if status.file.duration_seconds:
+                frames_time = (f'{pretty_duration(sample.out_time_seconds)}/'
+                               f'{pretty_duration(status.file.duration_seconds)} processed'
+                               f' ({sample.frame} frames). ')
             else:
-                frames_time = f'{frame} frames processed. '
+                frames_time = f'{sample.frame} frames processed. '
+            if sample.dup_frames or sample.drop_frames:
+                frames_time += f'Dup/drop: {sample.dup_frames}/{sample.drop_frames}. '
 
             self.current_progress_label.setText(
                 fps_line + frames_time +
@@ -698,30 +1114,64 @@ class MainWindow(QtWidgets.QMainWindow):
                 f'ETA: {pretty_duration(status.eta.get())}'
             )
 
+        def publish_progress():
+            samples = aggregator.take()
+            if len(samples) == 0:
+                return
+
+            for index, sample in samples.items():
+                status = file_statuses[index]
+                if status.status != 'working':
+                    continue  # Sample was taken after the job has finished
+                status.update_progress(sample)
+                overall.set(index, status.completed_percent)
+                self.process_table.item(index, 3).setText(f'{status.completed_percent:.2f}%')
+
+            # With several slots, current progress shows one of the jobs updated since the last tick
+            index, sample = samples.popitem()
+            if file_statuses[index].status == 'working':
+                update_current_progress(index, sample)
             update_overall_progress()
 
+        progress_timer = QtCore.QTimer(self)
+        progress_timer.setInterval(self.PROGRESS_INTERVAL_MS)
+        progress_timer.timeout.connect(publish_progress)
+
         def finished():
             logger.info('All files processed')
+            if batch is not None:
+                journal.finish_batch(batch)
+            progress_timer.stop()
+            progress_timer.deleteLater()
             self.current_progress.setValue(100)
             self.current_progress.setFormat('Done')
             self.current_progress_label.setText('')
             self.overall_progress.setValue(100)
             self.overall_progress.setFormat('Done')
-            self.overall_progress_label.setText('Time elapsed: ' + pretty_duration(time.time() - start_time))
+            self.overall_progress_label.setText('Time elapsed: ' + pretty_duration(time.time() - start_time) + '.' +
+                                                backups_text())
 
             self.windows_taskbar_progress.set_visible(False)
             if self.suspend_os_on_finish_checkbox.isChecked():
                 suspend_os()
 
         # Add files to process
-        self.process_table.setRowCount(len(self.files))
+        self.process_table.setRowCount(len(files))
         for i, file_status in enumerate(file_statuses):
             self.process_table.setItem(i, 0, QtWidgets.QTableWidgetItem(os.path.basename(file_status.file.file)))
+            self.process_table.setItem(i, 1, QtWidgets.QTableWidgetItem(''))
             update_file_status_with_gui(i, 'pending')
 
-        self.worker = Worker(self.files, self.ffmpeg)
-        self.worker.ffmpeg_process.connect(on_progress)
+        if self.serve is not None:
+            scheduler = Coordinator(self.ffprobe, self.probe_cache, self.serve, self.slots.chunks)
+        else:
+            staging = open_staging(self.ffmpeg, self.ffprobe, self.probe_cache, *self.scratch) \
+                if self.scratch is not None else None
+            scheduler = Scheduler(self.ffmpeg, self.ffprobe, self.probe_cache, self.slots, staging)
+        self.worker = Worker(files, scheduler, aggregator)
+        self.worker.backup_update.connect(update_backups_with_gui)
         self.worker.file_update.connect(update_file_status_with_gui)
+        self.worker.slot_update.connect(update_file_slot_with_gui)
         self.worker.error_message.connect(self.popup_error)
         self.worker.moveToThread(self.processing_thread)
 
@@ -731,10 +1181,14 @@ class MainWindow(QtWidgets.QMainWindow):
         self.worker.finished.connect(self.processing_thread.quit)
         self.worker.finished.connect(self.worker.deleteLater)
 
+        progress_timer.start()
         self.processing_thread.start()
 
     def init_ui(self):
-        self.setWindowTitle(f'Trimmer v{__version__}')
+        if self.serve is not None:
+            self.setWindowTitle(f'Trimmer v{__version__} - serving jobs on {self.serve[0]}:{self.serve[1]}')
+        else:
+            self.setWindowTitle(f'Trimmer v{__version__}')
         self.setBaseSize(1600, 1000)
 
         self.main_tabwidget = QtWidgets.QTabWidget()
@@ -754,6 +1208,16 @@ class MainWindow(QtWidgets.QMainWindow):
             toolbar.addAction(render_svg(ADD_DIRECTORY_ICON, 32, Colors.get_icon_color()), 'Add directory', lambda: self.add_directory())
             toolbar.addAction(render_svg(ADD_DIRECTORY_ICON, 32, Colors.get_icon_color()), 'Add directory\nrecursively', lambda: self.add_directory_recursive())
 
+            self.cancel_opening_action = QAction(render_svg(UNDO_ICON, 32, Colors.get_icon_color()), 'Cancel\nopening', toolbar)
+            self.cancel_opening_action.triggered.connect(lambda: self.cancel_opening())
+            self.cancel_opening_action.setEnabled(False)
+            toolbar.addAction(self.cancel_opening_action)
+
+            self.retry_failed_action = QAction(render_svg(RESTORE_ICON, 32, Colors.get_icon_color()), 'Retry\nfailed', toolbar)
+            self.retry_failed_action.triggered.connect(lambda: self.retry_failed())
+            self.retry_failed_action.setEnabled(False)
+            toolbar.addAction(self.retry_failed_action)
+
             self.remove_selected_action = QAction(render_svg(REMOVE_ICON, 32, Colors.get_icon_color()), 'Remove\nselected', toolbar)
             self.remove_selected_action.triggered.connect(lambda: self.remove_selected())
             self.remove_selected_action.setEnabled(False)
@@ -810,6 +1274,15 @@ class MainWindow(QtWidgets.QMainWindow):
             self.process_action.setEnabled(False)
             toolbar.addAction(self.process_action)
 
+            self.resume_batch_action = QAction(render_svg(RESTORE_ICON, 32, Colors.get_icon_color()), 'Resume\nbatch', toolbar)
+            self.resume_batch_action.triggered.connect(lambda: self.resume_batch())
+            self.resume_batch_action.setEnabled(False)
+            toolbar.addAction(self.resume_batch_action)
+
+            self.slots_action = QAction(render_svg(BATCH_ENCODING_OPTIONS_ICON, 32, Colors.get_icon_color()), 'Execution\nslots', toolbar)
+            self.slots_action.triggered.connect(lambda: self.slots_options())
+            toolbar.addAction(self.slots_action)
+
             toolbar.addSeparator()
 
             toolbar.addAction(render_svg(BACKUP_TOOL_ICON, 32, Colors.get_icon_color()), 'Backup\ntool', lambda: self.backup_tool())
@@ -821,12 +1294,12 @@ class MainWindow(QtWidgets.QMainWindow):
             splitter = QtWidgets.QSplitter(QtCore.Qt.Vertical)
 
             self.files_table = QtWidgets.QTableWidget()
-            self.files_table.setColumnCount(9)
+            self.files_table.setColumnCount(10)
             self.files_table.setHorizontalHeaderLabels(['File',
                                                         'Title*',
                                                         'Codec', 'Preset', 'Tune', 'Profile',
                                                         'Container',
-                                                        'Duration', 'Tracks summary'])
+                                                        'Duration', 'Tracks summary', 'Error'])
             # Make duration to take as little space as possible
             self.files_table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
             self.files_table.horizontalHeader().setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeToContents)
@@ -837,6 +1310,7 @@ class MainWindow(QtWidgets.QMainWindow):
             self.files_table.horizontalHeader().setSectionResizeMode(6, QtWidgets.QHeaderView.ResizeToContents)
             self.files_table.horizontalHeader().setSectionResizeMode(7, QtWidgets.QHeaderView.ResizeToContents)
             self.files_table.horizontalHeader().setSectionResizeMode(8, QtWidgets.QHeaderView.Stretch)
+            self.files_table.horizontalHeader().setSectionResizeMode(9, QtWidgets.QHeaderView.ResizeToContents)
             self.files_table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
             self.files_table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
             self.files_table.itemSelectionChanged.connect(self.on_file_selected)
@@ -872,11 +1346,13 @@ class MainWindow(QtWidgets.QMainWindow):
 
             # Table of files to process
             self.process_table = QtWidgets.QTableWidget()
-            self.process_table.setColumnCount(3)
-            self.process_table.setHorizontalHeaderLabels(['File', 'Status', 'Updated'])
+            self.process_table.setColumnCount(5)
+            self.process_table.setHorizontalHeaderLabels(['File', 'Slot', 'Status', 'Progress', 'Updated'])
             self.process_table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
             self.process_table.horizontalHeader().setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeToContents)
             self.process_table.horizontalHeader().setSectionResizeMode(2, QtWidgets.QHeaderView.ResizeToContents)
+            self.process_table.horizontalHeader().setSectionResizeMode(3, QtWidgets.QHeaderView.ResizeToContents)
+            self.process_table.horizontalHeader().setSectionResizeMode(4, QtWidgets.QHeaderView.ResizeToContents)
             process_tab_layout.addWidget(self.process_table)
 
             # Two progress bars: one for current file, one for overall progress + label below them
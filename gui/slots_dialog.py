@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+#
+# @file slots_dialog.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+
+import logging
+
+from PyQt5 import QtWidgets
+
+from scheduler import SlotConfig, CPU_SLOT, HW_SLOT, COPY_SLOT
+
+logger = logging.getLogger(__name__)
+
+class SlotsDialog(QtWidgets.QDialog):
+    MAX_SLOTS = 64
+
+    def __init__(self, slots: SlotConfig):
+        super().__init__()
+        self.setWindowTitle("Execution slots")
+        layout = QtWidgets.QVBoxLayout()
+        self.setLayout(layout)
+
+        layout.addWidget(QtWidgets.QLabel(
+            'Number of files processed at the same time.\n'
+            'H.265 files are only copied and use copy slots,\n'
+            'others use CPU or hardware slots depending on the codec'
+        ))
+
+        gridwidget = QtWidgets.QWidget()
+        gridlayout = QtWidgets.QGridLayout()
+        gridwidget.setLayout(gridlayout)
+        layout.addWidget(gridwidget)
+
+        self.selects = {}
+        for row, (slot_type, title) in enumerate([
+            (CPU_SLOT, 'CPU encode (libx265)'),
+            (HW_SLOT, 'Hardware encode (NVENC, VideoToolbox)'),
+            (COPY_SLOT, 'Stream copy'),
+        ]):
+            gridlayout.addWidget(QtWidgets.QLabel(title), row, 0)
+            select = QtWidgets.QSpinBox()
+            select.setRange(1, self.MAX_SLOTS)
+            select.setValue(slots.count(slot_type))
+            gridlayout.addWidget(select, row, 1)
+            self.selects[slot_type] = select
+
+        gridlayout.addWidget(QtWidgets.QLabel('Segments per CPU encode (0 - off)'), 3, 0)
+        self.chunks_select = QtWidgets.QSpinBox()
+        self.chunks_select.setRange(0, self.MAX_SLOTS)
+        self.chunks_select.setValue(slots.chunks)
+        self.chunks_select.setToolTip('Long videos are split at keyframes and\n'
+                                      'the segments are encoded in parallel')
+        gridlayout.addWidget(self.chunks_select, 3, 1)
+
+        dialog_buttons = QtWidgets.QDialogButtonBox()
+        dialog_buttons.setStandardButtons(QtWidgets.QDialogButtonBox.Cancel | QtWidgets.QDialogButtonBox.Ok)
+        dialog_buttons.accepted.connect(self.accept)
+        dialog_buttons.rejected.connect(self.reject)
+        layout.addWidget(dialog_buttons)
+
+    def accept(self):
+        self.result = SlotConfig(
+            self.selects[CPU_SLOT].value(),
+            self.selects[HW_SLOT].value(),
+            self.selects[COPY_SLOT].value(),
+            self.chunks_select.value())
+        logger.info('Slots: %s', self.result)
+        super().accept()
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+
+#
+# @file inplace.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# In-place metadata edits of Matroska files. When every track is kept and
+# no video needs encoding, remux() would copy the whole file only to change
+# the title, track names and languages and the TRIMMER_VERSION tag. Instead
+# the Info, Tracks and Tags elements are rebuilt and written over the old
+# ones, using the Void padding after them. An element that outgrows its
+# space is appended at the end of the segment and the SeekHead is updated,
+# so only a few KB are written whatever the size of the file.
+#
+# Overwritten bytes are saved to an undo file first, and the edit is
+# recorded in the job journal. An edit interrupted by a crash is rolled
+# back the next time trimmer starts (or the file is edited). A backup is
+# made only where it is free (a copy-on-write clone).
+#
+
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from typing import Optional, List, Tuple, Dict
+
+from result import Result, Ok, Err
+
+from probe.matroska import MatroskaReader, EBMLError, read_id, read_size, read_header, read_string, read_uint, \
+    UNKNOWN_SIZE, INFO_ID, TITLE_ID, TRACKS_ID, TRACK_ENTRY_ID, NAME_ID, LANGUAGE_ID, LANGUAGE_BCP47_ID, \
+    TAGS_ID, TAG_ID, TARGETS_ID, TAG_TRACK_UID_ID, TAG_EDITION_UID_ID, TAG_CHAPTER_UID_ID, TAG_ATTACHMENT_UID_ID, \
+    SIMPLE_TAG_ID, TAG_NAME_ID, TAG_STRING_ID, SEEKHEAD_ID, SEEK_ID, SEEK_ID_ID, SEEK_POSITION_ID, CLUSTER_ID, \
+    VOID_ID, TRACK_TYPES
+from journal import get_journal
+from placement import backup, REFLINK, NO_BACKUP
+from track import VideoTrack
+from utils import unique_bak_name
+
+logger = logging.getLogger(__name__)
+
+CRC32_ID = 0xBF
+UNDO_SUFFIX = '.undo.json'
+EDITABLE_CONTAINERS = ['mkv', 'webm']
+SIGNATURE_TAG = 'TRIMMER_VERSION'
+
+
+def undo_file(file: str) -> str:
+    return file + UNDO_SUFFIX
+
+
+def can_edit_in_place(container) -> bool:
+    # Same output remux() would make with stream copies only
+    ext = os.path.splitext(container.file)[1][1:].lower()
+    if ext not in EDITABLE_CONTAINERS or container.container.ext != ext:
+        return False
+    if not all(track.keep for track in container.tracks):
+        return False
+    if not all(track.is_h265 for track in container.tracks if isinstance(track, VideoTrack)):
+        return False
+    # Other hardlinks would be edited too, remux() leaves them the original
+    try:
+        return os.stat(container.file).st_nlink == 1
+    except OSError:
+        return False
+
+
+def encode_size(size: int, length: Optional[int] = None) -> bytes:
+    # Shortest length if not given. All ones is reserved for 'unknown'
+    minimal = 1
+    while size >= (1 << (7 * minimal)) - 1:
+        minimal += 1
+    length = max(minimal, length or 0)
+    if length > 8:
+        raise EBMLError(f'Element size {size} is too big')
+    return ((1 << (7 * length)) | size).to_bytes(length, 'big')
+
+
+def encode_uint(value: int) -> bytes:
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big')
+
+
+def element(id: int, payload: bytes, size_length: Optional[int] = None) -> bytes:
+    return encode_uint(id) + encode_size(len(payload), size_length) + payload
+
+
+def void(total: int) -> bytes:
+    # Void element of exactly total (>= 2) bytes
+    for length in range(1, 9):
+        size = total - 1 - length
+        if 0 <= size < (1 << (7 * length)) - 1:
+            return element(VOID_ID, bytes(size), length)
+    raise EBMLError(f'Unable to fill {total} bytes with Void')
+
+
+def fit(id: int, payload: bytes, space: int) -> Optional[bytes]:
+    # Element followed by Void, exactly space bytes. A single byte left
+    # cannot be a Void, so the size field is made a byte longer instead
+    length = len(encode_size(len(payload)))
+    while length <= 8:
+        data = element(id, payload, length)
+        rest = space - len(data)
+        if rest < 0:
+            return None
+        if rest == 0:
+            return data
+        if rest >= 2:
+            return data + void(rest)
+        length += 1
+    return None
+
+
+def children(buf, data: int, size: int):
+    # Like iter_children, with the offset of every child header
+    pos = data
+    while pos < data + size:
+        id, cdata, csize = read_header(buf, pos)
+        if csize == UNKNOWN_SIZE or cdata + csize > data + size:
+            raise EBMLError(f'Element {id:X} at {pos} is truncated')
+        yield id, pos, cdata, csize
+        pos = cdata + csize
+
+
+def with_crc(parts: List[bytes], crc: bool) -> bytes:
+    # CRC-32 covers everything after it in the parent, stored little-endian
+    payload = b''.join(parts)
+    if crc:
+        payload = element(CRC32_ID, zlib.crc32(payload).to_bytes(4, 'little')) + payload
+    return payload
+
+
+class MatroskaEditor:
+    def __init__(self, buf):
+        self.buf = buf
+        self.reader = MatroskaReader(buf)
+        self.segment_size_pos = None  # Offset of the segment size field
+        self.seekhead = None  # (offset, data, size) of the first SeekHead
+
+    def locate(self):
+        doctype = self.reader.parse_ebml_header()
+        if doctype not in ('matroska', 'webm'):
+            raise EBMLError(f'Unsupported DocType: {doctype}')
+        self.reader.locate_elements()
+
+        _, data, size = read_header(self.buf, 0)
+        self.segment_size_pos = data + size + read_id(self.buf, data + size)[1]
+
+        pos = self.reader.segment_data
+        while pos < self.reader.segment_end:
+            id, data, size = read_header(self.buf, pos)
+            if id == CLUSTER_ID or size == UNKNOWN_SIZE:
+                break
+            if id == SEEKHEAD_ID:
+                self.seekhead = (pos, data, size)
+                break
+            pos = data + size
+
+    def region_end(self, pos: int) -> int:
+        # End of the element and of the Voids right after it
+        _, data, size = read_header(self.buf, pos)
+        end = data + size
+        while end < self.reader.segment_end:
+            id, data, size = read_header(self.buf, end)
+            if id != VOID_ID or size == UNKNOWN_SIZE:
+                break
+            end = data + size
+        return end
+
+    def raw(self, pos: int, data: int, size: int) -> bytes:
+        return bytes(self.buf[pos:data + size])
+
+    def info_payload(self, title: Optional[str]) -> Optional[bytes]:
+        # None if the title is already there
+        if self.reader.parse_info().get('title') == title:
+            return None
+        data, size = self.reader.element(INFO_ID)
+
+        parts, crc = [], False
+        for id, pos, cdata, csize in children(self.buf, data, size):
+            if id == CRC32_ID:
+                crc = True
+            elif id not in (TITLE_ID, VOID_ID):
+                parts.append(self.raw(pos, cdata, csize))
+        if title:
+            parts.append(element(TITLE_ID, title.encode('utf-8')))
+        return with_crc(parts, crc)
+
+    def tracks_payload(self, tracks: dict) -> Result[Optional[bytes], str]:
+        # tracks: stream index -> (title, language). None if nothing changes
+        if (element_data := self.reader.element(TRACKS_ID)) is None:
+            raise EBMLError('No Tracks element')
+        data, size = element_data
+        _, track_tags = self.reader.parse_tags()
+
+        parts, crc, changed = [], False, False
+        index = 0
+        for id, pos, cdata, csize in children(self.buf, data, size):
+            if id == CRC32_ID:
+                crc = True
+                continue
+            if id == VOID_ID:
+                continue
+            if id != TRACK_ENTRY_ID:
+                parts.append(self.raw(pos, cdata, csize))
+                continue
+
+            entry = self.reader.parse_track_entry(cdata, csize)
+            # Same stream numbering as the probe
+            if TRACK_TYPES.get(entry.get('type')) is None or 'codec_id' not in entry:
+                parts.append(self.raw(pos, cdata, csize))
+                continue
+            title, language = tracks.get(index, (None, None))
+            index += 1
+            current_language = entry.get('language') or entry.get('language_bcp47') or 'eng'
+            if title is None or (entry.get('name') == title and current_language == language):
+                parts.append(self.raw(pos, cdata, csize))
+                continue
+
+            tags = track_tags.get(entry.get('uid'), {})
+            if any(key.lower() in ('title', 'language') for key in tags):
+                return Err(f'Track {index - 1} has title or language tags')
+
+            entry_parts, entry_crc = [], False
+            for eid, epos, edata, esize in children(self.buf, cdata, csize):
+                if eid == CRC32_ID:
+                    entry_crc = True
+                elif eid in (NAME_ID, LANGUAGE_ID, VOID_ID):
+                    continue
+                elif eid == LANGUAGE_BCP47_ID and current_language != language:
+                    continue  # Would take precedence over the new language
+                else:
+                    entry_parts.append(self.raw(epos, edata, esize))
+            if title:
+                entry_parts.append(element(NAME_ID, title.encode('utf-8')))
+            entry_parts.append(element(LANGUAGE_ID, (language or 'und').encode('utf-8')))
+            parts.append(element(TRACK_ENTRY_ID, with_crc(entry_parts, entry_crc)))
+            changed = True
+
+        return Ok(with_crc(parts, crc) if changed else None)
+
+    def is_global_tag(self, data: int, size: int) -> bool:
+        for id, _, cdata, csize in children(self.buf, data, size):
+            if id == TARGETS_ID:
+                return not any(tid in (TAG_TRACK_UID_ID, TAG_EDITION_UID_ID, TAG_CHAPTER_UID_ID, TAG_ATTACHMENT_UID_ID)
+                               for tid, _, _, _ in children(self.buf, cdata, csize))
+        return True
+
+    def tags_payload(self, signature: str) -> bytes:
+        # Old signatures are removed from global tags, a new Tag is added
+        parts, crc = [], False
+        if (element_data := self.reader.element(TAGS_ID)) is not None:
+            data, size = element_data
+            for id, pos, cdata, csize in children(self.buf, data, size):
+                if id == CRC32_ID:
+                    crc = True
+                elif id == VOID_ID:
+                    continue
+                elif id != TAG_ID or not self.is_global_tag(cdata, csize):
+                    parts.append(self.raw(pos, cdata, csize))
+                else:
+                    tag_parts, tag_crc, simple_tags = [], False, 0
+                    for tid, tpos, tdata, tsize in children(self.buf, cdata, csize):
+                        if tid == CRC32_ID:
+                            tag_crc = True
+                            continue
+                        if tid == SIMPLE_TAG_ID:
+                            names = [read_string(self.buf, sdata, ssize)
+                                     for sid, _, sdata, ssize in children(self.buf, tdata, tsize) if sid == TAG_NAME_ID]
+                            if SIGNATURE_TAG in names:
+                                continue
+                            simple_tags += 1
+                        tag_parts.append(self.raw(tpos, tdata, tsize))
+                    if simple_tags != 0:
+                        parts.append(element(TAG_ID, with_crc(tag_parts, tag_crc)))
+
+        simple_tag = element(TAG_NAME_ID, SIGNATURE_TAG.encode('utf-8')) + \
+            element(TAG_STRING_ID, signature.encode('utf-8'))
+        parts.append(element(TAG_ID, element(TARGETS_ID, b'') + element(SIMPLE_TAG_ID, simple_tag)))
+        return with_crc(parts, crc)
+
+    def seekhead_payload(self, moved: Dict[int, int]) -> bytes:
+        # moved: element ID -> new position relative to the segment
+        pos, data, size = self.seekhead
+        parts, crc = [], False
+        for id, cpos, cdata, csize in children(self.buf, data, size):
+            if id == CRC32_ID:
+                crc = True
+                continue
+            if id == VOID_ID:
+                continue
+            if id == SEEK_ID:
+                target = next((read_uint(self.buf, sdata, ssize) for sid, _, sdata, ssize
+                               in children(self.buf, cdata, csize) if sid == SEEK_ID_ID), None)
+                if target == SEEKHEAD_ID:
+                    raise EBMLError('Files with several SeekHeads are not supported')
+                if target in moved:
+                    continue
+            parts.append(self.raw(cpos, cdata, csize))
+        for id, position in moved.items():
+            parts.append(element(SEEK_ID, element(SEEK_ID_ID, encode_uint(id)) +
+                                 element(SEEK_POSITION_ID, encode_uint(position))))
+        return with_crc(parts, crc)
+
+    def plan(self, elements: List[Tuple[int, bytes]]) -> List[Tuple[int, bytes]]:
+        # Writes (offset, data) in a safe order: elements appended at the
+        # end first, then the segment size and the SeekHead that point to
+        # them, then the rewrites in place and the Voids over moved elements
+        file_size = len(self.buf)
+        segment_data, segment_end = self.reader.segment_data, self.reader.segment_end
+        tail = segment_end
+        appended, in_place, moved = [], [], {}
+
+        # Last elements first: one ending at the end of the file grows in place
+        def position(item):
+            return self.reader.positions.get(item[0], -1)
+
+        for id, payload in sorted(elements, key=position, reverse=True):
+            pos = self.reader.positions.get(id)
+            if pos is not None:
+                end = self.region_end(pos)
+                if (data := fit(id, payload, end - pos)) is not None:
+                    in_place.append((pos, data))
+                    continue
+                if end == tail == file_size:
+                    in_place.append((pos, element(id, payload)))
+                    tail = pos + len(in_place[-1][1])
+                    continue
+                in_place.append((pos, void(end - pos)))
+
+            if segment_end != file_size:
+                raise EBMLError('Segment does not end at the end of file')
+            if self.seekhead is None:
+                raise EBMLError(f'No SeekHead to point to moved element {id:X}')
+            data = element(id, payload)
+            appended.append((tail, data))
+            moved[id] = tail - segment_data
+            tail += len(data)
+
+        writes = list(appended)
+        if tail != segment_end:
+            size, length = read_size(self.buf, self.segment_size_pos)
+            if size != UNKNOWN_SIZE:
+                writes.append((self.segment_size_pos, encode_size(tail - segment_data, length)))
+        if len(moved) != 0:
+            pos, data, size = self.seekhead
+            seekhead = fit(SEEKHEAD_ID, self.seekhead_payload(moved), self.region_end(pos) - pos)
+            if seekhead is None:
+                raise EBMLError('No room to update SeekHead')
+            writes.append((pos, seekhead))
+        return writes + in_place
+
+
+def rollback(file: str) -> bool:
+    # True if there was an interrupted edit
+    path = undo_file(file)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            undo = json.load(f)
+    except FileNotFoundError:
+        return False
+
+    logger.warning('Rolling back interrupted in-place edit of %s', file)
+    with open(file, 'r+b') as f:
+        for offset, data in undo['patches']:
+            f.seek(offset)
+            f.write(bytes.fromhex(data))
+        f.truncate(undo['size'])
+        f.flush()
+        os.fsync(f.fileno())
+    os.remove(path)
+    return True
+
+
+def recover_edits():
+    # Called once on startup
+    if (journal := get_journal()) is None:
+        return
+
+    for id, file in journal.pending_edits():
+        if not os.path.isdir(os.path.dirname(os.path.abspath(file))):
+            logger.warning('%s is not reachable, will try again next time', file)
+            continue
+        try:
+            rollback(file)
+        except (OSError, ValueError) as e:
+            logger.error('Unable to roll back in-place edit of %s: %s', file, e)
+            continue
+        journal.end_edit(id)
+
+
+def apply(file: str, writes: List[Tuple[int, bytes]]):
+    journal = get_journal()
+    edit = journal.begin_edit(file) if journal is not None else None
+    try:
+        patch(file, writes)
+    except BaseException:
+        # Left in the journal, unless there is nothing to roll back
+        if edit is not None and not os.path.exists(undo_file(file)):
+            journal.end_edit(edit)
+        raise
+    if edit is not None:
+        journal.end_edit(edit)
+
+
+def patch(file: str, writes: List[Tuple[int, bytes]]):
+    with open(file, 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        patches = []
+        for offset, data in writes:
+            if offset < size:
+                f.seek(offset)
+                patches.append([offset, f.read(min(len(data), size - offset)).hex()])
+
+        path = undo_file(file)
+        with open(path + '.tmp', 'w', encoding='utf-8') as u:
+            json.dump({'size': size, 'patches': patches}, u)
+            u.flush()
+            os.fsync(u.fileno())
+        os.replace(path + '.tmp', path)
+
+        for offset, data in writes:
+            f.seek(offset)
+            f.write(data)
+            if offset >= size:
+                # Appended elements are on disk before anything points to them
+                f.flush()
+                os.fsync(f.fileno())
+        f.flush()
+        os.fsync(f.fileno())
+    os.remove(path)
+
+
+def edit_in_place(container) -> Result[str, str]:
+    # Returns the backup strategy: a clone or none
+    file = container.file
+    try:
+        if rollback(file):
+            return Err('Interrupted in-place edit was rolled back')
+        if container.is_stale():
+            return Err('File was changed since it was opened')
+
+        with open(file, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                editor = MatroskaEditor(buf)
+                editor.locate()
+
+                elements = []
+                if (payload := editor.info_payload(container.title or None)) is not None:
+                    elements.append((INFO_ID, payload))
+                tracks = {track.index: (track.title, track.language) for track in container.tracks}
+                if (payload := editor.tracks_payload(tracks)).is_err():
+                    return payload
+                if (payload := payload.unwrap()) is not None:
+                    elements.append((TRACKS_ID, payload))
+                elements.append((TAGS_ID, editor.tags_payload(container.metadata[SIGNATURE_TAG])))
+
+                writes = editor.plan(elements)
+
+        # Only a clone: any other backup would cost the copy this avoids
+        strategy = REFLINK
+        if backup(file, unique_bak_name(file), [REFLINK]).is_err():
+            logger.debug('No copy-on-write backup of %s', file)
+            strategy = NO_BACKUP
+
+        logger.info('Editing %s in place: %d bytes in %d writes',
+                    file, sum(len(data) for _, data in writes), len(writes))
+        apply(file, writes)
+    except (OSError, ValueError, EBMLError, IndexError, struct.error) as e:
+        try:
+            rollback(file)
+        except (OSError, ValueError) as rollback_error:
+            logger.error('Unable to roll back in-place edit of %s: %s', file, rollback_error)
+        return Err(f'Unable to edit in place: {e}')
+    return Ok(strategy)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+#
+# @file journal.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Durable record of processing batches. Every job is stored with the
+# settings of its Container (Container.to_dict()) and its status, so a
+# batch interrupted by a crash, logout or suspend can be continued:
+# finished jobs are skipped, interrupted ones are started again.
+#
+# Also records the swaps of originals with their outputs in progress
+# (see placement.py), so a crash between the two renames is recovered,
+# the in-place edits in progress (see inplace.py), so a half-patched file
+# is rolled back on the next start, and the outputs placed, so files written to containers that cannot keep
+# the TRIMMER_VERSION tag (MPEG-TS) are not processed again.
+#
+
+import functools
+import json
+import logging
+import os
+import platform
+import sqlite3
+import threading
+import time
+from typing import Optional, List, Tuple
+
+from utils import get_cache_dir, is_process_alive
+
+logger = logging.getLogger(__name__)
+
+# Statuses of unfinished jobs. 'working' ones were interrupted
+UNFINISHED_STATUSES = ('pending', 'working')
+UNFINISHED_PLACEHOLDERS = ', '.join('?' * len(UNFINISHED_STATUSES))
+SWAP_COLUMNS = [('size', 'INTEGER'), ('mtime_ns', 'INTEGER'), ('pid', 'INTEGER'), ('host', 'TEXT')]
+
+
+class Journal:
+    DEFAULT_FILE = 'journal.sqlite'
+    # Finished batches are of no use after that
+    KEEP_FINISHED_SECONDS = 30 * 24 * 3600
+
+    def __init__(self, path: Optional[str] = None):
+        self.__path = path or os.path.join(get_cache_dir(), self.DEFAULT_FILE)
+        # Statuses come from the slot threads
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(self.__path, check_same_thread=False)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        # Every status change must survive a power loss
+        self.__db.execute('PRAGMA synchronous=FULL')
+        self.__db.execute('PRAGMA foreign_keys=ON')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS batches ('
+                          'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                          'created REAL NOT NULL, '
+                          'finished REAL)')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                          'batch INTEGER NOT NULL REFERENCES batches(id) ON DELETE CASCADE, '
+                          'position INTEGER NOT NULL, '
+                          'path TEXT NOT NULL, '
+                          'settings TEXT NOT NULL, '
+                          'status TEXT NOT NULL, '
+                          'attempts INTEGER NOT NULL, '
+                          'created REAL NOT NULL, '
+                          'updated REAL NOT NULL, '
+                          'PRIMARY KEY (batch, position))')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS swaps ('
+                          'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                          'file TEXT NOT NULL, '
+                          'bak TEXT NOT NULL, '
+                          'outfile TEXT NOT NULL, '
+                          'dest TEXT NOT NULL, '
+                          'created REAL NOT NULL)')
+        # Identity of the complete output and the process doing the swap.
+        # Added later, NULL in rows of older versions
+        columns = {row[1] for row in self.__db.execute('PRAGMA table_info(swaps)')}
+        for column, type in SWAP_COLUMNS:
+            if column not in columns:
+                self.__db.execute(f'ALTER TABLE swaps ADD COLUMN {column} {type}')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS edits ('
+                          'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                          'file TEXT NOT NULL, '
+                          'created REAL NOT NULL, '
+                          'pid INTEGER NOT NULL, '
+                          'host TEXT NOT NULL)')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS outputs ('
+                          'path TEXT PRIMARY KEY, '
+                          'size INTEGER NOT NULL, '
+                          'mtime_ns INTEGER NOT NULL, '
+                          'signature TEXT NOT NULL, '
+                          'created REAL NOT NULL)')
+        self.__db.execute('DELETE FROM batches WHERE finished IS NOT NULL AND finished < ?',
+                          (time.time() - self.KEEP_FINISHED_SECONDS,))
+        self.__db.commit()
+        logger.info('Job journal: %s', self.__path)
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def start_batch(self, containers: list) -> int:
+        # Job positions are indices in containers
+        now = time.time()
+        with self.__lock:
+            batch = self.__db.execute('INSERT INTO batches (created) VALUES (?)', (now,)).lastrowid
+            self.__db.executemany('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+                (batch, position, container.file, json.dumps(container.to_dict()), 'pending', 0, now, now)
+                for position, container in enumerate(containers)
+            ])
+            self.__db.commit()
+        logger.info('Journal batch %d: %d jobs', batch, len(containers))
+        return batch
+
+    def set_status(self, batch: int, position: int, status: str):
+        # Starting a job counts as an attempt
+        attempt = 1 if status == 'working' else 0
+        with self.__lock:
+            self.__db.execute('UPDATE jobs SET status = ?, attempts = attempts + ?, updated = ? '
+                              'WHERE batch = ? AND position = ?',
+                              (status, attempt, time.time(), batch, position))
+            self.__db.commit()
+
+    def finish_batch(self, batch: int):
+        with self.__lock:
+            self.__db.execute('UPDATE batches SET finished = ? WHERE id = ?', (time.time(), batch))
+            self.__db.commit()
+
+    def unfinished_batch(self) -> Optional[int]:
+        # Latest batch that was interrupted with jobs left
+        with self.__lock:
+            row = self.__db.execute(
+                'SELECT batches.id FROM batches JOIN jobs ON jobs.batch = batches.id '
+                f'WHERE batches.finished IS NULL AND jobs.status IN ({UNFINISHED_PLACEHOLDERS}) '
+                'ORDER BY batches.id DESC LIMIT 1', UNFINISHED_STATUSES).fetchone()
+        return row[0] if row is not None else None
+
+    def unfinished_jobs(self, batch: int) -> List[Tuple[int, dict, int]]:
+        # (position, Container settings, attempts) in the original order
+        with self.__lock:
+            rows = self.__db.execute(
+                'SELECT position, settings, attempts FROM jobs '
+                f'WHERE batch = ? AND status IN ({UNFINISHED_PLACEHOLDERS}) '
+                'ORDER BY position', (batch, *UNFINISHED_STATUSES)).fetchall()
+        return [(position, json.loads(settings), attempts) for position, settings, attempts in rows]
+
+    def begin_swap(self, file: str, bak: str, outfile: str, dest: str, size: int, mtime_ns: int) -> int:
+        # size and mtime_ns are of the complete outfile
+        with self.__lock:
+            id = self.__db.execute('INSERT INTO swaps (file, bak, outfile, dest, created, size, mtime_ns, pid, host) '
+                                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                   (file, bak, outfile, dest, time.time(), size, mtime_ns,
+                                    os.getpid(), platform.node())).lastrowid
+            self.__db.commit()
+        return id
+
+    def end_swap(self, id: int):
+        with self.__lock:
+            self.__db.execute('DELETE FROM swaps WHERE id = ?', (id,))
+            self.__db.commit()
+
+    def pending_swaps(self) -> List[Tuple[int, str, str, str, str, Optional[int], Optional[int]]]:
+        # (id, file, bak, outfile, dest, size, mtime_ns) of swaps interrupted by
+        # a crash. Swaps of trimmer processes still running on this machine are
+        # in progress, those of other machines sharing the cache are theirs
+        with self.__lock:
+            rows = self.__db.execute('SELECT id, file, bak, outfile, dest, size, mtime_ns, pid, host '
+                                     'FROM swaps ORDER BY id').fetchall()
+        return [row[:7] for row in rows
+                if row[8] is None or row[8] == platform.node() and
+                (row[7] is None or row[7] == os.getpid() or not is_process_alive(row[7]))]
+
+    def begin_edit(self, file: str) -> int:
+        with self.__lock:
+            id = self.__db.execute('INSERT INTO edits (file, created, pid, host) VALUES (?, ?, ?, ?)',
+                                   (file, time.time(), os.getpid(), platform.node())).lastrowid
+            self.__db.commit()
+        return id
+
+    def end_edit(self, id: int):
+        with self.__lock:
+            self.__db.execute('DELETE FROM edits WHERE id = ?', (id,))
+            self.__db.commit()
+
+    def pending_edits(self) -> List[Tuple[int, str]]:
+        # (id, file) of in-place edits interrupted by a crash, see pending_swaps()
+        with self.__lock:
+            rows = self.__db.execute('SELECT id, file, pid, host FROM edits ORDER BY id').fetchall()
+        return [row[:2] for row in rows
+                if row[3] == platform.node() and (row[2] == os.getpid() or not is_process_alive(row[2]))]
+
+    def add_output(self, path: str, size: int, mtime_ns: int, signature: str):
+        with self.__lock:
+            self.__db.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?)',
+                              (os.path.abspath(path), size, mtime_ns, signature, time.time()))
+            self.__db.commit()
+
+    def output_signature(self, path: str, size: int, mtime_ns: int) -> Optional[str]:
+        # Signature of trimmer that wrote the file, if it was not changed since
+        with self.__lock:
+            row = self.__db.execute('SELECT signature FROM outputs WHERE path = ? AND size = ? AND mtime_ns = ?',
+                                    (os.path.abspath(path), size, mtime_ns)).fetchone()
+        return row[0] if row is not None else None
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+
+@functools.lru_cache(maxsize=None)
+def get_journal() -> Optional[Journal]:
+    # Without it batches just cannot be resumed
+    try:
+        return Journal()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning('Job journal disabled: %s', e)
+        return None
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+#
+# @file placement.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Placing remux outputs. Outputs are written next to their originals, so
+# the original is backed up and replaced without copying data: shutil.move
+# would silently copy the whole file if the two were on different devices.
+# Free space is checked before anything is written.
+#
+# Backups are made by the first strategy the filesystem supports:
+# a copy-on-write clone (btrfs, XFS, APFS) or a hardlink keep the original
+# in place until the output atomically replaces it, a rename leaves a
+# moment without it, a copy (e.g. the file is open on Windows) costs its size.
+#
+# The swap (original -> backup, output -> destination) is recorded in the
+# job journal first, with the size and mtime of the complete output.
+# A swap interrupted by a crash is completed the next time trimmer starts
+# if the output is still that one, and rolled back otherwise.
+#
+
+import ctypes
+import logging
+import os
+import platform
+import shutil
+from typing import Optional, Tuple, Dict
+
+from result import Result, Ok, Err
+
+from journal import get_journal
+from utils import unique_bak_name, pretty_size
+
+logger = logging.getLogger(__name__)
+
+# Left free for everything else on the disk
+FREE_SPACE_MARGIN = 512 * 1024 * 1024
+# Peak disk use in sizes of the original: a resumed encode keeps the
+# partial output and its joined copy, a chunked one the copy of the video,
+# the encoded segments, the joined video and the output
+RESUME_SPACE_FACTOR = 2
+CHUNKED_SPACE_FACTOR = 4
+REFLINK = 'reflink'
+HARDLINK = 'hardlink'
+RENAME = 'rename'
+COPY = 'copy'
+BACKUP_STRATEGIES = [REFLINK, HARDLINK, RENAME, COPY]
+# In-place edits on filesystems without clones, see inplace.py
+NO_BACKUP = 'no backup'
+# ioctl(dest, FICLONE, src) on Linux
+FICLONE = 0x40049409
+
+
+def check_free_space(outfile: str, needed: int) -> Result[None, str]:
+    directory = os.path.dirname(os.path.abspath(outfile))
+    try:
+        free = shutil.disk_usage(directory).free
+    except OSError as e:
+        logger.warning('Unable to get free space of %s: %s', directory, e)
+        return Ok(None)
+    if free < needed + FREE_SPACE_MARGIN:
+        return Err(f'Not enough free space in {directory}: {pretty_size(free)} free, '
+                   f'{pretty_size(needed + FREE_SPACE_MARGIN)} needed')
+    return Ok(None)
+
+
+def sync_dir(directory: str):
+    # Renames are durable only when the directory is synced
+    if platform.system() == 'Windows':
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.debug('Unable to sync %s: %s', directory, e)
+
+
+def same_device(a: str, b: str) -> bool:
+    return os.stat(os.path.dirname(os.path.abspath(a))).st_dev == os.stat(os.path.dirname(os.path.abspath(b))).st_dev
+
+
+def reflink(src: str, dst: str):
+    # Raises OSError if the filesystem cannot clone
+    if platform.system() == 'Linux':
+        import fcntl
+
+        with open(src, 'rb') as s, open(dst, 'xb') as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            except OSError:
+                d.close()
+                os.remove(dst)
+                raise
+    elif platform.system() == 'Darwin':
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+    else:
+        raise OSError('Not supported on this system')
+
+
+def make_backup(file: str, bak: str, strategy: str):
+    # A backup that exists is complete: clones and copies are renamed
+    # into place only when they are done
+    if strategy == HARDLINK:
+        os.link(file, bak)
+    elif strategy == RENAME:
+        os.rename(file, bak)
+    else:
+        tmp = bak + '.tmp'
+        try:
+            if strategy == REFLINK:
+                reflink(file, tmp)
+            else:
+                shutil.copy2(file, tmp)
+            os.rename(tmp, bak)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+def backup(file: str, bak: str, strategies: list) -> Result[str, str]:
+    # Strategy of the first one that works
+    errors = []
+    for strategy in strategies:
+        try:
+            make_backup(file, bak, strategy)
+        except OSError as e:
+            logger.debug('Unable to back up %s with %s: %s', file, strategy, e)
+            errors.append(f'{strategy}: {e}')
+            continue
+        logger.info('Backed up %s -> %s (%s)', file, bak, strategy)
+        return Ok(strategy)
+    return Err(f'Unable to back up {file}: {"; ".join(errors)}')
+
+
+def place_output(file: str, outfile: str, dest: str) -> Result[Tuple[str, str], str]:
+    # Backs up file and moves outfile to dest. Returns the backup and
+    # the strategy it was made with
+    if not same_device(file, outfile) or not same_device(outfile, dest):
+        return Err(f'{outfile} is not on the same filesystem as {dest}')
+
+    bak = unique_bak_name(file)
+    try:
+        st = os.stat(outfile)
+    except OSError as e:
+        return Err(f'Unable to stat {outfile}: {e}')
+    journal = get_journal()
+    swap = journal.begin_swap(file, bak, outfile, dest, st.st_size, st.st_mtime_ns) if journal is not None else None
+    def end_swap():
+        if swap is not None:
+            journal.end_swap(swap)
+
+    res = backup(file, bak, BACKUP_STRATEGIES)
+    if res.is_err():
+        end_swap()
+        return Err(res.unwrap_err())
+    strategy = res.unwrap()
+
+    try:
+        logger.info('Move %s -> %s', outfile, dest)
+        os.replace(outfile, dest)
+    except OSError as e:
+        try:
+            if strategy == RENAME:
+                os.rename(bak, file)
+            elif os.path.exists(file):
+                os.remove(bak)
+            end_swap()
+        except OSError as restore_error:
+            # Left in the journal, recovered on the next start
+            logger.error('Unable to restore %s from %s: %s', file, bak, restore_error)
+        return Err(f'Unable to replace {file}: {e}')
+    if strategy != RENAME and dest != file:
+        # Output has another extension, the original is in the backup
+        try:
+            os.remove(file)
+        except OSError as e:
+            logger.warning('Unable to remove %s: %s', file, e)
+    sync_dir(os.path.dirname(os.path.abspath(dest)))
+
+    end_swap()
+    return Ok((bak, strategy))
+
+
+def backups_summary(counts: Dict[str, int]) -> str:
+    # Strategy -> number of files: 'reflink 812, hardlink 40, copy 3'
+    return ', '.join(f'{strategy} {counts[strategy]}'
+                     for strategy in BACKUP_STRATEGIES + [NO_BACKUP] if counts.get(strategy))
+
+
+def is_output(path: str, size: Optional[int], mtime_ns: Optional[int]) -> bool:
+    # Whether path is the complete output recorded with the swap
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return size is not None and (st.st_size, st.st_mtime_ns) == (size, mtime_ns)
+
+
+def recover_swap(file: str, bak: str, outfile: str, dest: str,
+                 size: Optional[int], mtime_ns: Optional[int]) -> Optional[bool]:
+    # True if the swap was completed or undone, None if the files are
+    # not reachable now (e.g. an unmounted share)
+    if not os.path.isdir(os.path.dirname(os.path.abspath(dest))):
+        return None
+
+    if is_output(outfile, size, mtime_ns):
+        # The output is complete: the swap is finished
+        if os.path.exists(file) and not os.path.exists(bak):
+            logger.info('Move %s -> %s', file, bak)
+            os.rename(file, bak)
+        logger.info('Move %s -> %s', outfile, dest)
+        os.replace(outfile, dest)
+        if dest != file and os.path.exists(file) and os.path.exists(bak):
+            os.remove(file)  # Backed up by a link, clone or copy
+    elif is_output(dest, size, mtime_ns):
+        if dest != file and os.path.exists(file) and os.path.exists(bak):
+            os.remove(file)
+    else:
+        # The output is lost, or is not the one that was complete: the
+        # original stays. An unknown outfile is left to the user
+        if os.path.exists(outfile):
+            logger.warning('%s is not the output that was being placed, leaving it', outfile)
+        if not os.path.exists(file) and os.path.exists(bak):
+            logger.info('Move %s -> %s', bak, file)
+            os.rename(bak, file)
+        elif os.path.exists(file) and os.path.exists(bak):
+            os.remove(bak)  # Backed up by a link, clone or copy
+    sync_dir(os.path.dirname(os.path.abspath(dest)))
+    return True
+
+
+def recover_swaps():
+    # Called once on startup
+    if (journal := get_journal()) is None:
+        return
+
+    for id, file, bak, outfile, dest, size, mtime_ns in journal.pending_swaps():
+        logger.warning('Recovering interrupted replacement of %s', file)
+        try:
+            if recover_swap(file, bak, outfile, dest, size, mtime_ns) is None:
+                logger.warning('%s is not reachable, will try again next time', dest)
+                continue
+        except OSError as e:
+            logger.error('Unable to recover replacement of %s: %s', file, e)
+            continue
+        journal.end_swap(id)
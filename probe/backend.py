@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+#
+# @file backend.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+
+import logging
+import os
+from abc import abstractmethod
+from typing import List, Tuple, Callable, Optional
+
+from result import Result, Ok, Err
+
+from ffmpeg import probe_file_summary, ProbeAborted, ProbeTimeout
+from probe import isobmff, matroska, mpegts
+from probe.isobmff import probe_isobmff
+from probe.matroska import probe_matroska
+from probe.mpegts import probe_mpegts
+from probe.policy import get_probe_policy
+from probe.quarantine import get_quarantine
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeBackend:
+    # All backends return a document shaped like ffprobe's
+    # '-show_streams -show_format' JSON output
+    def __init__(self, name: str, extensions: List[str], cost: int, version: Optional[int] = None):
+        self.__name = name
+        self.__extensions = extensions  # Without dot. Empty - any file
+        self.__cost = cost  # Relative, lower is cheaper
+        self.__version = version  # Of the parser, None - of ffprobe
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    @property
+    def cost(self) -> int:
+        return self.__cost
+
+    @property
+    def cache_version(self) -> Optional[str]:
+        # Cached results are valid for this version only.
+        # None - the version of ffprobe the cache was opened with
+        return f'{self.__name}/{self.__version}' if self.__version is not None else None
+
+    def supports(self, file: str) -> bool:
+        if len(self.__extensions) == 0:
+            return True
+        return os.path.splitext(file)[1][1:].lower() in self.__extensions
+
+    @abstractmethod
+    def probe(self, file: str) -> Result[dict, str]:
+        pass
+
+    @property
+    def complete_summary(self) -> bool:
+        # Whether summary() returns the same document as probe()
+        return True
+
+    def summary(self, file: str) -> Result[dict, str]:
+        # Native backends only read headers anyway
+        return self.probe(file)
+
+    def __str__(self):
+        return f'ProbeBackend({self.name})'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class FFProbeBackend(ProbeBackend):
+    def __init__(self, ffprobe: str):
+        # Process spawn plus ffmpeg's own stream analysis
+        super().__init__('ffprobe', [], 100)
+        self.__ffprobe = ffprobe
+
+    def probe(self, file: str) -> Result[dict, str]:
+        return get_probe_policy().probe(self.__ffprobe, file)
+
+    @property
+    def complete_summary(self) -> bool:
+        return False
+
+    def summary(self, file: str) -> Result[dict, str]:
+        return probe_file_summary(self.__ffprobe, file)
+
+
+class MatroskaBackend(ProbeBackend):
+    def __init__(self):
+        super().__init__('matroska', ['mkv', 'webm'], 1, matroska.PARSER_VERSION)
+
+    def probe(self, file: str) -> Result[dict, str]:
+        return probe_matroska(file)
+
+
+class IsoBmffBackend(ProbeBackend):
+    def __init__(self):
+        # Reads the whole moov, which is larger than Matroska headers
+        super().__init__('isobmff', ['mp4', 'mov'], 2, isobmff.PARSER_VERSION)
+
+    def probe(self, file: str) -> Result[dict, str]:
+        return probe_isobmff(file)
+
+
+class MpegTsBackend(ProbeBackend):
+    def __init__(self):
+        # Constant-sized reads of the head and the tail
+        super().__init__('mpegts', ['ts', 'm2ts'], 3, mpegts.PARSER_VERSION)
+
+    def probe(self, file: str) -> Result[dict, str]:
+        return probe_mpegts(file)
+
+
+def get_backends(ffprobe: str) -> List[ProbeBackend]:
+    # ffprobe handles anything and is the most expensive one,
+    # so it ends up as the fallback for every file
+    return sorted([
+        MatroskaBackend(),
+        IsoBmffBackend(),
+        MpegTsBackend(),
+        FFProbeBackend(ffprobe),
+    ], key=lambda backend: backend.cost)
+
+
+def native_versions(file: str) -> List[str]:
+    # Cache versions of the native backends that may have probed file
+    return [backend.cache_version for backend in [MatroskaBackend(), IsoBmffBackend(), MpegTsBackend()]
+            if backend.supports(file)]
+
+
+def quarantined(file: str) -> Result[None, str]:
+    quarantine = get_quarantine()
+    if quarantine is not None and (reason := quarantine.reason(file)) is not None:
+        return Err(f'Quarantined: {reason}')
+    return Ok(None)
+
+
+def guarded(call: Callable[[str], Result[dict, str]], file: str) -> Result[dict, str]:
+    # Crashed probes put the file into the quarantine, hung ones
+    # only if they hang again
+    try:
+        return call(file)
+    except ProbeTimeout as e:
+        logger.warning('%s on %s, retrying', e, file)
+        try:
+            return call(file)
+        except ProbeAborted as e:
+            reason = str(e)
+    except ProbeAborted as e:
+        reason = str(e)
+
+    if (quarantine := get_quarantine()) is not None:
+        quarantine.add(file, reason)
+    return Err(f'Quarantined: {reason}')
+
+
+def probe(ffprobe: str, file: str) -> Result[dict, str]:
+    if (res := probe_with_backend(ffprobe, file)).is_err():
+        return Err(res.unwrap_err())
+    return Ok(res.unwrap()[0])
+
+
+def probe_with_backend(ffprobe: str, file: str) -> Result[Tuple[dict, ProbeBackend], str]:
+    # Returns the document and the backend that made it
+    if (res := quarantined(file)).is_err():
+        return res
+
+    res = Err(f'No probe backend for {file}')
+    for backend in get_backends(ffprobe):
+        if not backend.supports(file):
+            continue
+
+        res = guarded(backend.probe, file)
+        if res.is_ok():
+            logger.debug('Probed %s with %s backend', file, backend.name)
+            return Ok((res.unwrap(), backend))
+
+        logger.info('%s backend failed on %s: %s', backend.name, file, res.unwrap_err())
+
+    return res
+
+
+def summary(ffprobe: str, file: str) -> Result[Tuple[dict, bool], str]:
+    # Returns the document and whether it is complete, i.e. as good as probe()
+    if (res := summary_with_backend(ffprobe, file)).is_err():
+        return Err(res.unwrap_err())
+    data, backend = res.unwrap()
+    return Ok((data, backend.complete_summary))
+
+
+def summary_with_backend(ffprobe: str, file: str) -> Result[Tuple[dict, ProbeBackend], str]:
+    # Returns the document and the backend that made it
+    if (res := quarantined(file)).is_err():
+        return res
+
+    res = Err(f'No probe backend for {file}')
+    for backend in get_backends(ffprobe):
+        if not backend.supports(file):
+            continue
+
+        res = guarded(backend.summary, file)
+        if res.is_ok():
+            logger.debug('Summary of %s with %s backend', file, backend.name)
+            return Ok((res.unwrap(), backend))
+
+        logger.info('%s backend failed on %s: %s', backend.name, file, res.unwrap_err())
+
+    return res
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+#
+# @file benchmark.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Compares native probe backends against ffprobe: time per file and
+# whether both produce the same tracks.
+# Run from the repository root:
+# python -m probe.benchmark [-r N] <files or directories>
+#
+
+import argparse
+import logging
+import os
+import sys
+import time
+from typing import List
+
+from result import Result, Err
+
+from ffmpeg import tracks_from_probe, probe_file, ProbeAborted
+from probe.backend import get_backends, ProbeBackend, FFProbeBackend
+from utils import find_ffprobe
+
+
+class ReferenceBackend(ProbeBackend):
+    # ffprobe with its default limits. FFProbeBackend goes through the probe
+    # policy, whose escalations and explore runs would skew the times, and
+    # which would record these runs in the user's probe statistics
+    def __init__(self, ffprobe: str):
+        super().__init__('ffprobe', [], 100)
+        self.__ffprobe = ffprobe
+
+    def probe(self, file: str) -> Result[dict, str]:
+        try:
+            return probe_file(self.__ffprobe, file)
+        except ProbeAborted as e:
+            return Err(str(e))
+
+
+def collect(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for token in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, token)):
+                    files.append(os.path.join(path, token))
+        else:
+            files.append(path)
+    return files
+
+
+def track_signature(data: dict, file: str) -> List[str]:
+    tracks = tracks_from_probe(data, file)
+    if tracks.is_err():
+        return [tracks.unwrap_err()]
+    return [f'{type(t).__name__}:{t.index}:{t.codec}:{t.language}:{t.title}' for t in tracks.unwrap()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='probe.benchmark')
+    parser.description = 'Benchmark native probe backends against ffprobe'
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per file and backend')
+    parser.add_argument('input', nargs='+', help='Files or directories')
+    args = parser.parse_args()
+
+    # Mismatch details are interesting, "No tag ..." warnings are not
+    logging.basicConfig(level=logging.ERROR)
+
+    ffprobe = find_ffprobe()
+    if ffprobe.is_err():
+        print(f'Unable to find ffprobe: {ffprobe.unwrap_err()}', file=sys.stderr)
+        return 1
+    ffprobe = ffprobe.unwrap()
+    reference = ReferenceBackend(ffprobe)
+    natives = [b for b in get_backends(ffprobe) if not isinstance(b, FFProbeBackend)]
+
+    totals = {}
+    for file in collect(args.input):
+        for backend in natives:
+            if not backend.supports(file):
+                continue
+
+            def measure(b):
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    res = b.probe(file)
+                return (time.perf_counter() - start) / args.repeat, res
+
+            native_time, native_res = measure(backend)
+            ffprobe_time, ffprobe_res = measure(reference)
+
+            if native_res.is_err():
+                verdict = f'fallback ({native_res.unwrap_err()})'
+            elif ffprobe_res.is_err():
+                verdict = f'ffprobe failed ({ffprobe_res.unwrap_err()})'
+            elif track_signature(native_res.unwrap(), file) != track_signature(ffprobe_res.unwrap(), file):
+                verdict = 'MISMATCH'
+                print(f'  native:  {track_signature(native_res.unwrap(), file)}')
+                print(f'  ffprobe: {track_signature(ffprobe_res.unwrap(), file)}')
+            else:
+                verdict = 'ok'
+
+            total = totals.setdefault(backend.name, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += native_time
+            total[2] += ffprobe_time
+            print(f'{os.path.basename(file)}: {backend.name} {native_time * 1000:.2f} ms, '
+                  f'ffprobe {ffprobe_time * 1000:.2f} ms, '
+                  f'x{ffprobe_time / max(native_time, 1e-9):.1f}, {verdict}')
+
+    for name, (count, native_time, ffprobe_time) in totals.items():
+        print(f'{name}: {count} files, {native_time:.3f} s vs ffprobe {ffprobe_time:.3f} s '
+              f'(x{ffprobe_time / max(native_time, 1e-9):.1f})')
+
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+#
+# @file cache.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+from result import Result, Ok, Err
+
+from probe import backend
+from utils import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeKey:
+    # Identity of the file at the moment it was probed. If any of the
+    # fields changes, the cached probe is considered stale
+    def __init__(self, path: str, size: int, mtime_ns: int, inode: int, version: str):
+        self.__path = path
+        self.__size = size
+        self.__mtime_ns = mtime_ns
+        self.__inode = inode
+        self.__version = version
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    @property
+    def mtime_ns(self) -> int:
+        return self.__mtime_ns
+
+    @property
+    def inode(self) -> int:
+        return self.__inode
+
+    @property
+    def version(self) -> str:
+        return self.__version
+
+    def __str__(self):
+        return f'ProbeKey({self.path}, size={self.size}, mtime_ns={self.mtime_ns}, inode={self.inode})'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class ProbeCache:
+    # 2: results of the native backends are stored under their parser version
+    SCHEMA_VERSION = 2
+    DEFAULT_FILE = 'probe_cache.sqlite'
+
+    def __init__(self, version: str, path: Optional[str] = None):
+        self.__version = version
+        self.__path = path or os.path.join(get_cache_dir(), self.DEFAULT_FILE)
+        # Probing is done from worker threads, so share one connection
+        # and serialize access to it
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(self.__path, check_same_thread=False)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('PRAGMA synchronous=NORMAL')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS probes ('
+                          'path TEXT PRIMARY KEY, '
+                          'size INTEGER NOT NULL, '
+                          'mtime_ns INTEGER NOT NULL, '
+                          'inode INTEGER NOT NULL, '
+                          'version TEXT NOT NULL, '
+                          'schema INTEGER NOT NULL, '
+                          'data TEXT NOT NULL, '
+                          'updated REAL NOT NULL)')
+        self.__db.commit()
+        logger.info('Probe cache: %s', self.__path)
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def key(self, file: str) -> Optional[ProbeKey]:
+        try:
+            st = os.stat(file)
+        except OSError as e:
+            logger.warning('Unable to stat %s: %s', file, e)
+            return None
+
+        path = os.path.normcase(os.path.abspath(file))
+        return ProbeKey(path, st.st_size, st.st_mtime_ns, st.st_ino, self.__version)
+
+    def get(self, key: ProbeKey) -> Optional[dict]:
+        # Made by ffprobe of key.version, or by the current version of a native backend
+        versions = [key.version] + backend.native_versions(key.path)
+        with self.__lock:
+            row = self.__db.execute(
+                'SELECT data FROM probes WHERE path = ? AND size = ? AND mtime_ns = ? '
+                f'AND inode = ? AND version IN ({", ".join("?" * len(versions))}) AND schema = ?',
+                (key.path, key.size, key.mtime_ns, key.inode, *versions, self.SCHEMA_VERSION)).fetchone()
+
+        if row is None:
+            logger.debug('Probe cache miss: %s', key)
+            return None
+
+        logger.debug('Probe cache hit: %s', key)
+        return json.loads(row[0])
+
+    def put(self, key: ProbeKey, data: dict, version: Optional[str] = None):
+        # version - of the native backend that made data, see ProbeBackend.cache_version
+        with self.__lock:
+            self.__db.execute(
+                'INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key.path, key.size, key.mtime_ns, key.inode, version or key.version,
+                 self.SCHEMA_VERSION, json.dumps(data), time.time()))
+            self.__db.commit()
+
+    def invalidate(self, file: str):
+        path = os.path.normcase(os.path.abspath(file))
+        with self.__lock:
+            self.__db.execute('DELETE FROM probes WHERE path = ?', (path,))
+            self.__db.commit()
+
+    def probe(self, ffprobe: str, file: str) -> Result[dict, str]:
+        # Stat before probing, so a file modified while ffprobe runs
+        # is never stored under its new identity
+        key = self.key(file)
+        if key is not None and (data := self.get(key)) is not None:
+            return Ok(data)
+
+        res = backend.probe_with_backend(ffprobe, file)
+        if res.is_err():
+            return Err(res.unwrap_err())
+        data, used = res.unwrap()
+        if key is not None:
+            self.put(key, data, used.cache_version)
+        return Ok(data)
+
+    def summary(self, ffprobe: str, file: str) -> Result[Tuple[dict, bool], str]:
+        # A cached full probe is the best summary there is. Incomplete
+        # summaries are not stored, the full probe replaces them anyway
+        key = self.key(file)
+        if key is not None and (data := self.get(key)) is not None:
+            return Ok((data, True))
+
+        res = backend.summary_with_backend(ffprobe, file)
+        if res.is_err():
+            return Err(res.unwrap_err())
+        data, used = res.unwrap()
+        if used.complete_summary and key is not None:
+            self.put(key, data, used.cache_version)
+        return Ok((data, used.complete_summary))
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+
+#
+# @file isobmff.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Minimal ISO-BMFF (MP4/MOV) header reader. Top-level boxes are walked by
+# their headers only, so a moov stored after a multi-GB mdat costs a single
+# seek over the mdat instead of a scan. Only moov is read into memory and
+# walked: mvhd, trak/tkhd, mdia/mdhd/hdlr, minf/stbl/stsd/stts, udta and meta.
+# Like the Matroska reader, the result is shaped like ffprobe's JSON output.
+#
+
+import logging
+import os
+import struct
+import time
+from fractions import Fraction
+from typing import Optional, List, Tuple, Dict
+
+from result import Result, Ok, Err
+
+logger = logging.getLogger(__name__)
+
+# Bumped on every change of the output, cached results of older versions are dropped
+PARSER_VERSION = 1
+
+HANDLERS = {
+    b'vide': 'video',
+    b'soun': 'audio',
+    b'sbtl': 'subtitle',
+    b'subt': 'subtitle',
+    b'clcp': 'subtitle',
+    b'text': 'subtitle',
+    b'tmcd': 'data',
+}
+
+# Sample entry format -> ffprobe codec_name
+CODECS = {
+    b'avc1': 'h264',
+    b'avc3': 'h264',
+    b'hvc1': 'hevc',
+    b'hev1': 'hevc',
+    b'dvh1': 'hevc',
+    b'dvhe': 'hevc',
+    b'vvc1': 'vvc',
+    b'av01': 'av1',
+    b'vp08': 'vp8',
+    b'vp09': 'vp9',
+    b'mp4v': 'mpeg4',
+    b'apch': 'prores',
+    b'apcn': 'prores',
+    b'apcs': 'prores',
+    b'apco': 'prores',
+    b'ap4h': 'prores',
+    b'ap4x': 'prores',
+    b'mp4a': 'aac',
+    b'ac-3': 'ac3',
+    b'ec-3': 'eac3',
+    b'Opus': 'opus',
+    b'fLaC': 'flac',
+    b'alac': 'alac',
+    b'mlpa': 'truehd',
+    b'dtsc': 'dts',
+    b'dtsh': 'dts',
+    b'dtsl': 'dts',
+    b'dtse': 'dts',
+    b'tx3g': 'mov_text',
+    b'text': 'mov_text',
+    b'wvtt': 'webvtt',
+    b'c608': 'eia_608',
+    b'stpp': 'ttml',
+    b'tmcd': 'tmcd',
+}
+
+# MPEG-4 objectTypeIndication from esds, for mp4a entries
+AUDIO_OBJECT_TYPES = {
+    0x40: 'aac',
+    0x66: 'aac',
+    0x67: 'aac',
+    0x68: 'aac',
+    0x69: 'mp3',
+    0x6B: 'mp3',
+    0xA5: 'ac3',
+    0xA6: 'eac3',
+}
+
+# 1904-01-01 -> 1970-01-01 in seconds
+MAC_EPOCH_OFFSET = 2082844800
+# QuickTime language codes, mov_mdhd_language_map of ffmpeg. 0 is English
+MAC_LANGUAGES = [
+    'eng', 'fra', 'ger', 'ita', 'dut', 'sve', 'spa', 'dan', 'por', 'nor',
+    'heb', 'jpn', 'ara', 'fin', 'gre', 'ice', 'mlt', 'tur', 'hr ', 'chi',
+    'urd', 'hin', 'tha', 'kor', 'lit', 'pol', 'hun', 'est', 'lav', '',
+    'fo ', '', 'rus', 'chi', '', 'iri', 'alb', 'ron', 'ces', 'slk',
+    'slv', 'yid', 'sr ', 'mac', 'bul', 'ukr', 'bel', 'uzb', 'kaz', 'aze',
+    'aze', 'arm', 'geo', 'mol', 'kir', 'tgk', 'tuk', 'mon', '', 'pus',
+    'kur', 'kas', 'snd', 'tib', 'nep', 'san', 'mar', 'ben', 'asm', 'guj',
+    'pa ', 'ori', 'mal', 'kan', 'tam', 'tel', '', 'bur', 'khm', 'lao',
+    'vie', 'ind', 'tgl', 'may', 'may', 'amh', 'tir', 'orm', 'som', 'swa',
+    '', 'run', '', 'mlg', 'epo', '', '', '', '', '',
+    '', '', '', '', '', '', '', '', '', '',
+    '', '', '', '', '', '', '', '', '', '',
+    '', '', '', '', '', '', '', '', 'wel', 'baq',
+    'cat', 'lat', 'que', 'grn', 'aym', 'tat', 'uig', 'dzo', 'jav',
+]
+
+
+class BoxError(Exception):
+    pass
+
+
+def iter_boxes(buf: bytes, start: int, end: int):
+    pos = start
+    while pos + 8 <= end:
+        size, type = struct.unpack_from('>I4s', buf, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise BoxError(f'Truncated box header at {pos}')
+            size = struct.unpack_from('>Q', buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise BoxError(f'Invalid {type!r} box size {size} at {pos}')
+        yield type, pos + header, pos + size
+        pos += size
+
+
+def find_box(buf: bytes, start: int, end: int, path: List[bytes]) -> Optional[Tuple[int, int]]:
+    for type, data, box_end in iter_boxes(buf, start, end):
+        if type == path[0]:
+            if len(path) == 1:
+                return data, box_end
+            if type == b'meta' and buf[data + 4:data + 8] != b'hdlr':
+                data += 4  # ISO meta is a full box, QuickTime one is not
+            return find_box(buf, data, box_end, path[1:])
+    return None
+
+
+def find_moov(file) -> Tuple[bytes, bool]:
+    # Walk top-level headers. mdat is skipped by its size, so a moov at the
+    # end of the file is reached with one seek
+    file.seek(0, os.SEEK_END)
+    file_size = file.tell()
+    pos = 0
+    while pos + 8 <= file_size:
+        file.seek(pos)
+        header = file.read(16)
+        size, type = struct.unpack_from('>I4s', header, 0)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_size:
+            raise BoxError(f'Invalid top-level {type!r} box size {size} at {pos}')
+
+        if type == b'moov':
+            if pos + size > file_size:
+                raise BoxError('Truncated moov box')
+            file.seek(pos + header_size)
+            return file.read(size - header_size), False
+        if type == b'moof':
+            # Fragmented file: tracks are spread over fragments
+            return b'', True
+        pos += size
+
+    raise BoxError('No moov box')
+
+
+def parse_language(code: int) -> str:
+    # ISO-639-2/T packed as three 5-bit letters, or a QuickTime (Mac)
+    # language code below 0x400, mapped as ffmpeg's ff_mov_lang_to_iso639 does
+    if code < 0x400:
+        language = MAC_LANGUAGES[code] if code < len(MAC_LANGUAGES) else ''
+        return language if language != '' else 'und'
+    if code == 0x7FFF:
+        return 'und'
+    language = ''.join(chr(((code >> shift) & 0x1F) + 0x60) for shift in (10, 5, 0))
+    return language if language.isalpha() else 'und'
+
+
+def parse_mvhd(buf: bytes, data: int) -> Tuple[int, int, int]:
+    # Returns creation time, timescale and duration
+    version = buf[data]
+    if version == 1:
+        creation, _, timescale, duration = struct.unpack_from('>QQIQ', buf, data + 4)
+    else:
+        creation, _, timescale, duration = struct.unpack_from('>IIII', buf, data + 4)
+    return creation, timescale, duration
+
+
+def parse_mdhd(buf: bytes, data: int) -> Tuple[int, int, str]:
+    # Returns timescale, duration and language
+    version = buf[data]
+    if version == 1:
+        _, _, timescale, duration, language = struct.unpack_from('>QQIQH', buf, data + 4)
+    else:
+        _, _, timescale, duration, language = struct.unpack_from('>IIIIH', buf, data + 4)
+    return timescale, duration, parse_language(language)
+
+
+def parse_descriptor(buf: bytes, pos: int, end: int) -> Tuple[int, int, int]:
+    # Returns tag, data offset, data end
+    tag = buf[pos]
+    pos += 1
+    size = 0
+    for _ in range(4):
+        byte = buf[pos]
+        pos += 1
+        size = (size << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return tag, pos, min(pos + size, end)
+
+
+def parse_esds(buf: bytes, data: int, end: int) -> Tuple[Optional[int], Optional[int]]:
+    # Returns objectTypeIndication and AAC channel configuration
+    tag, pos, esd_end = parse_descriptor(buf, data + 4, end)
+    if tag != 0x03:
+        return None, None
+    flags = buf[pos + 2]
+    pos += 3
+    if flags & 0x80:
+        pos += 2
+    if flags & 0x40:
+        pos += 1 + buf[pos]
+    if flags & 0x20:
+        pos += 2
+
+    tag, pos, config_end = parse_descriptor(buf, pos, esd_end)
+    if tag != 0x04:
+        return None, None
+    object_type = buf[pos]
+    pos += 13
+    if pos >= config_end:
+        return object_type, None
+
+    tag, pos, _ = parse_descriptor(buf, pos, config_end)
+    if tag != 0x05:
+        return object_type, None
+
+    # AudioSpecificConfig: object type (5 bits, 31 = escape), frequency
+    # index (4 bits, 15 = explicit 24-bit frequency), channel config (4 bits)
+    bits = int.from_bytes(buf[pos:pos + 8].ljust(8, b'\x00'), 'big')
+    offset = 64 - 5
+    if (bits >> offset) & 0x1F == 31:
+        offset -= 6
+    offset -= 4
+    if (bits >> offset) & 0xF == 15:
+        offset -= 24
+    offset -= 4
+    return object_type, (bits >> offset) & 0xF
+
+
+def parse_sample_entry(buf: bytes, data: int, end: int, type: str) -> Dict:
+    # stsd: full box header, entry count, then the first sample entry
+    entries = list(iter_boxes(buf, data + 8, end))
+    if len(entries) == 0:
+        raise BoxError('Empty stsd')
+    format, entry, entry_end = entries[0]
+    result = {'format': format}
+
+    if type == 'video':
+        width, height = struct.unpack_from('>HH', buf, entry + 24)
+        result['width'] = width
+        result['height'] = height
+    elif type == 'audio':
+        version = struct.unpack_from('>H', buf, entry + 8)[0]
+        if version == 2:
+            # QuickTime sound description v2 stores channels elsewhere
+            result['sample_rate'] = int(struct.unpack_from('>d', buf, entry + 32)[0])
+            result['channels'] = struct.unpack_from('>I', buf, entry + 40)[0]
+            children = entry + 64
+        else:
+            result['sample_rate'] = struct.unpack_from('>I', buf, entry + 24)[0] >> 16
+            result['channels'] = struct.unpack_from('>H', buf, entry + 16)[0]
+            children = entry + 28 + (16 if version == 1 else 0)
+        for child, cdata, cend in iter_boxes(buf, children, entry_end):
+            if child == b'esds':
+                result['object_type'], channels = parse_esds(buf, cdata, cend)
+                if channels:
+                    result['channels'] = channels
+            elif child == b'dOps':
+                result['channels'] = buf[cdata + 1]
+    return result
+
+
+def parse_stts(buf: bytes, data: int) -> Tuple[int, int, int]:
+    # Returns number of entries, number of samples and their total duration
+    count = struct.unpack_from('>I', buf, data + 4)[0]
+    samples, total = 0, 0
+    for i in range(count):
+        sample_count, delta = struct.unpack_from('>II', buf, data + 8 + i * 8)
+        samples += sample_count
+        total += sample_count * delta
+    return count, samples, total
+
+
+def parse_udta_title(buf: bytes, data: int, end: int) -> Optional[str]:
+    for type, cdata, cend in iter_boxes(buf, data, end):
+        if type == b'name':
+            return buf[cdata:cend].decode('utf-8', errors='replace').rstrip('\x00')
+        if type == b'\xa9nam':
+            # QuickTime user data text: size, language, text
+            return buf[cdata + 4:cend].decode('utf-8', errors='replace').rstrip('\x00')
+    return None
+
+
+def parse_ilst(buf: bytes, data: int, end: int) -> Dict[str, str]:
+    keys = {b'\xa9nam': 'title', b'\xa9too': 'encoder', b'\xa9cmt': 'comment', b'\xa9day': 'date'}
+    tags = {}
+    for type, cdata, cend in iter_boxes(buf, data, end):
+        if type not in keys:
+            continue
+        value = find_box(buf, cdata, cend, [b'data'])
+        if value is not None:
+            # data box: type indicator and locale before the value
+            tags[keys[type]] = buf[value[0] + 8:value[1]].decode('utf-8', errors='replace')
+    return tags
+
+
+def parse_mdta(buf: bytes, keys: Tuple[int, int], ilst: Tuple[int, int]) -> Dict[str, str]:
+    # QuickTime metadata (ffmpeg -movflags use_metadata_tags): key names
+    # in keys, values in ilst items whose type is the 1-based key index
+    names = []
+    pos = keys[0] + 8  # Version, flags and entry count
+    for _ in range(struct.unpack_from('>I', buf, keys[0] + 4)[0]):
+        if pos + 8 > keys[1] or (size := struct.unpack_from('>I', buf, pos)[0]) < 8 or pos + size > keys[1]:
+            raise BoxError('Truncated keys box')
+        names.append(buf[pos + 8:pos + size].decode('utf-8', errors='replace'))
+        pos += size
+
+    tags = {}
+    for type, cdata, cend in iter_boxes(buf, ilst[0], ilst[1]):
+        index = struct.unpack('>I', type)[0]
+        if 1 <= index <= len(names) and (value := find_box(buf, cdata, cend, [b'data'])) is not None:
+            tags[names[index - 1]] = buf[value[0] + 8:value[1]].decode('utf-8', errors='replace')
+    return tags
+
+
+def parse_trak(buf: bytes, data: int, end: int) -> Dict:
+    track = {}
+    if (hdlr := find_box(buf, data, end, [b'mdia', b'hdlr'])) is None:
+        raise BoxError('No hdlr in trak')
+    handler = buf[hdlr[0] + 8:hdlr[0] + 12]
+    if handler not in HANDLERS:
+        raise BoxError(f'Unsupported handler {handler!r}')
+    track['type'] = HANDLERS[handler]
+
+    if (mdhd := find_box(buf, data, end, [b'mdia', b'mdhd'])) is None:
+        raise BoxError('No mdhd in trak')
+    track['timescale'], track['duration'], track['language'] = parse_mdhd(buf, mdhd[0])
+
+    if (stsd := find_box(buf, data, end, [b'mdia', b'minf', b'stbl', b'stsd'])) is None:
+        raise BoxError('No stsd in trak')
+    track.update(parse_sample_entry(buf, stsd[0], stsd[1], track['type']))
+
+    if (stts := find_box(buf, data, end, [b'mdia', b'minf', b'stbl', b'stts'])) is not None:
+        track['stts'] = parse_stts(buf, stts[0])
+
+    if (tref := find_box(buf, data, end, [b'tref'])) is not None:
+        track['references'] = [type for type, _, _ in iter_boxes(buf, tref[0], tref[1])]
+
+    if (udta := find_box(buf, data, end, [b'udta'])) is not None:
+        if (title := parse_udta_title(buf, udta[0], udta[1])) is not None:
+            track['title'] = title
+    return track
+
+
+def build_probe(moov: bytes) -> Result[dict, str]:
+    mvhd = find_box(moov, 0, len(moov), [b'mvhd'])
+    if mvhd is None:
+        return Err('No mvhd box')
+    creation, timescale, duration = parse_mvhd(moov, mvhd[0])
+
+    tracks = []
+    format_tags = {}
+    chapter_tracks = set()
+    seen_trak = False
+    for type, data, end in iter_boxes(moov, 0, len(moov)):
+        if type == b'mvex':
+            return Err('Fragmented file')
+        if type == b'trak':
+            seen_trak = True
+            track = parse_trak(moov, data, end)
+            tkhd = find_box(moov, data, end, [b'tkhd'])
+            track['id'] = struct.unpack_from('>I', moov, tkhd[0] + (20 if moov[tkhd[0]] == 1 else 12))[0] \
+                if tkhd is not None else 0
+            if (chap := find_box(moov, data, end, [b'tref', b'chap'])) is not None:
+                chapter_tracks.update(struct.unpack_from(f'>{(chap[1] - chap[0]) // 4}I', moov, chap[0]))
+            tracks.append(track)
+        elif type == b'udta':
+            if (title := parse_udta_title(moov, data, end)) is not None:
+                format_tags['title'] = title
+            if (keys := find_box(moov, data, end, [b'meta', b'keys'])) is not None:
+                if (ilst := find_box(moov, data, end, [b'meta', b'ilst'])) is not None:
+                    format_tags.update(parse_mdta(moov, keys, ilst))
+            elif (ilst := find_box(moov, data, end, [b'meta', b'ilst'])) is not None:
+                format_tags.update(parse_ilst(moov, ilst[0], ilst[1]))
+                if find_box(moov, ilst[0], ilst[1], [b'covr']) is not None and not seen_trak:
+                    # ffmpeg would create the cover art stream before the tracks
+                    return Err('Cover art before tracks')
+        elif type == b'meta':
+            # QuickTime metadata may be right in moov as well
+            if moov[data + 4:data + 8] != b'hdlr':
+                data += 4
+            keys = find_box(moov, data, end, [b'keys'])
+            ilst = find_box(moov, data, end, [b'ilst'])
+            if keys is not None and ilst is not None:
+                format_tags.update(parse_mdta(moov, keys, ilst))
+
+    streams = []
+    for track in tracks:
+        if track['id'] in chapter_tracks:
+            # ffmpeg exposes chapter tracks differently, leave it to ffprobe
+            return Err('Chapter track')
+
+        format = track['format']
+        if format in (b'encv', b'enca'):
+            return Err('Encrypted track')
+        codec = CODECS.get(format)
+        if codec is None:
+            return Err(f'Unknown sample entry {format!r}')
+        if format == b'mp4a':
+            codec = AUDIO_OBJECT_TYPES.get(track.get('object_type'), None)
+            if codec is None:
+                return Err(f'Unknown mp4a object type {track.get("object_type")}')
+
+        stream = {
+            'index': len(streams),
+            'codec_name': codec,
+            'codec_type': track['type'],
+            'disposition': {'attached_pic': 0},
+        }
+        if track['timescale'] != 0:
+            stream['duration'] = f'{track["duration"] / track["timescale"]:.6f}'
+
+        tags = {'language': track['language']}
+        if 'title' in track:
+            tags['title'] = track['title']
+        stream['tags'] = tags
+
+        if track['type'] == 'video':
+            if 'stts' not in track or track['stts'][1] == 0 or track['stts'][2] == 0:
+                return Err('No sample timing for video track')
+            entries, samples, total = track['stts']
+            rate = Fraction(samples * track['timescale'], total).limit_denominator(1001)
+            stream['r_frame_rate'] = f'{rate.numerator}/{rate.denominator}'
+            stream['avg_frame_rate'] = stream['r_frame_rate']
+            stream['width'] = track['width']
+            stream['height'] = track['height']
+        elif track['type'] == 'audio':
+            stream['channels'] = track['channels']
+            stream['sample_rate'] = str(track['sample_rate'])
+
+        streams.append(stream)
+
+    if creation != 0:
+        format_tags.setdefault('creation_time', time.strftime(
+            '%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime(creation - MAC_EPOCH_OFFSET)))
+
+    format = {
+        'format_name': 'mov,mp4,m4a,3gp,3g2,mj2',
+        'nb_streams': len(streams),
+        'tags': format_tags,
+    }
+    if timescale != 0:
+        format['duration'] = f'{duration / timescale:.6f}'
+
+    logger.debug('ISO-BMFF probe: %d streams, format tags: %s', len(streams), format_tags)
+    return Ok({'streams': streams, 'format': format})
+
+
+def probe_isobmff(file: str) -> Result[dict, str]:
+    try:
+        with open(file, 'rb') as f:
+            moov, fragmented = find_moov(f)
+        if fragmented:
+            return Err('Fragmented file')
+        return build_probe(moov)
+    except (OSError, BoxError, IndexError, struct.error) as e:
+        return Err(f'Unable to parse ISO-BMFF headers: {e}')
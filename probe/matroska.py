@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+
+#
+# @file matroska.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Minimal EBML/Matroska header reader. Only the elements needed to build
+# tracks and container metadata are parsed: Info, Tracks and Tags, located
+# through the SeekHead. Clusters (the actual media data) are never touched,
+# so only a few hundred KB of the file is read.
+# The result is shaped like ffprobe's '-show_streams -show_format' JSON
+# document, so it goes through the same track builders as ffprobe output.
+#
+
+import datetime
+import logging
+import mmap
+import struct
+from fractions import Fraction
+from typing import Optional, Tuple, Dict, List
+
+from result import Result, Ok, Err
+
+logger = logging.getLogger(__name__)
+
+# Bumped on every change of the output, cached results of older versions are dropped
+PARSER_VERSION = 1
+
+# Element IDs (with the length marker, as in the specification)
+EBML_ID = 0x1A45DFA3
+EBML_DOCTYPE_ID = 0x4282
+SEGMENT_ID = 0x18538067
+SEEKHEAD_ID = 0x114D9B74
+SEEK_ID = 0x4DBB
+SEEK_ID_ID = 0x53AB
+SEEK_POSITION_ID = 0x53AC
+INFO_ID = 0x1549A966
+TIMESTAMP_SCALE_ID = 0x2AD7B1
+DURATION_ID = 0x4489
+TITLE_ID = 0x7BA9
+MUXING_APP_ID = 0x4D80
+DATE_UTC_ID = 0x4461
+TRACKS_ID = 0x1654AE6B
+TRACK_ENTRY_ID = 0xAE
+TRACK_NUMBER_ID = 0xD7
+TRACK_UID_ID = 0x73C5
+TRACK_TYPE_ID = 0x83
+FLAG_DEFAULT_ID = 0x88
+FLAG_FORCED_ID = 0x55AA
+DEFAULT_DURATION_ID = 0x23E383
+NAME_ID = 0x536E
+LANGUAGE_ID = 0x22B59C
+LANGUAGE_BCP47_ID = 0x22B59D
+CODEC_ID_ID = 0x86
+VIDEO_ID = 0xE0
+PIXEL_WIDTH_ID = 0xB0
+PIXEL_HEIGHT_ID = 0xBA
+AUDIO_ID = 0xE1
+SAMPLING_FREQUENCY_ID = 0xB5
+CHANNELS_ID = 0x9F
+CONTENT_ENCODINGS_ID = 0x6D80
+CONTENT_ENCODING_ID = 0x6240
+CONTENT_ENCRYPTION_ID = 0x5035
+TAGS_ID = 0x1254C367
+TAG_ID = 0x7373
+TARGETS_ID = 0x63C0
+TAG_TRACK_UID_ID = 0x63C5
+TAG_EDITION_UID_ID = 0x63C9
+TAG_CHAPTER_UID_ID = 0x63C4
+TAG_ATTACHMENT_UID_ID = 0x63C6
+SIMPLE_TAG_ID = 0x67C8
+TAG_NAME_ID = 0x45A3
+TAG_LANGUAGE_ID = 0x447A
+TAG_STRING_ID = 0x4487
+CLUSTER_ID = 0x1F43B675
+VOID_ID = 0xEC
+
+# Track types ffmpeg creates streams for. Others (complex, logo, buttons,
+# control) are skipped by the demuxer and don't take a stream index
+TRACK_TYPES = {
+    1: 'video',
+    2: 'audio',
+    0x11: 'subtitle',
+    0x21: 'data',
+}
+
+# Matroska CodecID -> ffprobe codec_name. Anything not listed here is
+# left to ffprobe
+CODECS = {
+    'V_MPEG4/ISO/AVC': 'h264',
+    'V_MPEGH/ISO/HEVC': 'hevc',
+    'V_MPEGI/ISO/VVC': 'vvc',
+    'V_AV1': 'av1',
+    'V_VP8': 'vp8',
+    'V_VP9': 'vp9',
+    'V_MPEG1': 'mpeg1video',
+    'V_MPEG2': 'mpeg2video',
+    'V_MPEG4/ISO/ASP': 'mpeg4',
+    'V_MPEG4/ISO/SP': 'mpeg4',
+    'V_MPEG4/ISO/AP': 'mpeg4',
+    'V_THEORA': 'theora',
+    'V_PRORES': 'prores',
+    'V_FFV1': 'ffv1',
+    'A_AAC': 'aac',
+    'A_AC3': 'ac3',
+    'A_EAC3': 'eac3',
+    'A_DTS': 'dts',
+    'A_DTS/EXPRESS': 'dts',
+    'A_DTS/LOSSLESS': 'dts',
+    'A_TRUEHD': 'truehd',
+    'A_FLAC': 'flac',
+    'A_OPUS': 'opus',
+    'A_VORBIS': 'vorbis',
+    'A_ALAC': 'alac',
+    'A_MPEG/L1': 'mp1',
+    'A_MPEG/L2': 'mp2',
+    'A_MPEG/L3': 'mp3',
+    'S_TEXT/UTF8': 'subrip',
+    'S_TEXT/ASCII': 'text',
+    'S_TEXT/SSA': 'ass',
+    'S_TEXT/ASS': 'ass',
+    'S_SSA': 'ass',
+    'S_ASS': 'ass',
+    'S_TEXT/WEBVTT': 'webvtt',
+    'S_VOBSUB': 'dvd_subtitle',
+    'S_HDMV/PGS': 'hdmv_pgs_subtitle',
+    'S_HDMV/TEXTST': 'hdmv_text_subtitle',
+    'S_DVBSUB': 'dvb_subtitle',
+}
+
+# 2001-01-01T00:00:00 UTC, origin of DateUTC
+MATROSKA_EPOCH = datetime.datetime(2001, 1, 1, tzinfo=datetime.timezone.utc)
+
+UNKNOWN_SIZE = -1
+
+
+class EBMLError(Exception):
+    pass
+
+
+def read_id(buf, pos: int) -> Tuple[int, int]:
+    first = buf[pos]
+    length = 1
+    mask = 0x80
+    while length <= 4 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 4:
+        raise EBMLError(f'Invalid element ID at {pos}')
+    return int.from_bytes(buf[pos:pos + length], 'big'), length
+
+
+def read_size(buf, pos: int) -> Tuple[int, int]:
+    first = buf[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise EBMLError(f'Invalid element size at {pos}')
+    value = int.from_bytes(buf[pos:pos + length], 'big') & ((1 << (7 * length)) - 1)
+    if value == (1 << (7 * length)) - 1:
+        return UNKNOWN_SIZE, length
+    return value, length
+
+
+def read_header(buf, pos: int) -> Tuple[int, int, int]:
+    # Returns element ID, data offset and data size
+    if pos >= len(buf):
+        raise EBMLError(f'Element at {pos} is past the end of file')
+    id, id_length = read_id(buf, pos)
+    size, size_length = read_size(buf, pos + id_length)
+    return id, pos + id_length + size_length, size
+
+
+def iter_children(buf, start: int, end: int):
+    pos = start
+    while pos < end:
+        id, data, size = read_header(buf, pos)
+        if size == UNKNOWN_SIZE:
+            # Only clusters and the segment are allowed to have unknown size,
+            # we never descend into either
+            yield id, data, end - data
+            return
+        if data + size > len(buf):
+            raise EBMLError(f'Element {id:X} at {pos} is truncated')
+        yield id, data, size
+        pos = data + size
+
+
+def read_uint(buf, data: int, size: int) -> int:
+    return int.from_bytes(buf[data:data + size], 'big')
+
+
+def read_float(buf, data: int, size: int) -> float:
+    if size == 4:
+        return struct.unpack('>f', buf[data:data + 4])[0]
+    if size == 8:
+        return struct.unpack('>d', buf[data:data + 8])[0]
+    if size == 0:
+        return 0.0
+    raise EBMLError(f'Invalid float size {size} at {data}')
+
+
+def read_string(buf, data: int, size: int) -> str:
+    return bytes(buf[data:data + size]).rstrip(b'\x00').decode('utf-8', errors='replace')
+
+
+class MatroskaReader:
+    def __init__(self, buf):
+        self.buf = buf
+        self.segment_data = None
+        self.segment_end = None
+        # Top-level element ID -> absolute offset of its header
+        self.positions: Dict[int, int] = {}
+
+    def parse_ebml_header(self) -> str:
+        id, data, size = read_header(self.buf, 0)
+        if id != EBML_ID:
+            raise EBMLError('Not an EBML file')
+
+        doctype = 'matroska'
+        for id, cdata, csize in iter_children(self.buf, data, data + size):
+            if id == EBML_DOCTYPE_ID:
+                doctype = read_string(self.buf, cdata, csize)
+
+        id, seg_data, seg_size = read_header(self.buf, data + size)
+        if id != SEGMENT_ID:
+            raise EBMLError('No segment after EBML header')
+
+        self.segment_data = seg_data
+        if seg_size == UNKNOWN_SIZE or seg_data + seg_size > len(self.buf):
+            self.segment_end = len(self.buf)
+        else:
+            self.segment_end = seg_data + seg_size
+        return doctype
+
+    def parse_seekhead(self, data: int, size: int, depth: int = 0):
+        for id, cdata, csize in iter_children(self.buf, data, data + size):
+            if id != SEEK_ID:
+                continue
+            target, position = None, None
+            for sid, sdata, ssize in iter_children(self.buf, cdata, cdata + csize):
+                if sid == SEEK_ID_ID:
+                    target = read_uint(self.buf, sdata, ssize)
+                elif sid == SEEK_POSITION_ID:
+                    position = read_uint(self.buf, sdata, ssize)
+            if target is None or position is None:
+                continue
+
+            offset = self.segment_data + position
+            if target == SEEKHEAD_ID and depth == 0 and offset < self.segment_end:
+                # Secondary SeekHead, usually at the end of the file
+                id, sdata, ssize = read_header(self.buf, offset)
+                if id == SEEKHEAD_ID:
+                    self.parse_seekhead(sdata, ssize, depth + 1)
+            elif target not in self.positions:
+                self.positions[target] = offset
+
+    def locate_elements(self):
+        # Walk top-level elements until the first cluster. This finds the
+        # SeekHead, and also Info/Tracks in files written without one
+        pos = self.segment_data
+        while pos < self.segment_end:
+            id, data, size = read_header(self.buf, pos)
+            if id == CLUSTER_ID or size == UNKNOWN_SIZE:
+                break
+            if id == SEEKHEAD_ID:
+                self.parse_seekhead(data, size)
+            elif id not in self.positions:
+                self.positions[id] = pos
+            pos = data + size
+
+    def element(self, id: int) -> Optional[Tuple[int, int]]:
+        if id not in self.positions:
+            return None
+
+        pos = self.positions[id]
+        eid, data, size = read_header(self.buf, pos)
+        if eid != id:
+            raise EBMLError(f'SeekHead points to {eid:X} instead of {id:X} at {pos}')
+        if size == UNKNOWN_SIZE or data + size > len(self.buf):
+            raise EBMLError(f'Element {id:X} at {pos} is truncated')
+        return data, size
+
+    def parse_info(self) -> dict:
+        info = {'timestamp_scale': 1000000}
+        if (element := self.element(INFO_ID)) is None:
+            raise EBMLError('No Info element')
+
+        data, size = element
+        for id, cdata, csize in iter_children(self.buf, data, data + size):
+            if id == TIMESTAMP_SCALE_ID:
+                info['timestamp_scale'] = read_uint(self.buf, cdata, csize)
+            elif id == DURATION_ID:
+                info['duration'] = read_float(self.buf, cdata, csize)
+            elif id == TITLE_ID:
+                info['title'] = read_string(self.buf, cdata, csize)
+            elif id == MUXING_APP_ID:
+                info['encoder'] = read_string(self.buf, cdata, csize)
+            elif id == DATE_UTC_ID:
+                nanoseconds = int.from_bytes(self.buf[cdata:cdata + csize], 'big', signed=True)
+                date = MATROSKA_EPOCH + datetime.timedelta(microseconds=nanoseconds // 1000)
+                info['creation_time'] = date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        return info
+
+    def parse_track_entry(self, data: int, size: int) -> dict:
+        track = {'channels': 1, 'default': 1, 'forced': 0}
+        for id, cdata, csize in iter_children(self.buf, data, data + size):
+            if id == TRACK_NUMBER_ID:
+                track['number'] = read_uint(self.buf, cdata, csize)
+            elif id == TRACK_UID_ID:
+                track['uid'] = read_uint(self.buf, cdata, csize)
+            elif id == TRACK_TYPE_ID:
+                track['type'] = read_uint(self.buf, cdata, csize)
+            elif id == FLAG_DEFAULT_ID:
+                track['default'] = read_uint(self.buf, cdata, csize)
+            elif id == FLAG_FORCED_ID:
+                track['forced'] = read_uint(self.buf, cdata, csize)
+            elif id == DEFAULT_DURATION_ID:
+                track['default_duration'] = read_uint(self.buf, cdata, csize)
+            elif id == NAME_ID:
+                track['name'] = read_string(self.buf, cdata, csize)
+            elif id == LANGUAGE_ID:
+                track['language'] = read_string(self.buf, cdata, csize)
+            elif id == LANGUAGE_BCP47_ID:
+                track['language_bcp47'] = read_string(self.buf, cdata, csize)
+            elif id == CODEC_ID_ID:
+                track['codec_id'] = read_string(self.buf, cdata, csize)
+            elif id == VIDEO_ID:
+                for vid, vdata, vsize in iter_children(self.buf, cdata, cdata + csize):
+                    if vid == PIXEL_WIDTH_ID:
+                        track['width'] = read_uint(self.buf, vdata, vsize)
+                    elif vid == PIXEL_HEIGHT_ID:
+                        track['height'] = read_uint(self.buf, vdata, vsize)
+            elif id == AUDIO_ID:
+                for aid, adata, asize in iter_children(self.buf, cdata, cdata + csize):
+                    if aid == CHANNELS_ID:
+                        track['channels'] = read_uint(self.buf, adata, asize)
+                    elif aid == SAMPLING_FREQUENCY_ID:
+                        track['sample_rate'] = read_float(self.buf, adata, asize)
+            elif id == CONTENT_ENCODINGS_ID:
+                for eid, edata, esize in iter_children(self.buf, cdata, cdata + csize):
+                    if eid != CONTENT_ENCODING_ID:
+                        continue
+                    for xid, _, _ in iter_children(self.buf, edata, edata + esize):
+                        if xid == CONTENT_ENCRYPTION_ID:
+                            track['encrypted'] = True
+        return track
+
+    def parse_tracks(self) -> List[dict]:
+        if (element := self.element(TRACKS_ID)) is None:
+            raise EBMLError('No Tracks element')
+
+        data, size = element
+        return [self.parse_track_entry(cdata, csize)
+                for id, cdata, csize in iter_children(self.buf, data, data + size)
+                if id == TRACK_ENTRY_ID]
+
+    def parse_simple_tags(self, data: int, size: int, tags: Dict[str, str]):
+        name, value, language = None, None, 'und'
+        for id, cdata, csize in iter_children(self.buf, data, data + size):
+            if id == TAG_NAME_ID:
+                name = read_string(self.buf, cdata, csize)
+            elif id == TAG_STRING_ID:
+                value = read_string(self.buf, cdata, csize)
+            elif id == TAG_LANGUAGE_ID:
+                language = read_string(self.buf, cdata, csize)
+        if name is None or value is None:
+            return
+        # ffmpeg appends the tag language to the key: TITLE-eng
+        if language not in ('und', ''):
+            name = f'{name}-{language}'
+        tags[name] = value
+
+    def parse_tags(self) -> Tuple[Dict[str, str], Dict[int, Dict[str, str]]]:
+        # Global tags and per-track (by TrackUID) tags
+        global_tags, track_tags = {}, {}
+        if (element := self.element(TAGS_ID)) is None:
+            return global_tags, track_tags
+
+        data, size = element
+        for id, cdata, csize in iter_children(self.buf, data, data + size):
+            if id != TAG_ID:
+                continue
+
+            track_uids, other_target = [], False
+            simple_tags = []
+            for tid, tdata, tsize in iter_children(self.buf, cdata, cdata + csize):
+                if tid == TARGETS_ID:
+                    for xid, xdata, xsize in iter_children(self.buf, tdata, tdata + tsize):
+                        if xid == TAG_TRACK_UID_ID:
+                            track_uids.append(read_uint(self.buf, xdata, xsize))
+                        elif xid in (TAG_EDITION_UID_ID, TAG_CHAPTER_UID_ID, TAG_ATTACHMENT_UID_ID):
+                            other_target = True
+                elif tid == SIMPLE_TAG_ID:
+                    simple_tags.append((tdata, tsize))
+
+            if other_target and len(track_uids) == 0:
+                continue  # Chapter/edition/attachment tags are not needed
+            targets = [track_tags.setdefault(uid, {}) for uid in track_uids] or [global_tags]
+            for tags in targets:
+                for tdata, tsize in simple_tags:
+                    self.parse_simple_tags(tdata, tsize, tags)
+
+        return global_tags, track_tags
+
+
+def frame_rate_from_default_duration(default_duration: int) -> str:
+    # NTSC-style rates (24000/1001) are the finest ones in practice
+    fraction = Fraction(1000000000, default_duration).limit_denominator(1001)
+    return f'{fraction.numerator}/{fraction.denominator}'
+
+
+def probe_matroska(file: str) -> Result[dict, str]:
+    try:
+        with open(file, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return build_probe(MatroskaReader(buf))
+    except (OSError, ValueError, EBMLError, IndexError, struct.error) as e:
+        return Err(f'Unable to parse Matroska headers: {e}')
+
+
+def build_probe(reader: MatroskaReader) -> Result[dict, str]:
+    doctype = reader.parse_ebml_header()
+    if doctype not in ('matroska', 'webm'):
+        return Err(f'Unsupported DocType: {doctype}')
+
+    reader.locate_elements()
+    info = reader.parse_info()
+    tracks = reader.parse_tracks()
+    global_tags, track_tags = reader.parse_tags()
+
+    streams = []
+    for track in tracks:
+        type = TRACK_TYPES.get(track.get('type'))
+        if type is None or 'codec_id' not in track:
+            # Not exposed by ffmpeg either
+            continue
+        if track.get('encrypted', False):
+            return Err(f'Track {track.get("number")} is encrypted')
+
+        codec_id = track['codec_id']
+        if codec_id.startswith('A_AAC'):
+            codec_id = 'A_AAC'
+        if type != 'data' and codec_id not in CODECS:
+            return Err(f'Unknown CodecID {codec_id}')
+
+        stream = {
+            'index': len(streams),
+            'codec_name': CODECS.get(codec_id, 'none'),
+            'codec_type': type,
+            'disposition': {
+                'default': track['default'],
+                'forced': track['forced'],
+                'attached_pic': 0,
+            },
+        }
+
+        tags = {}
+        # Like ffmpeg, prefer the legacy element. EBML default is 'eng'
+        language = track.get('language') or track.get('language_bcp47') or 'eng'
+        if language and language != 'und':
+            tags['language'] = language
+        if 'name' in track:
+            tags['title'] = track['name']
+        tags.update(track_tags.get(track.get('uid'), {}))
+        if tags:
+            stream['tags'] = tags
+
+        if type == 'video':
+            if 'default_duration' not in track or track['default_duration'] == 0:
+                # ffprobe would compute it from the packets
+                return Err(f'Video track {track.get("number")} has no DefaultDuration')
+            stream['r_frame_rate'] = frame_rate_from_default_duration(track['default_duration'])
+            stream['avg_frame_rate'] = stream['r_frame_rate']
+            if 'width' in track:
+                stream['width'] = track['width']
+            if 'height' in track:
+                stream['height'] = track['height']
+        elif type == 'audio':
+            stream['channels'] = track['channels']
+            if 'sample_rate' in track:
+                stream['sample_rate'] = str(int(track['sample_rate']))
+
+        streams.append(stream)
+
+    format_tags = {}
+    for key in ('title', 'encoder', 'creation_time'):
+        if key in info:
+            format_tags[key] = info[key]
+    format_tags.update(global_tags)
+
+    format = {
+        'format_name': 'matroska,webm',
+        'nb_streams': len(streams),
+        'tags': format_tags,
+    }
+    if 'duration' in info:
+        format['duration'] = f'{info["duration"] * info["timestamp_scale"] / 1e9:.6f}'
+
+    logger.debug('Matroska probe: %d streams, format tags: %s', len(streams), format_tags)
+    return Ok({'streams': streams, 'format': format})
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+
+#
+# @file mpegts.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Bounded-read MPEG-TS/M2TS reader. Streams are enumerated from PAT/PMT in
+# the first few MB of the file, audio channel counts come from the first
+# audio frame headers and the video frame rate from PES timestamps there
+# (extensions of the core, e.g. 7.1 E-AC-3 and DTS-HD, are left to ffprobe).
+# Duration is the distance between the first and the highest video PTS,
+# the latter being read from the tail of the file. Reads are constant-sized,
+# no matter how large the file is.
+# Like the other native readers, the result is shaped like ffprobe's JSON.
+#
+
+import logging
+import os
+from collections import Counter
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple
+
+from result import Result, Ok, Err
+
+logger = logging.getLogger(__name__)
+
+# Bumped on every change of the output, cached results of older versions are dropped
+PARSER_VERSION = 2
+
+HEAD_SIZE = 8 * 1024 * 1024
+TAIL_SIZE = 4 * 1024 * 1024
+# Enough PES payload to find an audio frame header in
+AUDIO_PAYLOAD_SIZE = 64 * 1024
+
+SYNC_BYTE = 0x47
+PAT_PID = 0x0000
+PTS_CLOCK = 90000
+PTS_WRAP = 1 << 33
+
+# stream_type -> (codec_type, ffprobe codec_name)
+STREAM_TYPES = {
+    0x01: ('video', 'mpeg1video'),
+    0x02: ('video', 'mpeg2video'),
+    0x10: ('video', 'mpeg4'),
+    0x1B: ('video', 'h264'),
+    0x24: ('video', 'hevc'),
+    0xEA: ('video', 'vc1'),
+    0x03: ('audio', 'mp3'),
+    0x04: ('audio', 'mp3'),
+    0x0F: ('audio', 'aac'),
+}
+
+# Blu-ray (HDMV registration) specific stream types
+HDMV_STREAM_TYPES = {
+    0x80: ('audio', 'pcm_bluray'),
+    0x81: ('audio', 'ac3'),
+    0x82: ('audio', 'dts'),
+    0x83: ('audio', 'truehd'),
+    0x84: ('audio', 'eac3'),
+    0xA1: ('audio', 'eac3'),
+    0xA2: ('audio', 'dts'),
+    0x90: ('subtitle', 'hdmv_pgs_subtitle'),
+    0x92: ('subtitle', 'hdmv_text_subtitle'),
+}
+
+# Private data (0x06) streams identified by a descriptor tag
+PRIVATE_DESCRIPTORS = {
+    0x6A: ('audio', 'ac3'),
+    0x7A: ('audio', 'eac3'),
+    0x59: ('subtitle', 'dvb_subtitle'),
+}
+
+# ATSC AC-3/E-AC-3 stream types
+ATSC_STREAM_TYPES = {
+    0x81: ('audio', 'ac3'),
+    0x87: ('audio', 'eac3'),
+}
+
+ISO_639_DESCRIPTOR = 0x0A
+REGISTRATION_DESCRIPTOR = 0x05
+
+AC3_ACMOD_CHANNELS = [2, 1, 2, 3, 3, 4, 4, 5]
+DTS_AMODE_CHANNELS = [1, 2, 2, 2, 2, 3, 3, 4, 4, 5, 6, 6, 6, 7, 8, 8]
+PCM_BLURAY_CHANNELS = [0, 1, 0, 2, 3, 3, 4, 4, 5, 6, 7, 8]
+TRUEHD_CHANNELS = [2, 1, 1, 2, 2, 2, 2, 1, 1, 2, 2, 1, 1]
+# strmtyp of E-AC-3 substreams that extend the independent one
+EAC3_DEPENDENT = 1
+DTS_HD_SYNC = b'\x64\x58\x20\x25'
+
+
+class TSError(Exception):
+    pass
+
+
+def detect_packet_size(buf: bytes) -> Tuple[int, int]:
+    # Returns packet size and offset of the sync byte inside a packet.
+    # M2TS prepends a 4-byte timestamp to every 188-byte packet
+    for size, offset in ((188, 0), (192, 4), (204, 0)):
+        if len(buf) >= size * 5 + offset and \
+                all(buf[offset + i * size] == SYNC_BYTE for i in range(5)):
+            return size, offset
+    raise TSError('No MPEG-TS sync')
+
+
+def iter_packets(buf: bytes, start: int, size: int):
+    # Yields PID, payload unit start flag and payload bounds
+    for pos in range(start, len(buf) - 187, size):
+        if buf[pos] != SYNC_BYTE:
+            raise TSError(f'Lost sync at {pos}')
+        pid = ((buf[pos + 1] & 0x1F) << 8) | buf[pos + 2]
+        pusi = bool(buf[pos + 1] & 0x40)
+        adaptation = (buf[pos + 3] >> 4) & 0x3
+        payload = pos + 4
+        if adaptation & 0x2:
+            payload += 1 + buf[pos + 4]
+        if not adaptation & 0x1 or payload >= pos + 188:
+            continue
+        yield pid, pusi, payload, pos + 188
+
+
+def parse_pts(buf: bytes, pos: int) -> int:
+    return ((buf[pos] >> 1) & 0x07) << 30 | buf[pos + 1] << 22 | \
+           (buf[pos + 2] >> 1) << 15 | buf[pos + 3] << 7 | buf[pos + 4] >> 1
+
+
+def parse_pes_header(buf: bytes, start: int, end: int) -> Tuple[Optional[int], int]:
+    # Returns PTS (if any) and the payload offset
+    if end - start < 9 or buf[start:start + 3] != b'\x00\x00\x01':
+        return None, end
+    payload = start + 9 + buf[start + 8]
+    if buf[start + 7] & 0x80 and start + 14 <= end:
+        return parse_pts(buf, start + 9), payload
+    return None, payload
+
+
+def parse_descriptors(buf: bytes, start: int, end: int) -> Dict[int, bytes]:
+    descriptors = {}
+    while start + 2 <= end:
+        tag, length = buf[start], buf[start + 1]
+        descriptors[tag] = bytes(buf[start + 2:start + 2 + length])
+        start += 2 + length
+    return descriptors
+
+
+class PSIAssembler:
+    # Collects PSI sections that span several packets
+    def __init__(self):
+        self.sections: Dict[int, bytearray] = {}
+
+    def feed(self, pid: int, pusi: bool, buf: bytes, start: int, end: int) -> Optional[bytes]:
+        if pusi:
+            start += 1 + buf[start]  # pointer_field
+            self.sections[pid] = bytearray()
+        if pid not in self.sections:
+            return None
+
+        section = self.sections[pid]
+        section += buf[start:end]
+        if len(section) < 3:
+            return None
+        length = 3 + (((section[1] & 0x0F) << 8) | section[2])
+        if len(section) < length:
+            return None
+        del self.sections[pid]
+        return bytes(section[:length])
+
+
+def parse_pat(section: bytes) -> List[int]:
+    pids = []
+    for pos in range(8, len(section) - 4, 4):
+        program = (section[pos] << 8) | section[pos + 1]
+        pid = ((section[pos + 2] & 0x1F) << 8) | section[pos + 3]
+        if program != 0:  # 0 is the network PID
+            pids.append(pid)
+    return pids
+
+
+def parse_pmt(section: bytes) -> List[dict]:
+    program_info_length = ((section[10] & 0x0F) << 8) | section[11]
+    program_descriptors = parse_descriptors(section, 12, 12 + program_info_length)
+    registration = program_descriptors.get(REGISTRATION_DESCRIPTOR, b'')[:4]
+
+    streams = []
+    pos = 12 + program_info_length
+    while pos + 5 <= len(section) - 4:
+        stream_type = section[pos]
+        pid = ((section[pos + 1] & 0x1F) << 8) | section[pos + 2]
+        info_length = ((section[pos + 3] & 0x0F) << 8) | section[pos + 4]
+        descriptors = parse_descriptors(section, pos + 5, pos + 5 + info_length)
+        pos += 5 + info_length
+
+        if registration == b'HDMV' and stream_type in HDMV_STREAM_TYPES:
+            codec_type, codec = HDMV_STREAM_TYPES[stream_type]
+        elif stream_type in STREAM_TYPES:
+            codec_type, codec = STREAM_TYPES[stream_type]
+        elif stream_type == 0x06 and (tags := [t for t in PRIVATE_DESCRIPTORS if t in descriptors]):
+            codec_type, codec = PRIVATE_DESCRIPTORS[tags[0]]
+        elif registration == b'GA94' and stream_type in ATSC_STREAM_TYPES:
+            codec_type, codec = ATSC_STREAM_TYPES[stream_type]
+        else:
+            raise TSError(f'Unsupported stream type 0x{stream_type:02X} on PID 0x{pid:X}')
+
+        stream = {'pid': pid, 'stream_type': stream_type, 'codec_type': codec_type, 'codec': codec}
+        if ISO_639_DESCRIPTOR in descriptors and len(descriptors[ISO_639_DESCRIPTOR]) >= 3:
+            stream['language'] = descriptors[ISO_639_DESCRIPTOR][:3].decode('latin-1')
+        streams.append(stream)
+
+        if registration == b'HDMV' and stream_type == 0x83:
+            # ffmpeg exposes the AC-3 core of Blu-ray TrueHD as a second stream
+            streams.append({'pid': pid, 'stream_type': stream_type, 'codec_type': 'audio',
+                            'codec': 'ac3', 'language': stream.get('language')})
+    return streams
+
+
+def ac3_channels(buf: bytes) -> Optional[int]:
+    pos = buf.find(b'\x0b\x77')
+    while pos != -1 and pos + 8 <= len(buf):
+        bsid = buf[pos + 5] >> 3
+        if bsid <= 10:
+            acmod = buf[pos + 6] >> 5
+            bits = (buf[pos + 6] << 8 | buf[pos + 7]) << 3  # Bits after acmod
+            skip = 0
+            if acmod & 1 and acmod != 1:
+                skip += 2
+            if acmod & 4:
+                skip += 2
+            if acmod == 2:
+                skip += 2
+            lfe = (bits >> (15 - skip)) & 1
+            return AC3_ACMOD_CHANNELS[acmod] + lfe
+        pos = buf.find(b'\x0b\x77', pos + 2)
+    return None
+
+
+def eac3_channels(buf: bytes) -> Optional[int]:
+    # Channels of the independent substream. None if a dependent one
+    # (strmtyp 1, extra channels of 7.1) follows it
+    pos = buf.find(b'\x0b\x77')
+    while pos != -1 and pos + 6 <= len(buf):
+        bsid = buf[pos + 5] >> 3
+        if 11 <= bsid <= 16:
+            size = ((((buf[pos + 2] & 0x7) << 8) | buf[pos + 3]) + 1) * 2
+            following = pos + size
+            if following + 3 > len(buf) or buf[following:following + 2] != b'\x0b\x77' or \
+                    buf[following + 2] >> 6 == EAC3_DEPENDENT:
+                return None
+            acmod = (buf[pos + 4] >> 1) & 0x7
+            return AC3_ACMOD_CHANNELS[acmod] + (buf[pos + 4] & 1)
+        pos = buf.find(b'\x0b\x77', pos + 2)
+    return None
+
+
+def aac_channels(buf: bytes) -> Optional[int]:
+    for pos in range(len(buf) - 7):
+        if buf[pos] == 0xFF and buf[pos + 1] & 0xF6 == 0xF0:
+            config = ((buf[pos + 2] & 0x1) << 2) | (buf[pos + 3] >> 6)
+            if config == 0:
+                return None  # Channel layout is in the bitstream (PCE)
+            return 8 if config == 7 else config
+    return None
+
+
+def mp3_channels(buf: bytes) -> Optional[int]:
+    for pos in range(len(buf) - 4):
+        if buf[pos] == 0xFF and buf[pos + 1] & 0xE0 == 0xE0:
+            return 1 if buf[pos + 3] >> 6 == 3 else 2
+    return None
+
+
+def dts_channels(buf: bytes) -> Optional[int]:
+    pos = buf.find(b'\x7f\xfe\x80\x01')
+    if pos == -1 or pos + 11 > len(buf):
+        return None
+    bits = int.from_bytes(buf[pos:pos + 11], 'big')
+    size = ((bits >> (88 - 60)) & 0x3FFF) + 1
+    amode = (bits >> (88 - 66)) & 0x3F
+    lff = (bits >> (88 - 87)) & 0x3
+    if amode >= len(DTS_AMODE_CHANNELS):
+        return None
+    # Core only: the channels of a DTS-HD extension after it are not counted
+    if pos + size + 4 > len(buf) or buf[pos + size:pos + size + 4] == DTS_HD_SYNC:
+        return None
+    return DTS_AMODE_CHANNELS[amode] + (1 if lff else 0)
+
+
+def pcm_bluray_channels(buf: bytes) -> Optional[int]:
+    if len(buf) < 4:
+        return None
+    assignment = buf[2] >> 4
+    if assignment >= len(PCM_BLURAY_CHANNELS) or PCM_BLURAY_CHANNELS[assignment] == 0:
+        return None
+    return PCM_BLURAY_CHANNELS[assignment]
+
+
+def truehd_channels(buf: bytes) -> Optional[int]:
+    pos = buf.find(b'\xf8\x72\x6f\xba')
+    if pos == -1 or pos + 8 > len(buf):
+        return None
+    info = int.from_bytes(buf[pos + 4:pos + 8], 'big')
+    six_channel = (info >> 15) & 0x1F
+    eight_channel = info & 0x1FFF
+    channel_map = eight_channel if eight_channel else six_channel
+    return sum(count for bit, count in enumerate(TRUEHD_CHANNELS) if channel_map & (1 << bit)) or None
+
+
+AUDIO_PARSERS = {
+    'ac3': ac3_channels,
+    'eac3': eac3_channels,
+    'aac': aac_channels,
+    'mp3': mp3_channels,
+    'dts': dts_channels,
+    'pcm_bluray': pcm_bluray_channels,
+    'truehd': truehd_channels,
+}
+
+
+class TSReader:
+    def __init__(self, head: bytes, packet_size: int, offset: int):
+        self.head = head
+        self.packet_size = packet_size
+        self.offset = offset
+        self.streams: List[dict] = []
+        self.pts: Dict[int, List[int]] = {}
+        self.payloads: Dict[int, bytearray] = {}
+
+    def parse_head(self):
+        psi = PSIAssembler()
+        pmt_pids = None
+        for pid, pusi, start, end in iter_packets(self.head, self.offset, self.packet_size):
+            if pid == PAT_PID and pmt_pids is None:
+                if (section := psi.feed(pid, pusi, self.head, start, end)) is not None:
+                    pmt_pids = parse_pat(section)
+                    if len(pmt_pids) != 1:
+                        raise TSError(f'{len(pmt_pids)} programs in PAT')
+            elif pmt_pids is not None and pid in pmt_pids and len(self.streams) == 0:
+                if (section := psi.feed(pid, pusi, self.head, start, end)) is not None:
+                    self.streams = parse_pmt(section)
+                    for stream in self.streams:
+                        self.pts.setdefault(stream['pid'], [])
+                        self.payloads.setdefault(stream['pid'], bytearray())
+            elif pid in self.pts:
+                payload = start
+                if pusi:
+                    pts, payload = parse_pes_header(self.head, start, end)
+                    if pts is not None:
+                        self.pts[pid].append(pts)
+                if len(self.payloads[pid]) < AUDIO_PAYLOAD_SIZE and payload < end:
+                    self.payloads[pid] += self.head[payload:end]
+
+        if len(self.streams) == 0:
+            raise TSError(f'No PMT in the first {HEAD_SIZE // (1024 * 1024)} MB of the file')
+
+    def last_pts(self, tail: bytes, pid: int) -> Optional[int]:
+        start = tail.find(bytes([SYNC_BYTE]))
+        # Align to the packet grid: several sync bytes in a row
+        while start != -1 and not all(
+                start + i * self.packet_size < len(tail) and tail[start + i * self.packet_size] == SYNC_BYTE
+                for i in range(5)):
+            start = tail.find(bytes([SYNC_BYTE]), start + 1)
+        if start == -1:
+            return None
+
+        values = []
+        for ppid, pusi, pstart, pend in iter_packets(tail, start, self.packet_size):
+            if ppid == pid and pusi:
+                pts, _ = parse_pes_header(tail, pstart, pend)
+                if pts is not None:
+                    values.append(pts)
+        if len(values) == 0:
+            return None
+        # Decode order: with B-frames the last PES is not the last frame.
+        # Compared around the last one, a wrap in the tail is not the highest
+        return max(values, key=lambda pts: (pts - values[-1] + PTS_WRAP // 2) % PTS_WRAP)
+
+
+def frame_rate_from_pts(pts: List[int]) -> Optional[str]:
+    # PTS come in decode order (B-frames), sorted they are one frame apart
+    values = sorted(set(pts))
+    deltas = Counter(b - a for a, b in zip(values, values[1:]) if b > a)
+    if len(deltas) == 0:
+        return None
+    delta, _ = deltas.most_common(1)[0]
+    rate = Fraction(PTS_CLOCK, delta).limit_denominator(1001)
+    return f'{rate.numerator}/{rate.denominator}'
+
+
+def build_probe(reader: TSReader, tail: bytes) -> Result[dict, str]:
+    video = [s for s in reader.streams if s['codec_type'] == 'video']
+    if len(video) == 0:
+        return Err('No video stream')
+    reference_pid = video[0]['pid']
+
+    first_pts = min(reader.pts[reference_pid], default=None)
+    last_pts = reader.last_pts(tail, reference_pid)
+    if first_pts is None or last_pts is None:
+        return Err('No video timestamps in the head or the tail')
+    frame_rate = frame_rate_from_pts(reader.pts[reference_pid])
+    if frame_rate is None:
+        return Err('Unable to estimate frame rate')
+
+    fraction = Fraction(frame_rate)
+    duration = ((last_pts - first_pts) % PTS_WRAP) / PTS_CLOCK + float(1 / fraction)
+
+    streams = []
+    for stream in reader.streams:
+        data = {
+            'index': len(streams),
+            'codec_name': stream['codec'],
+            'codec_type': stream['codec_type'],
+            'id': f'0x{stream["pid"]:x}',
+            'disposition': {'attached_pic': 0},
+            'duration': f'{duration:.6f}',
+        }
+        if stream.get('language'):
+            data['tags'] = {'language': stream['language']}
+
+        if stream['codec_type'] == 'video':
+            if stream['pid'] == reference_pid:
+                data['r_frame_rate'] = frame_rate
+            elif (rate := frame_rate_from_pts(reader.pts[stream['pid']])) is not None:
+                data['r_frame_rate'] = rate
+            else:
+                return Err(f'Unable to estimate frame rate of PID 0x{stream["pid"]:X}')
+            data['avg_frame_rate'] = data['r_frame_rate']
+        elif stream['codec_type'] == 'audio':
+            channels = AUDIO_PARSERS[stream['codec']](bytes(reader.payloads[stream['pid']]))
+            if channels is None:
+                return Err(f'Unable to find {stream["codec"]} header on PID 0x{stream["pid"]:X}')
+            data['channels'] = channels
+
+        streams.append(data)
+
+    format = {
+        'format_name': 'mpegts',
+        'nb_streams': len(streams),
+        'duration': f'{duration:.6f}',
+    }
+    logger.debug('MPEG-TS probe: %d streams, duration %.2f', len(streams), duration)
+    return Ok({'streams': streams, 'format': format})
+
+
+def probe_mpegts(file: str) -> Result[dict, str]:
+    try:
+        with open(file, 'rb') as f:
+            head = f.read(HEAD_SIZE)
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - TAIL_SIZE))
+            tail = f.read(TAIL_SIZE)
+
+        packet_size, offset = detect_packet_size(head)
+        reader = TSReader(head, packet_size, offset)
+        reader.parse_head()
+        return build_probe(reader, tail)
+    except (OSError, TSError, IndexError) as e:
+        return Err(f'Unable to parse MPEG-TS headers: {e}')
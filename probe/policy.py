@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+#
+# @file policy.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Adaptive -probesize/-analyzeduration for ffprobe. Files are probed with
+# small limits first and the limits are raised only when the result lacks
+# something tracks are built from (frame rate, channels, duration).
+# The level each file needed is remembered per container type, so the
+# following files of the same type start at the right level.
+#
+
+import atexit
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import List, Optional, Dict
+
+from result import Result
+
+from ffmpeg import probe_file, ProbeTimeout
+from utils import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeLevel:
+    def __init__(self, probesize: int, analyzeduration: int):
+        self.__probesize = probesize  # Bytes
+        self.__analyzeduration = analyzeduration  # Microseconds
+
+    @property
+    def probesize(self) -> int:
+        return self.__probesize
+
+    @property
+    def analyzeduration(self) -> int:
+        return self.__analyzeduration
+
+    def __str__(self):
+        return f'ProbeLevel({self.probesize} B, {self.analyzeduration / 1e6:g} s)'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+PROBE_LEVELS = [
+    ProbeLevel(512 * 1024, 500_000),
+    ProbeLevel(2 * 1024 * 1024, 2_000_000),
+    ProbeLevel(5_000_000, 5_000_000),  # ffprobe defaults
+    ProbeLevel(50 * 1024 * 1024, 30_000_000),
+    ProbeLevel(200 * 1024 * 1024, 120_000_000),  # Odd TS files with late streams
+]
+DEFAULT_LEVEL = PROBE_LEVELS[2]
+
+
+def missing_fields(data: dict) -> List[str]:
+    # Fields ffprobe leaves empty when it stops analysing too early
+    missing = []
+    has_duration = 'duration' in data.get('format', {})
+    for stream in data.get('streams', []):
+        index = stream.get('index')
+        type = stream.get('codec_type')
+        if type == 'video' and stream.get('disposition', {}).get('attached_pic', 0) != 1:
+            rate = stream.get('r_frame_rate', '0/0')
+            if rate.startswith('0/') or rate.endswith('/0'):
+                missing.append(f'frame rate of stream {index}')
+        if type == 'audio' and not stream.get('channels'):
+            missing.append(f'channels of stream {index}')
+        if type in ('video', 'audio', 'subtitle') and stream.get('codec_name') is None:
+            missing.append(f'codec of stream {index}')
+        if 'duration' in stream or 'DURATION' in stream.get('tags', {}):
+            has_duration = True
+
+    if not has_duration:
+        missing.append('duration')
+    return missing
+
+
+class ProbePolicy:
+    # Recent files per container type used to pick the starting level
+    HISTORY = 32
+    # Share of the recent files the starting level should be enough for
+    PERCENTILE = 0.9
+    # Every n-th file starts one level lower, so the statistics can go
+    # down again once files that needed more are gone
+    EXPLORE_EVERY = 8
+    SAVE_INTERVAL = 30  # Seconds
+    DEFAULT_FILE = 'probe_policy.json'
+
+    def __init__(self, path: Optional[str] = None):
+        self.__path = path
+        self.__lock = threading.Lock()
+        # Writes of the file, one at a time
+        self.__save_lock = threading.Lock()
+        self.__dirty = False
+        self.__history: Dict[str, deque] = {}
+        self.__counters: Dict[str, int] = {}
+        self.__saved = time.time()
+        self.__load()
+
+    def __load(self):
+        if self.__path is None or not os.path.exists(self.__path):
+            return
+        try:
+            with open(self.__path, 'r') as f:
+                for ext, levels in json.load(f).items():
+                    self.__history[ext] = deque(
+                        [min(max(int(level), 0), len(PROBE_LEVELS) - 1) for level in levels],
+                        maxlen=self.HISTORY)
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning('Unable to load probe statistics from %s: %s', self.__path, e)
+
+    def save(self):
+        if self.__path is None:
+            return
+        with self.__save_lock:
+            with self.__lock:
+                if not self.__dirty:
+                    return
+                data = {ext: list(levels) for ext, levels in self.__history.items()}
+                self.__saved = time.time()
+                self.__dirty = False
+            tmp = self.__path + '.tmp'
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(data, f)
+                os.replace(tmp, self.__path)
+            except OSError as e:
+                logger.warning('Unable to save probe statistics to %s: %s', self.__path, e)
+
+    @staticmethod
+    def container_type(file: str) -> str:
+        return os.path.splitext(file)[1][1:].lower()
+
+    def start_level(self, file: str) -> int:
+        ext = self.container_type(file)
+        with self.__lock:
+            levels = sorted(self.__history.get(ext, []))
+            if len(levels) == 0:
+                return 0
+            level = levels[int((len(levels) - 1) * self.PERCENTILE)]
+
+            self.__counters[ext] = self.__counters.get(ext, 0) + 1
+            if level > 0 and self.__counters[ext] % self.EXPLORE_EVERY == 0:
+                level -= 1
+        return level
+
+    def record(self, file: str, level: int):
+        ext = self.container_type(file)
+        with self.__lock:
+            self.__history.setdefault(ext, deque(maxlen=self.HISTORY)).append(level)
+            self.__dirty = True
+            # Stamped here, so only one of the probe threads saves
+            save = time.time() - self.__saved > self.SAVE_INTERVAL
+            if save:
+                self.__saved = time.time()
+        if save:
+            self.save()
+
+    def statistics(self) -> Dict[str, List[int]]:
+        # Number of recent files per level, per container type
+        with self.__lock:
+            return {ext: [list(levels).count(i) for i in range(len(PROBE_LEVELS))]
+                    for ext, levels in self.__history.items()}
+
+    def probe(self, ffprobe: str, file: str) -> Result[dict, str]:
+        level = self.start_level(file)
+        while True:
+            limits = PROBE_LEVELS[level]
+            try:
+                res = probe_file(ffprobe, file, limits.probesize, limits.analyzeduration)
+            except ProbeTimeout as e:
+                if limits.probesize <= DEFAULT_LEVEL.probesize:
+                    raise
+                # Too much to read over a slow link. Defaults are better than nothing
+                logger.warning('Probe of %s at %s: %s, retrying with defaults', file, limits, e)
+                return probe_file(ffprobe, file)
+            if res.is_err():
+                # Not something more data fixes, but don't let the limits
+                # be the reason the file fails to open
+                logger.info('Probe of %s failed at %s, retrying with defaults', file, limits)
+                return probe_file(ffprobe, file)
+
+            missing = missing_fields(res.unwrap())
+            if len(missing) == 0 or level == len(PROBE_LEVELS) - 1:
+                if len(missing) != 0:
+                    logger.warning('Missing %s in %s even at %s', ', '.join(missing), file, limits)
+                self.record(file, level)
+                return res
+
+            logger.debug('Missing %s in %s at %s, escalating', ', '.join(missing), file, limits)
+            level += 1
+
+
+@functools.lru_cache(maxsize=None)
+def get_probe_policy() -> ProbePolicy:
+    # One policy per process, shared by all probe workers
+    try:
+        path = os.path.join(get_cache_dir(), ProbePolicy.DEFAULT_FILE)
+    except OSError as e:
+        logger.warning('Probe statistics will not be saved: %s', e)
+        path = None
+    policy = ProbePolicy(path)
+    # Short sessions never reach SAVE_INTERVAL
+    atexit.register(policy.save)
+    return policy
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+#
+# @file pool.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Callable, Optional
+
+from result import Result, Ok, Err
+
+from codec import Codec
+from container import Container
+from probe.cache import ProbeCache
+from utils import is_network_path
+
+logger = logging.getLogger(__name__)
+
+
+class ProbePool:
+    # ffprobe spends most of its time waiting for the storage, not the CPU,
+    # so the pool is sized by where the files live
+    LOCAL_WORKERS = 4
+    NETWORK_WORKERS = 12
+
+    def __init__(self, ffprobe: str, codec: Optional[Codec],
+                 cache: Optional[ProbeCache] = None,
+                 workers: Optional[int] = None):
+        self.__ffprobe = ffprobe
+        self.__codec = codec  # Of new files. Not needed by complete() and restore()
+        self.__cache = cache
+        self.__workers = workers
+        self.__cancelled = threading.Event()
+
+    @staticmethod
+    def workers_for(files: List[str]) -> int:
+        # Checking a handful of files is enough: a queue usually comes
+        # from one or two directories
+        if any(is_network_path(file) for file in files[:8]):
+            return ProbePool.NETWORK_WORKERS
+        return ProbePool.LOCAL_WORKERS
+
+    @property
+    def cancelled(self) -> bool:
+        return self.__cancelled.is_set()
+
+    def cancel(self):
+        logger.info('Cancelling probe pool')
+        self.__cancelled.set()
+
+    def open_one(self, file: str) -> Result[Container, str]:
+        if self.cancelled:
+            return Err('Cancelled')
+
+        container = Container(file, self.__codec)
+        try:
+            # Full parse happens on demand, see Container.ensure_parsed()
+            if (res := container.parse_summary(self.__ffprobe, self.__cache)).is_err():
+                return Err(res.unwrap_err())
+        except Exception as e:
+            logger.exception('Error parsing file %s: %s', file, e)
+            return Err(f'Error parsing file: {e}')
+
+        return Ok(container)
+
+    def complete_one(self, container: Container) -> Result[Container, str]:
+        if self.cancelled:
+            return Err('Cancelled')
+
+        try:
+            if (res := container.ensure_parsed(self.__ffprobe, self.__cache)).is_err():
+                return Err(res.unwrap_err())
+        except Exception as e:
+            logger.exception('Error parsing file %s: %s', container.file, e)
+            return Err(f'Error parsing file: {e}')
+
+        return Ok(container)
+
+    def restore_one(self, settings: dict) -> Result[Container, str]:
+        if self.cancelled:
+            return Err('Cancelled')
+
+        try:
+            return Container.from_dict(settings, self.__ffprobe, self.__cache)
+        except Exception as e:
+            logger.exception('Error parsing file %s: %s', settings['file'], e)
+            return Err(f'Error parsing file: {e}')
+
+    def __run(self, items: list, worker: Callable, on_result: Callable):
+        # Blocks until every item is processed or the pool is cancelled.
+        # on_result is called from the calling thread in completion order
+        if len(items) == 0:
+            return
+
+        files = [item if isinstance(item, str) else item['file'] if isinstance(item, dict) else item.file
+                 for item in items]
+        workers = self.__workers or self.workers_for(files)
+        logger.info('Probing %d files with %d probe workers', len(items), workers)
+
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='probe')
+        try:
+            futures = {executor.submit(worker, item): item for item in items}
+            for future in as_completed(futures):
+                if self.cancelled:
+                    break
+                on_result(futures[future], future.result())
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def open(self, files: List[str],
+             on_result: Callable[[str, Result[Container, str]], None]):
+        # Summary parse of new files
+        self.__run(files, self.open_one, on_result)
+
+    def complete(self, containers: List[Container],
+                 on_result: Callable[[Container, Result[Container, str]], None]):
+        # Full parse of already opened files, e.g. before filtering their tracks
+        self.__run([c for c in containers if not c.complete or c.is_stale()],
+                   self.complete_one, on_result)
+
+    def restore(self, settings: List[dict],
+                on_result: Callable[[dict, Result[Container, str]], None]):
+        # Jobs of an interrupted batch, with the settings they were queued with
+        self.__run(settings, self.restore_one, on_result)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+#
+# @file quarantine.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Files ffprobe hung or crashed on. They are not probed again on later
+# scans until released (explicit retry) or changed on disk.
+#
+
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, List, Tuple
+
+from utils import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+
+class Quarantine:
+    DEFAULT_FILE = 'quarantine.sqlite'
+
+    def __init__(self, path: Optional[str] = None):
+        self.__path = path or os.path.join(get_cache_dir(), self.DEFAULT_FILE)
+        # Same as the probe cache: shared by the probe workers
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(self.__path, check_same_thread=False)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS quarantine ('
+                          'path TEXT PRIMARY KEY, '
+                          'size INTEGER NOT NULL, '
+                          'mtime_ns INTEGER NOT NULL, '
+                          'reason TEXT NOT NULL, '
+                          'added REAL NOT NULL)')
+        self.__db.commit()
+        logger.info('Probe quarantine: %s', self.__path)
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @staticmethod
+    def __key(file: str) -> Optional[Tuple[str, int, int]]:
+        try:
+            st = os.stat(file)
+        except OSError:
+            return None
+        return os.path.normcase(os.path.abspath(file)), st.st_size, st.st_mtime_ns
+
+    def reason(self, file: str) -> Optional[str]:
+        # Why the file is quarantined, None if it is not (or was changed since)
+        key = self.__key(file)
+        if key is None:
+            return None
+
+        with self.__lock:
+            row = self.__db.execute(
+                'SELECT reason FROM quarantine WHERE path = ? AND size = ? AND mtime_ns = ?', key).fetchone()
+        return row[0] if row is not None else None
+
+    def add(self, file: str, reason: str):
+        key = self.__key(file)
+        if key is None:
+            return
+
+        logger.warning('Quarantining %s: %s', file, reason)
+        with self.__lock:
+            self.__db.execute('INSERT OR REPLACE INTO quarantine VALUES (?, ?, ?, ?, ?)',
+                              (*key, reason, time.time()))
+            self.__db.commit()
+
+    def release(self, file: str):
+        logger.info('Releasing %s from quarantine', file)
+        path = os.path.normcase(os.path.abspath(file))
+        with self.__lock:
+            self.__db.execute('DELETE FROM quarantine WHERE path = ?', (path,))
+            self.__db.commit()
+
+    def entries(self) -> List[Tuple[str, str]]:
+        # (path, reason) pairs
+        with self.__lock:
+            return self.__db.execute('SELECT path, reason FROM quarantine ORDER BY added').fetchall()
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+
+@functools.lru_cache(maxsize=None)
+def get_quarantine() -> Optional[Quarantine]:
+    # Without it pathological files are just probed (and time out) again
+    try:
+        return Quarantine()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning('Probe quarantine disabled: %s', e)
+        return None
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+#
+# @file progress.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Progress of parallel jobs. Slot threads report every sample, the GUI
+# picks up only the latest sample per job at its own pace (~10 Hz),
+# so the number of cross-thread events does not grow with the number
+# of jobs or ffmpeg's reporting rate.
+#
+
+import threading
+from typing import Dict, List
+
+from ffmpeg import ProgressSample
+
+
+class ProgressAggregator:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__pending: Dict[int, ProgressSample] = {}
+
+    def update(self, index: int, sample: ProgressSample):
+        # Called from slot threads. Replaces an unpublished sample of the job
+        with self.__lock:
+            self.__pending[index] = sample
+
+    def take(self) -> Dict[int, ProgressSample]:
+        # Latest sample of every job updated since the previous call
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = {}
+        return pending
+
+
+class OverallProgress:
+    # Average percent of all jobs, updated in O(1) per job change
+    def __init__(self, count: int):
+        self.__percents: List[float] = [0.0] * count
+        self.__sum = 0.0
+
+    def set(self, index: int, percent: float):
+        self.__sum += percent - self.__percents[index]
+        self.__percents[index] = percent
+
+    @property
+    def percent(self) -> float:
+        if len(self.__percents) == 0:
+            return 0
+        # Float error of the running sum must not show up as 100.0000001%
+        return min(max(self.__sum / len(self.__percents), 0), 100)
+
+    def __str__(self):
+        return f'OverallProgress({self.percent:.2f}%)'
+
+    def __repr__(self):
+        return self.__str__()
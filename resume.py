@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+#
+# @file resume.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Resuming interrupted encodes. A Matroska output is readable up to its
+# last complete cluster, so after a crash or reboot the video of the
+# partial output is kept up to its last keyframe, only the rest of the
+# original is encoded, and the parts are joined (stream copy). Audio,
+# subtitles and chapters are muxed in from the original at the end.
+#
+# A sidecar file next to the output records what the partial output was
+# encoded from and with which settings. Without a matching one, the
+# partial output is not trusted and the file is encoded from the start.
+#
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Optional, Any, Callable
+
+from result import Result, Ok, Err
+
+from ffmpeg import FFMpegRemuxer, ProgressSample, VideoTrack, probe_video_packets
+from segments import concat_videos, mux_with_original
+
+logger = logging.getLogger(__name__)
+
+RESUME_SUFFIX = '.resume.json'
+# Partial outputs of other containers (MP4 without 'moov') are unreadable
+RESUMABLE_CONTAINERS = ['mkv', 'webm']
+# Resuming costs a full read of the partial output and two extra muxes
+MIN_RESUME_SECONDS = 60
+
+
+def resume_file(outfile: str) -> str:
+    return outfile + RESUME_SUFFIX
+
+
+def encoded_video(container) -> Optional[VideoTrack]:
+    videos = [track for track in container.tracks if isinstance(track, VideoTrack) and track.keep]
+    if len(videos) != 1 or videos[0].is_h265:
+        return None  # Copies are quick to redo
+    return videos[0]
+
+
+def resume_settings(container, video: VideoTrack) -> Optional[dict]:
+    try:
+        st = os.stat(container.file)
+    except OSError:
+        return None
+    # Only what the encoded video depends on. Other tracks and metadata
+    # are taken from the original again anyway
+    return {
+        'source': [os.path.abspath(container.file), st.st_size, st.st_mtime_ns],
+        'video': video.index,
+        'codec': container.codec.name,
+        'preset': container.preset,
+        'tune': container.tune,
+        'profile': container.profile,
+    }
+
+
+def save_resume_info(container, outfile: str):
+    # Called right before the output is written from the start
+    if container.container.ext not in RESUMABLE_CONTAINERS or (video := encoded_video(container)) is None:
+        return
+    if (settings := resume_settings(container, video)) is None:
+        return
+
+    path = resume_file(outfile)
+    try:
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(settings, f)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logger.warning('Unable to save resume info %s: %s', path, e)
+
+
+def remove_resume_info(outfile: str):
+    try:
+        os.remove(resume_file(outfile))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning('Unable to remove resume info of %s: %s', outfile, e)
+
+
+def can_resume(container, outfile: str) -> bool:
+    if container.container.ext not in RESUMABLE_CONTAINERS or (video := encoded_video(container)) is None:
+        return False
+    if not os.path.isfile(outfile):
+        return False
+
+    try:
+        with open(resume_file(outfile), 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as e:
+        logger.warning('Unable to read resume info of %s: %s', outfile, e)
+        return False
+
+    if saved != resume_settings(container, video):
+        logger.info('Partial output %s was encoded with other settings or from another file', outfile)
+        return False
+    return True
+
+
+def encode_resumed(ffmpeg: str, ffprobe: str, container, outfile: str,
+                   on_progress: Callable[[ProgressSample], None]) -> Result[Any, str]:
+    # Replaces the partial outfile only when everything succeeded,
+    # so it can be resumed again if this gets interrupted too
+    video = encoded_video(container)
+
+    # Everything before the last keyframe of the partial output is complete
+    packets = probe_video_packets(ffprobe, outfile)
+    if packets.is_err():
+        return Err(f'Unable to read partial output: {packets.unwrap_err()}')
+    packets = packets.unwrap()
+    keyframes = [i for i, (_, _, key) in enumerate(packets) if key]
+    if len(keyframes) < 2:
+        return Err('Partial output is too short')
+    cut = keyframes[-1]
+    # Real end of the kept part: with open GOPs some frames shown right
+    # before the cut keyframe are decoded after it, and are lost
+    resume_seconds = max(pts + duration for pts, duration, _ in packets[:cut])
+    if resume_seconds < MIN_RESUME_SECONDS:
+        return Err(f'Only {resume_seconds:.0f} s were encoded, not worth resuming')
+    # Between the last two keyframes, so the split is exactly at the last one
+    split_seconds = (packets[keyframes[-2]][0] + packets[cut][0]) / 2
+    del packets
+
+    logger.info('Resuming %s from %.3f s', container.file, resume_seconds)
+    workdir = tempfile.mkdtemp(prefix='.trimmer-', dir=os.path.dirname(os.path.abspath(outfile)))
+    try:
+        # Video of the partial output up to the last keyframe. The segment
+        # muxer splits exactly at keyframes, the second part is dropped
+        res = FFMpegRemuxer(ffmpeg, outfile) \
+            .map_stream('0:v:0') \
+            .copy_all() \
+            .output_options(['-f', 'segment', '-segment_times', f'{split_seconds:.6f}',
+                             '-segment_format', 'matroska']) \
+            .process(os.path.join(workdir, 'done_%04d.mkv'), lambda _: None)
+        if res.is_err():
+            return Err(f'Unable to cut partial output: {res.unwrap_err()}')
+        done = os.path.join(workdir, 'done_0000.mkv')
+
+        # The rest. Input seeking decodes from the previous keyframe of
+        # the original and drops frames up to the exact time
+        def progress(sample: ProgressSample):
+            sample.out_time_us += int(resume_seconds * 1_000_000)
+            on_progress(sample)
+
+        rest = os.path.join(workdir, 'rest.mkv')
+        res = FFMpegRemuxer(ffmpeg, container.file, ['-ss', f'{resume_seconds:.6f}']) \
+            .map_stream(f'0:{video.index}') \
+            .video_to_hevc(video, container.codec, container.preset, container.tune, container.profile) \
+            .process(rest, progress)
+        if res.is_err():
+            return Err(f'Encoding of the rest failed: {res.unwrap_err()}')
+
+        video_file = os.path.join(workdir, 'video.mkv')
+        if (res := concat_videos(ffmpeg, [done, rest], video_file)).is_err():
+            return res
+
+        joined = os.path.join(workdir, 'joined.' + container.container.ext)
+        if (res := mux_with_original(ffmpeg, container, video, video_file, joined, on_progress)).is_err():
+            return res
+
+        os.replace(joined, outfile)
+        return Ok(None)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
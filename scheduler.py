@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+#
+# @file scheduler.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Runs remux jobs in parallel on typed execution slots:
+# CPU encodes (libx265), hardware encodes (NVENC, VideoToolbox, ...)
+# and stream copies, which only need I/O. Every type has its own number
+# of slots, so e.g. a copy never waits behind a long software encode.
+#
+# With a staging area (see staging.py), files on network shares are
+# copied to scratch ahead of their jobs, and a slot is free for the next
+# job as soon as its encode is done: the output is written back meanwhile.
+# Each slot type stages at most as many files ahead as it has slots, so
+# a long queue does not fill the scratch with files that wait for hours.
+#
+# stop() drops the jobs that did not start yet, running ones are finished.
+#
+
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Iterable, Optional, Dict, Tuple
+
+from result import Result, Err
+
+from container import Container
+from ffmpeg import VideoTrack, ProgressSample
+from probe.cache import ProbeCache
+from staging import StagingArea
+
+logger = logging.getLogger(__name__)
+
+CPU_SLOT = 'cpu'
+HW_SLOT = 'hw'
+COPY_SLOT = 'copy'
+SLOT_TYPES = [CPU_SLOT, HW_SLOT, COPY_SLOT]
+
+HW_ENCODER_SUFFIXES = ['_nvenc', '_videotoolbox', '_qsv', '_vaapi', '_amf']
+# How often waits check for stop()
+STOP_CHECK_INTERVAL = 1.0
+
+
+class SlotConfig:
+    def __init__(self, cpu: int, hw: int, copy: int, chunks: int = 0):
+        self.__slots = {CPU_SLOT: cpu, HW_SLOT: hw, COPY_SLOT: copy}
+        # CPU encodes split into that many parallel segments, 0 - disabled
+        self.__chunks = chunks
+
+    @staticmethod
+    def default() -> 'SlotConfig':
+        # libx265 stops scaling at about 16 threads, so bigger machines
+        # can run several encodes side by side.
+        # Consumer GPUs have a limited number of encoder sessions
+        return SlotConfig(max(1, (os.cpu_count() or 1) // 16), 1, 2)
+
+    def count(self, slot_type: str) -> int:
+        return self.__slots[slot_type]
+
+    def set_count(self, slot_type: str, count: int):
+        self.__slots[slot_type] = max(1, count)
+
+    @property
+    def chunks(self) -> int:
+        return self.__chunks
+
+    @chunks.setter
+    def chunks(self, chunks: int):
+        self.__chunks = max(0, chunks)
+
+    def __str__(self):
+        return f'SlotConfig({", ".join(f"{t}={n}" for t, n in self.__slots.items())}, chunks={self.chunks})'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def classify(container: Container) -> str:
+    # Container must be fully parsed. Same decision remux() makes:
+    # H.265 video is copied, everything else is encoded with container.codec
+    videos = [track for track in container.tracks if isinstance(track, VideoTrack) and track.keep]
+    if all(track.is_h265 for track in videos):
+        return COPY_SLOT
+    if any(container.codec.name.endswith(suffix) for suffix in HW_ENCODER_SUFFIXES):
+        return HW_SLOT
+    return CPU_SLOT
+
+
+class Scheduler:
+    def __init__(self, ffmpeg: str, ffprobe: str, cache: Optional[ProbeCache], slots: SlotConfig,
+                 staging: Optional[StagingArea] = None):
+        self.__ffmpeg = ffmpeg
+        self.__ffprobe = ffprobe
+        self.__cache = cache
+        self.__slots = slots
+        # Closed by run(), after the last output is written back
+        self.__staging = staging
+        self.__stopping = threading.Event()
+        # Reentrant: cancelled jobs call back into run() under it
+        self.__lock = threading.RLock()
+        self.__submitted: Dict[int, Tuple[Future, Optional[Future]]] = {}  # Unfinished (job, prefetch) of run()
+
+    def stop(self):
+        # Called from any thread. run() returns when the running jobs are done
+        with self.__lock:
+            self.__stopping.set()
+            if self.__staging is not None:
+                self.__staging.cancel()
+            for job, prefetch in list(self.__submitted.values()):
+                if job.cancel() and prefetch is not None:
+                    prefetch.cancel()
+
+    def run(self, files: Iterable[Container],
+            on_status: Callable[[int, str, Optional[str]], None],
+            on_slot: Callable[[int, str], None],
+            on_progress: Callable[[int, ProgressSample], None],
+            on_error: Callable[[str], None]):
+        # Blocks until every job is done. Callbacks are called from the
+        # slot threads. Jobs start in order within each slot type.
+        # Status callback gets the backup strategy of done files, None otherwise.
+        # files may be a generator that blocks for new files (watch mode)
+        logger.info('Scheduling files on %s', self.__slots)
+
+        executors: Dict[str, ThreadPoolExecutor] = {}
+        free_slots: Dict[str, queue.Queue] = {}
+        # Files staged ahead of their jobs, see stage()
+        stagers: Dict[str, ThreadPoolExecutor] = {}
+        lookahead: Dict[str, threading.BoundedSemaphore] = {}
+        for slot_type in SLOT_TYPES:
+            count = self.__slots.count(slot_type)
+            executors[slot_type] = ThreadPoolExecutor(max_workers=count, thread_name_prefix=f'slot-{slot_type}')
+            free_slots[slot_type] = queue.Queue()
+            for n in range(count):
+                free_slots[slot_type].put(f'{slot_type.upper()} {n + 1}')
+            stagers[slot_type] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'stage-{slot_type}')
+            lookahead[slot_type] = threading.BoundedSemaphore(count)
+
+        def stage(container: Container, slot_type: str, chunks: int) -> Tuple[bool, Result]:
+            # Waits until a job of the type starts. Other types are staged
+            # meanwhile, the copies themselves are still done in job order.
+            # Returns whether it took a place of the lookahead, and the result
+            while not lookahead[slot_type].acquire(timeout=STOP_CHECK_INTERVAL):
+                if self.__stopping.is_set():
+                    return False, Err('Stopped')
+            if self.__stopping.is_set():
+                lookahead[slot_type].release()
+                return False, Err('Stopped')
+            return True, self.__staging.stage(container, chunks).result()
+
+        def staged(slot_type: str, prefetch: Future) -> Result:
+            # Result of the prefetch, its place is free for the next file of the type
+            acquired, res = prefetch.result()
+            if acquired:
+                lookahead[slot_type].release()
+            return res
+
+        def dropped(slot_type: str, prefetch: Future, job_future: Future):
+            # Gives back what a cancelled job's prefetch holds, once it is done
+            with self.__lock:
+                self.__submitted.pop(id(job_future), None)
+            if job_future.cancelled() and prefetch is not None and not prefetch.cancelled():
+                prefetch.add_done_callback(lambda _: discard(slot_type, prefetch))
+
+        def discard(slot_type: str, prefetch: Future):
+            if prefetch.cancelled():
+                return
+            if (res := staged(slot_type, prefetch)).is_ok() and res.unwrap() is not None:
+                self.__staging.discard(res.unwrap())
+
+        def finish(index: int, container: Container, res):
+            if res.is_err():
+                on_status(index, 'error', None)
+                on_error(f'Failed to process file {container.file}: {res.unwrap_err()}')
+            else:
+                on_status(index, 'done', res.unwrap())
+
+        def written(index: int, container: Container, future):
+            try:
+                res = future.result()
+            except Exception as e:
+                logger.exception('Write back of %s failed: %s', container.file, e)
+                res = Err(str(e))
+            finish(index, container, res)
+
+        def job(index: int, container: Container, slot_type: str, chunks: int, prefetch):
+            # Executor runs at most as many jobs as there are slots,
+            # so a free slot name is always available here
+            slot = free_slots[slot_type].get()
+            waited = prefetch is None
+            try:
+                on_slot(index, slot)
+                on_status(index, 'working', None)
+                logger.info('Slot %s: %s', slot, container.file)
+
+                def progress(sample: ProgressSample):
+                    on_progress(index, sample)
+
+                staged_file = None
+                if prefetch is not None:
+                    waited = True
+                    if (res := staged(slot_type, prefetch)).is_err():
+                        finish(index, container, res)
+                        return
+                    staged_file = res.unwrap()
+                if staged_file is None:
+                    finish(index, container, container.remux(self.__ffmpeg, progress, chunks, self.__ffprobe))
+                    return
+
+                if (res := self.__staging.encode(staged_file, progress, chunks)).is_err():
+                    finish(index, container, res)
+                    return
+                # The slot takes the next job while the output is written back
+                self.__staging.write_back(container, staged_file, res.unwrap()).add_done_callback(
+                    lambda future: written(index, container, future))
+            except Exception as e:
+                logger.exception('Slot %s failed on %s: %s', slot, container.file, e)
+                on_status(index, 'error', None)
+                on_error(f'Failed to process file {container.file}: {e}')
+            finally:
+                if not waited:
+                    # Failed before the staging, which may still hold a place
+                    staged(slot_type, prefetch)
+                free_slots[slot_type].put(slot)
+
+        with self.__lock:
+            self.__submitted = {}
+        try:
+            for index, container in enumerate(files):
+                # Files that were never selected only have a summary parse,
+                # and tracks are needed to pick the slot type
+                if (res := container.ensure_parsed(self.__ffprobe, self.__cache)).is_err():
+                    on_status(index, 'error', None)
+                    on_error(f'Failed to parse file {container.file}: {res.unwrap_err()}')
+                    continue
+
+                slot_type = classify(container)
+                logger.debug('File %s goes to %s slots', container.file, slot_type)
+                # Hardware encoders have few sessions, only CPU encodes are chunked
+                chunks = self.__slots.chunks if slot_type == CPU_SLOT else 0
+                with self.__lock:
+                    if self.__stopping.is_set():
+                        break
+                    prefetch = stagers[slot_type].submit(stage, container, slot_type, chunks) \
+                        if self.__staging is not None else None
+                    job_future = executors[slot_type].submit(job, index, container, slot_type, chunks, prefetch)
+                    # Finished jobs are forgotten, a watch daemon runs for months
+                    self.__submitted[id(job_future)] = (job_future, prefetch)
+                    job_future.add_done_callback(
+                        lambda future, slot_type=slot_type, prefetch=prefetch: dropped(slot_type, prefetch, future))
+        finally:
+            # Stagers are done when the last job of their type starts
+            for executor in [*executors.values(), *stagers.values()]:
+                executor.shutdown(wait=True)
+            if self.__staging is not None:
+                self.__staging.close()
+
+        logger.info('Stopped' if self.__stopping.is_set() else 'All files processed')
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+#
+# @file segments.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Chunked encoding of a single file. A lone libx265 encode does not load
+# a many-core machine, so the video is split at keyframes (stream copy),
+# the segments are encoded by parallel ffmpeg processes and joined back
+# with the concat demuxer (stream copy). Audio, subtitles and chapters
+# are copied from the original in the final mux.
+#
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Any, Optional
+
+from result import Result, Ok, Err
+
+from ffmpeg import FFMpegRemuxer, ProgressSample, VideoTrack
+
+logger = logging.getLogger(__name__)
+
+# Shorter segments cost more keyframes at the joins than they gain
+MIN_SEGMENT_SECONDS = 60
+
+
+class SegmentProgress:
+    # Sums the progress of parallel segment encodes into one sample,
+    # as if the whole video was encoded by a single process
+    def __init__(self, count: int, on_progress: Callable[[ProgressSample], None]):
+        self.__lock = threading.Lock()
+        self.__samples: List[Optional[ProgressSample]] = [None] * count
+        self.__on_progress = on_progress
+
+    def update(self, index: int, sample: ProgressSample):
+        with self.__lock:
+            self.__samples[index] = sample
+            total = ProgressSample()
+            for s in self.__samples:
+                if s is None:
+                    continue
+                total.frame += s.frame
+                total.out_time_us += max(s.out_time_us, 0)
+                total.total_size += s.total_size
+                total.dup_frames += s.dup_frames
+                total.drop_frames += s.drop_frames
+                if not s.end:
+                    # Finished segments don't encode anymore
+                    total.fps += s.fps
+                    total.speed += s.speed
+                    total.bitrate += s.bitrate
+        self.__on_progress(total)
+
+
+def concat_videos(ffmpeg: str, files: List[str], outfile: str) -> Result[Any, str]:
+    # Joins encoded parts of one video with the concat demuxer (stream copy)
+    concat_list = os.path.splitext(outfile)[0] + '.txt'
+    with open(concat_list, 'w', encoding='utf-8') as f:
+        for file in files:
+            # Quotes are escaped as '\'' in the list
+            path = os.path.abspath(file).replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+    res = FFMpegRemuxer(ffmpeg, concat_list, ['-f', 'concat', '-safe', '0']) \
+        .map_stream('0:0') \
+        .copy_all() \
+        .process(outfile, lambda _: None)
+    if res.is_err():
+        return Err(f'Concatenation failed: {res.unwrap_err()}')
+    return Ok(None)
+
+
+def mux_with_original(ffmpeg: str, container, video: VideoTrack, video_file: str, outfile: str,
+                      on_progress: Callable[[ProgressSample], None]) -> Result[Any, str]:
+    # Encoded video plus everything else from the original
+    remuxer = FFMpegRemuxer(ffmpeg, video_file).add_input(container.file)
+    remuxer.set_format_metadata(container.metadata)
+    output_index = 0
+    for track in container.tracks:
+        if not track.keep:
+            continue
+        remuxer.map_stream('0:0' if track is video else f'1:{track.index}')
+        remuxer.set_stream_metadata(output_index, 'language', track.language)
+        remuxer.set_stream_metadata(output_index, 'title', track.title)
+        output_index += 1
+    remuxer.copy_all().output_options(['-tag:v', 'hvc1', '-map_chapters', '1'])
+    # Copy is quick, only its end is reported
+    res = remuxer.process(outfile, lambda sample: on_progress(sample) if sample.end else None)
+    if res.is_err():
+        return Err(f'Final mux failed: {res.unwrap_err()}')
+    return Ok(None)
+
+
+def can_chunk(container, chunks: int) -> bool:
+    # One video track to encode, long enough to be worth splitting
+    videos = [track for track in container.tracks if isinstance(track, VideoTrack) and track.keep]
+    return chunks > 1 and len(videos) == 1 and not videos[0].is_h265 and \
+        (container.duration_seconds or 0) >= MIN_SEGMENT_SECONDS * 2
+
+
+def encode_chunked(ffmpeg: str, container, outfile: str, chunks: int,
+                   on_progress: Callable[[ProgressSample], None]) -> Result[Any, str]:
+    video = next(track for track in container.tracks if isinstance(track, VideoTrack) and track.keep)
+    segment_seconds = max(container.duration_seconds / chunks, MIN_SEGMENT_SECONDS)
+
+    # Next to the output: segments are as large as the video itself
+    workdir = tempfile.mkdtemp(prefix='.trimmer-', dir=os.path.dirname(os.path.abspath(outfile)))
+    try:
+        # Split. The segment muxer cuts at the first keyframe after each point
+        logger.info('Splitting %s into %.0f s segments', container.file, segment_seconds)
+        res = FFMpegRemuxer(ffmpeg, container.file) \
+            .map_stream(f'0:{video.index}') \
+            .copy_all() \
+            .output_options(['-f', 'segment', '-segment_time', f'{segment_seconds:.3f}',
+                             '-reset_timestamps', '1', '-segment_format', 'matroska']) \
+            .process(os.path.join(workdir, 'source_%04d.mkv'), lambda _: None)
+        if res.is_err():
+            return Err(f'Split failed: {res.unwrap_err()}')
+
+        sources = sorted(f for f in os.listdir(workdir) if f.startswith('source_'))
+        logger.info('Encoding %d segments of %s in parallel', len(sources), container.file)
+
+        # Encode
+        progress = SegmentProgress(len(sources), on_progress)
+        def encode(index: int, source: str) -> Result[Any, str]:
+            return FFMpegRemuxer(ffmpeg, os.path.join(workdir, source)) \
+                .map_stream('0:0') \
+                .video_to_hevc(video, container.codec, container.preset, container.tune, container.profile) \
+                .process(os.path.join(workdir, source.replace('source_', 'encoded_')),
+                         lambda sample: progress.update(index, sample))
+
+        with ThreadPoolExecutor(max_workers=chunks, thread_name_prefix='segment') as executor:
+            results = list(executor.map(encode, range(len(sources)), sources))
+        for source, res in zip(sources, results):
+            if res.is_err():
+                return Err(f'Encoding of segment {source} failed: {res.unwrap_err()}')
+
+        # Join
+        video_file = os.path.join(workdir, 'video.mkv')
+        res = concat_videos(ffmpeg, [os.path.join(workdir, source.replace('source_', 'encoded_')) for source in sources],
+                            video_file)
+        if res.is_err():
+            return res
+
+        return mux_with_original(ffmpeg, container, video, video_file, outfile, on_progress)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
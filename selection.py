@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+#
+# @file selection.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Choosing files and tracks to process. Shared by the GUI and the batch mode
+#
+
+import logging
+import os
+from typing import List, Type
+
+from container import Container, SUPPORTED_CONTAINERS
+from track import Track
+
+logger = logging.getLogger(__name__)
+
+
+def collect_files(dir: str, recursive: bool) -> List[str]:
+    logger.debug('Open directory: %s, recursive: %s', dir, recursive)
+    files = []
+    # Don't use os.walk since its freezes on Windows Network paths
+    for token in os.listdir(dir):
+        path = os.path.join(dir, token)
+        if os.path.isdir(path):
+            if recursive:
+                files += collect_files(path, True)
+        elif any(token.endswith(container.ext) for container in SUPPORTED_CONTAINERS):
+            files.append(path)
+
+    return files
+
+
+def filter_tracks(containers: List[Container], filters: List[str], negative_logic: bool, t: Type[Track]):
+    # Containers must be fully parsed. A filter matches the language, the title
+    # or the codec of a track. Positive filters keep matching tracks ('*' keeps all),
+    # negative ones drop them. Tracks dropped before stay dropped
+    logger.info('Filters: %s', filters)
+    for container in containers:
+        for track in container.tracks:
+            if isinstance(track, t):
+                matches = False
+                for filter in filters:
+                    if filter.lower() in track.language.lower():
+                        matches = True
+                        break
+                    if filter.lower() in track.title.lower():
+                        matches = True
+                        break
+                    if filter.lower() in track.codec.lower():
+                        matches = True
+                        break
+
+                if not negative_logic:
+                    track.keep = (matches or any('*' in filter for filter in filters)) and track.keep
+                else:
+                    track.keep = not matches and track.keep
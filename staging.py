@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+#
+# @file staging.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Staging of files on network shares through a local scratch directory.
+# ffmpeg reading and writing an SMB/NFS share directly is bound by its
+# latency, so every file goes through three stages that overlap:
+# the next inputs are copied to scratch while the current ones encode,
+# encodes read and write scratch only, and outputs are written back to
+# the share (and replace their originals) while the slot takes the next
+# job. Staged files never take more than the scratch budget.
+#
+# Local files, files larger than the budget and files that only need an
+# in-place edit are processed where they are.
+#
+# Every file is staged in a work directory of its own, named after its path
+# and identity, so an encode interrupted by a crash or reboot finds its
+# partial output there and is resumed (see resume.py).
+#
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Callable
+
+from result import Result, Ok, Err
+
+from container import Container
+from ffmpeg import ProgressSample
+from inplace import can_edit_in_place
+from placement import check_free_space, CHUNKED_SPACE_FACTOR, FREE_SPACE_MARGIN
+from probe.cache import ProbeCache
+from resume import RESUME_SUFFIX
+from utils import is_network_path, pretty_size
+
+logger = logging.getLogger(__name__)
+
+SCRATCH_PREFIX = 'trimmer-'
+JOB_PREFIX = SCRATCH_PREFIX + 'job-'
+HEARTBEAT_FILE = 'heartbeat'
+# Scratch directories of live processes are touched that often,
+# ones that were not touched for much longer were left by a crash
+HEARTBEAT_INTERVAL = 60
+STALE_SECONDS = 30 * 60
+# Work directories with a resumable partial output wait that long for a run
+RESUMABLE_SECONDS = 7 * 24 * 3600
+
+
+def job_workdir(scratch: str, file: str) -> Optional[str]:
+    # Same for the same file until it is modified
+    try:
+        st = os.stat(file)
+    except OSError:
+        return None
+    key = f'{os.path.abspath(file)}\0{st.st_size}\0{st.st_mtime_ns}'
+    return os.path.join(scratch, JOB_PREFIX + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+
+def is_resumable(path: str) -> bool:
+    try:
+        return any(name.endswith(RESUME_SUFFIX) for name in os.listdir(path))
+    except OSError:
+        return False
+
+
+class ScratchBudget:
+    def __init__(self, total: int):
+        self.__total = total
+        self.__used = 0
+        self.__cancelled = False
+        self.__condition = threading.Condition()
+
+    @property
+    def total(self) -> int:
+        return self.__total
+
+    def acquire(self, size: int) -> Result[bool, str]:
+        # Blocks until there is room. False if there never will be
+        if size > self.__total:
+            return Ok(False)
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__cancelled or self.__used + size <= self.__total)
+            if self.__cancelled:
+                return Err('Staging was cancelled')
+            self.__used += size
+        return Ok(True)
+
+    def cancel(self):
+        # Wakes up and fails the waiting acquire() calls, and the later ones
+        with self.__condition:
+            self.__cancelled = True
+            self.__condition.notify_all()
+
+    def release(self, size: int):
+        with self.__condition:
+            self.__used -= size
+            self.__condition.notify_all()
+
+
+class StagedFile:
+    # Scratch copy of a container and what it holds of the budget
+    def __init__(self, container: Container, workdir: str, reserved: int):
+        self.__container = container
+        self.__workdir = workdir
+        self.__reserved = reserved
+
+    @property
+    def container(self) -> Container:
+        return self.__container
+
+    @property
+    def workdir(self) -> str:
+        return self.__workdir
+
+    @property
+    def reserved(self) -> int:
+        return self.__reserved
+
+    def __str__(self):
+        return f'StagedFile({self.container.file}, reserved={pretty_size(self.reserved)})'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class StagingArea:
+    def __init__(self, ffmpeg: str, ffprobe: str, cache: Optional[ProbeCache],
+                 scratch: str, budget: Optional[int] = None):
+        self.__ffmpeg = ffmpeg
+        self.__ffprobe = ffprobe
+        self.__cache = cache
+
+        os.makedirs(scratch, exist_ok=True)
+        self.remove_stale(scratch)
+        self.__scratch = scratch
+        self.__root = tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=scratch)
+        # Work directories in use, touched along with the root
+        self.__workdirs = set()
+        self.__workdirs_lock = threading.Lock()
+        self.__closing = threading.Event()
+        self.__heartbeat = threading.Thread(target=self.__beat, name='scratch-heartbeat', daemon=True)
+        self.__heartbeat.start()
+
+        if budget is None:
+            budget = max(0, shutil.disk_usage(scratch).free - FREE_SPACE_MARGIN)
+        self.__budget = ScratchBudget(budget)
+        logger.info('Scratch %s, budget %s', self.__root, pretty_size(budget))
+
+        # Network transfers one at a time, in the order of the jobs
+        self.__prefetch = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self.__write_back = ThreadPoolExecutor(max_workers=1, thread_name_prefix='write-back')
+
+    @property
+    def root(self) -> str:
+        return self.__root
+
+    @staticmethod
+    def remove_stale(scratch: str):
+        for token in os.listdir(scratch):
+            path = os.path.join(scratch, token)
+            if not token.startswith(SCRATCH_PREFIX) or not os.path.isdir(path):
+                continue
+            try:
+                heartbeat = os.path.getmtime(os.path.join(path, HEARTBEAT_FILE))
+            except OSError:
+                heartbeat = os.path.getmtime(path)
+            if time.time() - heartbeat > (RESUMABLE_SECONDS if is_resumable(path) else STALE_SECONDS):
+                logger.info('Removing stale scratch directory %s', path)
+                shutil.rmtree(path, ignore_errors=True)
+
+    def __beat(self):
+        while not self.__closing.is_set():
+            with self.__workdirs_lock:
+                directories = [self.__root, *self.__workdirs]
+            for directory in directories:
+                path = os.path.join(directory, HEARTBEAT_FILE)
+                try:
+                    with open(path, 'a'):
+                        os.utime(path)
+                except OSError as e:
+                    logger.warning('Unable to touch %s: %s', path, e)
+            self.__closing.wait(HEARTBEAT_INTERVAL)
+
+    def __remove_workdir(self, workdir: str):
+        with self.__workdirs_lock:
+            self.__workdirs.discard(workdir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    def __release(self, staged: StagedFile):
+        self.__remove_workdir(staged.workdir)
+        self.__budget.release(staged.reserved)
+
+    def __stage(self, container: Container, chunks: int) -> Result[Optional[StagedFile], str]:
+        if not is_network_path(container.file) or can_edit_in_place(container):
+            return Ok(None)
+        try:
+            size = os.path.getsize(container.file)
+        except OSError as e:
+            return Err(f'Unable to get size of {container.file}: {e}')
+
+        # The copy, and the encode as remux() needs it
+        reserved = size + size * (CHUNKED_SPACE_FACTOR if chunks > 1 else 1)
+        if (acquired := self.__budget.acquire(reserved)).is_err():
+            return Err(acquired.unwrap_err())
+        if not acquired.unwrap():
+            logger.info('%s does not fit into scratch (%s needed), processing in place',
+                        container.file, pretty_size(reserved))
+            return Ok(None)
+
+        staged = None
+        workdir = job_workdir(self.__scratch, container.file)
+        try:
+            if workdir is None:
+                return Err(f'Unable to stat {container.file}')
+            with self.__workdirs_lock:
+                self.__workdirs.add(workdir)
+            os.makedirs(workdir, exist_ok=True)
+
+            file = os.path.join(workdir, os.path.basename(container.file))
+            if self.__is_copy(container.file, file):
+                # Left by an interrupted run, along with its partial output
+                logger.info('Staged copy %s is there already', file)
+            else:
+                logger.info('Prefetch %s -> %s', container.file, file)
+                start = time.time()
+                # copy2 keeps mtime, which identifies the file in from_dict()
+                # and in the resume info
+                shutil.copy2(container.file, file)
+                logger.info('Prefetched %s in %.1f s', pretty_size(size), time.time() - start)
+
+            res = Container.from_dict(container.to_dict(), self.__ffprobe, self.__cache, file)
+            if res.is_err():
+                return Err(f'Unable to open staged copy: {res.unwrap_err()}')
+            staged = StagedFile(res.unwrap(), workdir, reserved)
+            return Ok(staged)
+        except OSError as e:
+            return Err(f'Unable to prefetch {container.file}: {e}')
+        finally:
+            if staged is None:
+                if workdir is not None:
+                    self.__remove_workdir(workdir)
+                self.__budget.release(reserved)
+
+    @staticmethod
+    def __is_copy(file: str, copy: str) -> bool:
+        # copy2 sets mtime last, so an interrupted copy does not match
+        try:
+            st, copy_st = os.stat(file), os.stat(copy)
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime_ns) == (copy_st.st_size, copy_st.st_mtime_ns)
+
+    def stage(self, container: Container, chunks: int) -> 'Future[Result[Optional[StagedFile], str]]':
+        # Starts the copy to scratch. None - the file is processed in place
+        return self.__prefetch.submit(self.__stage, container, chunks)
+
+    def discard(self, staged: StagedFile):
+        # Staged file whose job will not run
+        self.__release(staged)
+
+    def encode(self, staged: StagedFile, on_progress: Callable[[ProgressSample], None],
+               chunks: int) -> Result[str, str]:
+        # Scratch to scratch. Returns the output
+        outfile = staged.container.output_file()
+        try:
+            res = staged.container.encode(self.__ffmpeg, outfile, on_progress, chunks, self.__ffprobe)
+        except Exception:
+            self.__release(staged)
+            raise
+        if res.is_err():
+            self.__release(staged)
+            return Err(res.unwrap_err())
+        return Ok(outfile)
+
+    def __write(self, container: Container, staged: StagedFile, outfile: str) -> Result[str, str]:
+        try:
+            dest = container.output_file()
+            size = os.path.getsize(outfile)
+            if (res := check_free_space(dest, size)).is_err():
+                return res
+
+            logger.info('Write back %s -> %s', outfile, dest)
+            start = time.time()
+            try:
+                shutil.copyfile(outfile, dest)
+            except OSError as e:
+                try:
+                    os.remove(dest)
+                except OSError:
+                    pass
+                return Err(f'Unable to write back {dest}: {e}')
+            logger.info('Written back %s in %.1f s', pretty_size(size), time.time() - start)
+            return container.place(dest)
+        finally:
+            self.__release(staged)
+
+    def write_back(self, container: Container, staged: StagedFile, outfile: str) -> 'Future[Result[str, str]]':
+        return self.__write_back.submit(self.__write, container, staged, outfile)
+
+    def cancel(self):
+        # Files waiting for scratch space are not staged anymore
+        self.__budget.cancel()
+
+    def close(self):
+        # Waits for the transfers in progress
+        self.__prefetch.shutdown(wait=True)
+        self.__write_back.shutdown(wait=True)
+        self.__closing.set()
+        shutil.rmtree(self.__root, ignore_errors=True)
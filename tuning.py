@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+#
+# @file tuning.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Per-machine default presets. The hard-coded preferred presets of the
+# codecs suit no machine in particular, so --benchmark encodes a short
+# synthetic clip at every preset of the codec, and the fastest preset
+# whose output is at most SIZE_TOLERANCE larger than the smallest one
+# becomes the default for new files on this machine.
+#
+
+import functools
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Optional, List, Callable
+
+from result import Result, Ok, Err
+
+from codec import Codec
+from utils import run, get_cache_dir, pretty_size
+
+logger = logging.getLogger(__name__)
+
+# Film-like source: detail, motion and grain. Generated once, losslessly,
+# so generating it does not count into the encode speed
+BENCHMARK_SOURCE = 'testsrc2=size=1920x1080:rate=24,noise=alls=8:allf=t+u'
+BENCHMARK_FRAMES = 120
+# Presets slower than that are not practical anyway
+PRESET_TIMEOUT = 10 * 60
+# Output size relative to the smallest one that is still efficient enough
+SIZE_TOLERANCE = 0.05
+
+
+class PresetResult:
+    def __init__(self, preset: str, fps: float, size: int):
+        self.__preset = preset
+        self.__fps = fps
+        self.__size = size
+
+    @property
+    def preset(self) -> str:
+        return self.__preset
+
+    @property
+    def fps(self) -> float:
+        return self.__fps
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def to_dict(self) -> dict:
+        return {'preset': self.preset, 'fps': self.fps, 'size': self.size}
+
+    def __str__(self):
+        return f'PresetResult({self.preset}, {self.fps:.2f} fps, {pretty_size(self.size)})'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def make_source(ffmpeg: str, file: str) -> Result[None, str]:
+    code, result = run([ffmpeg, '-hide_banner', '-nostdin', '-y', '-f', 'lavfi', '-i', BENCHMARK_SOURCE,
+                        '-frames:v', str(BENCHMARK_FRAMES), '-c:v', 'ffv1', file])
+    if code != 0:
+        return Err(f'Unable to generate benchmark clip: {result.strip()}')
+    return Ok(None)
+
+
+def benchmark_preset(ffmpeg: str, codec: Codec, preset: str, source: str, outfile: str) -> Result[PresetResult, str]:
+    # Same options as the real encode, see FFMpegRemuxer.video_to_hevc()
+    args = [ffmpeg, '-hide_banner', '-nostdin', '-y', '-i', source,
+            '-c:v', codec.name, '-preset', preset, '-tune', codec.preferred_tune,
+            '-profile:v', codec.preferred_profile, '-vtag', 'hvc1', outfile]
+    start = time.time()
+    try:
+        code, result = run(args, PRESET_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return Err(f'Preset {preset} took longer than {PRESET_TIMEOUT} s')
+    elapsed = time.time() - start
+    if code != 0:
+        lines = result.strip().splitlines()
+        return Err(f'Preset {preset} failed: {lines[-1] if len(lines) != 0 else code}')
+
+    try:
+        size = os.path.getsize(outfile)
+        os.remove(outfile)
+    except OSError as e:
+        return Err(f'Unable to get size of {outfile}: {e}')
+    return Ok(PresetResult(preset, BENCHMARK_FRAMES / max(elapsed, 1e-3), size))
+
+
+def choose_preset(results: List[PresetResult]) -> Optional[PresetResult]:
+    # Fastest of the presets that compress well enough
+    if len(results) == 0:
+        return None
+    smallest = min(result.size for result in results)
+    efficient = [result for result in results if result.size <= smallest * (1 + SIZE_TOLERANCE)]
+    return max(efficient, key=lambda result: result.fps)
+
+
+def benchmark(ffmpeg: str, codec: Codec,
+              on_result: Callable[[str, Result[PresetResult, str]], None]) -> Result[List[PresetResult], str]:
+    workdir = tempfile.mkdtemp(prefix='trimmer-benchmark-')
+    try:
+        source = os.path.join(workdir, 'source.mkv')
+        if (res := make_source(ffmpeg, source)).is_err():
+            return Err(res.unwrap_err())
+
+        results = []
+        for preset in codec.presets:
+            res = benchmark_preset(ffmpeg, codec, preset, source, os.path.join(workdir, f'{preset}.mkv'))
+            on_result(preset, res)
+            if res.is_ok():
+                results.append(res.unwrap())
+        if len(results) == 0:
+            return Err(f'No preset of {codec.name} works')
+        return Ok(results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class PresetProfile:
+    DEFAULT_FILE = 'presets.json'
+
+    def __init__(self, path: Optional[str] = None):
+        # Caches of several machines may be on one share (e.g. NFS home),
+        # so the file keeps a profile per host:
+        # {host: {codec: {'preset': ..., 'ffmpeg': ..., 'time': ..., 'results': [...]}}}
+        self.__path = path or os.path.join(get_cache_dir(), self.DEFAULT_FILE)
+        self.__host = platform.node()
+        self.__lock = threading.Lock()
+        self.__data = {}
+        if os.path.exists(self.__path):
+            with open(self.__path, 'r', encoding='utf-8') as f:
+                self.__data = json.load(f)
+            if not isinstance(self.__data, dict):
+                raise ValueError(f'{self.__path} is not a preset profile')
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def preset(self, codec: str) -> Optional[str]:
+        with self.__lock:
+            entry = self.__data.get(self.__host, {}).get(codec)
+            return entry.get('preset') if isinstance(entry, dict) else None
+
+    def store(self, codec: str, ffmpeg: str, results: List[PresetResult], preset: str):
+        with self.__lock:
+            self.__data.setdefault(self.__host, {})[codec] = {
+                'preset': preset,
+                'ffmpeg': ffmpeg,
+                'time': time.time(),
+                'results': [result.to_dict() for result in results],
+            }
+            tmp = self.__path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.__data, f, indent=2)
+            os.replace(tmp, self.__path)
+
+
+@functools.lru_cache(maxsize=None)
+def get_preset_profile() -> Optional[PresetProfile]:
+    # Without it the codecs' preferred presets are used
+    try:
+        return PresetProfile()
+    except (OSError, ValueError) as e:
+        logger.warning('Preset profile disabled: %s', e)
+        return None
+
+
+def default_preset(codec: Codec) -> str:
+    profile = get_preset_profile()
+    if profile is not None and (preset := profile.preset(codec.name)) in codec.presets:
+        return preset
+    return codec.preferred_preset
+
+
+def tune_presets(ffmpeg: str, codec: Codec) -> Result[str, str]:
+    # Benchmarks the codec and stores the preset it picked
+    logger.info('Benchmarking %d presets of %s, this may take a while', len(codec.presets), codec.name)
+
+    def on_result(preset: str, res: Result[PresetResult, str]):
+        if res.is_ok():
+            logger.info('%s: %.2f fps, %s', preset, res.unwrap().fps, pretty_size(res.unwrap().size))
+        else:
+            logger.warning('%s', res.unwrap_err())
+
+    res = benchmark(ffmpeg, codec, on_result)
+    if res.is_err():
+        return Err(res.unwrap_err())
+    results = res.unwrap()
+    best = choose_preset(results)
+
+    if (profile := get_preset_profile()) is None:
+        return Err('Preset profile is not available')
+    try:
+        profile.store(codec.name, ffmpeg, results, best.preset)
+    except OSError as e:
+        return Err(f'Unable to save {profile.path}: {e}')
+    logger.info('Default preset of %s on this machine: %s (was %s)', codec.name, best.preset, codec.preferred_preset)
+    return Ok(best.preset)
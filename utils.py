@@ -6,28 +6,80 @@
 # @author Maxim Kurylko <vk_vm@ukr.net>
 #
 
+import functools
 import os
 import platform
 import logging
 import re
 import shutil
+import signal
 import subprocess
 import time
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 
 from result import Result, Err, Ok
 
 logger = logging.getLogger(__name__)
 
-def run(args: List[str]) -> Tuple[int, str]:
+def kill_process_tree(process: subprocess.Popen):
+    # ffmpeg tools may spawn helpers, kill the whole group/tree
+    if platform.system() == 'Windows':
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       creationflags=subprocess.CREATE_NO_WINDOW)
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            process.kill()
+
+def is_process_alive(pid: int) -> bool:
+    # os.kill() terminates the process on Windows, so it is asked differently
+    if platform.system() == 'Windows':
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED: exists, but not ours
+        try:
+            code = ctypes.c_ulong()
+            return kernel32.GetExitCodeProcess(handle, ctypes.byref(code)) != 0 and code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def is_crash_code(code: int) -> bool:
+    # Killed by a signal on POSIX, NTSTATUS error (access violation etc.) on Windows
+    if platform.system() == 'Windows':
+        return code & 0xFFFFFFFF >= 0xC0000000
+    return code < 0
+
+def run(args: List[str], timeout: Optional[float] = None) -> Tuple[int, str]:
+    # Raises subprocess.TimeoutExpired if the process does not finish in time.
+    # With a timeout the process gets its own process group, so it can be
+    # killed together with its children
     logger.debug('Running command: [%s]', ' '.join(args))
     process = subprocess.Popen(args,
                            stdout=subprocess.PIPE,
                            stderr=subprocess.PIPE,
                            universal_newlines=True,
                            creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0,
+                           start_new_session=timeout is not None and platform.system() != 'Windows',
                            encoding='utf-8')
-    stdout, stderr = process.communicate()
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.warning('Command timed out after %s s, killing: [%s]', timeout, ' '.join(args))
+        kill_process_tree(process)
+        process.communicate()
+        raise
     output = stdout + stderr
     logger.debug('code: %d, output: [%s]', process.returncode, output)
     return process.returncode, output
@@ -46,6 +98,63 @@ def find_ffprobe() -> Result[str, str]:
 
     return Ok(ffprobe)
 
+def get_cache_dir() -> str:
+    if platform.system() == 'Windows':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~\\AppData\\Local'))
+    elif platform.system() == 'Darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+
+    path = os.path.join(base, 'trimmer')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+NETWORK_FILESYSTEMS = ['nfs', 'nfs4', 'cifs', 'smb', 'smb2', 'smb3', 'smbfs',
+                       'afpfs', 'sshfs', 'fuse.sshfs', 'fuse.rclone', '9p', 'davfs', 'webdav']
+
+# Mounts rarely change during a run, and reading them costs a process
+# spawn on macOS. Cached for that long
+MOUNTS_TTL = 60
+
+@functools.lru_cache(maxsize=1)
+def read_mounts(period: int) -> List[Tuple[str, str]]:
+    # (mount point, filesystem). period only expires the cache, see get_mounts()
+    if platform.system() == 'Linux':
+        try:
+            with open('/proc/mounts', 'r') as f:
+                return [(fields[1].replace('\\040', ' '), fields[2]) for fields in map(str.split, f)]
+        except OSError:
+            return []
+
+    # //user@host/share on /Volumes/share (smbfs, nodev, nosuid, mounted by user)
+    code, output = run(['mount'])
+    if code != 0:
+        return []
+    regex = re.compile(r'^.+ on (?P<mount>.+) \((?P<fs>[^,)]+)')
+    return [(m.group('mount'), m.group('fs')) for line in output.splitlines()
+            if (m := regex.match(line)) is not None]
+
+def get_mounts() -> List[Tuple[str, str]]:
+    return read_mounts(int(time.monotonic() // MOUNTS_TTL))
+
+def is_network_path(path: str) -> bool:
+    path = os.path.abspath(path)
+    if platform.system() == 'Windows':
+        if path.startswith('\\\\'):
+            return True
+        import ctypes
+        DRIVE_REMOTE = 4
+        drive = os.path.splitdrive(path)[0] + '\\'
+        return ctypes.windll.kernel32.GetDriveTypeW(drive) == DRIVE_REMOTE
+
+    # Longest mount point that contains the path wins
+    best, best_fs = '', ''
+    for mount, fs in get_mounts():
+        if (path == mount or path.startswith(mount.rstrip('/') + '/')) and len(mount) > len(best):
+            best, best_fs = mount, fs
+    return best_fs in NETWORK_FILESYSTEMS
+
 def unique_bak_name(file):
     i = 0
     while True:
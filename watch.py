@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+
+#
+# @file watch.py
+# @date 16-10-2026
+# @author Maxim Kurylko <vk_vm@ukr.net>
+#
+# Watch mode (--watch): a long-lived process that watches drop folders,
+# waits until new files stop growing, probes them, applies the saved
+# track selection rules of their folder and feeds them to the scheduler.
+# Outputs and backups are the ones Container.remux() makes.
+#
+# Local folders are watched with inotify on Linux. Other systems and
+# network filesystems (whose changes inotify never sees) are polled.
+#
+# Nothing is journaled: after a restart the folders are scanned again,
+# files processed already are skipped by their trimmer signature and
+# interrupted encodes are resumed from their partial outputs.
+#
+
+import argparse
+import ctypes
+import json
+import logging
+import os
+import platform
+import select
+import signal
+import struct
+import threading
+import time
+from collections import deque, Counter
+from typing import List, Dict, Optional, Tuple
+
+from result import Result, Ok, Err
+
+from cli import setup, staging_area, choose_codec, track_filters, apply_filters, apply_options, release_quarantined, \
+    TRACK_FILTERS
+from codec import Codec, KNOWN_CODECS
+from container import Container, SUPPORTED_CONTAINERS
+from placement import backups_summary
+from probe.cache import ProbeCache
+from scheduler import Scheduler, SlotConfig, SLOT_TYPES, classify
+from utils import is_network_path
+
+logger = logging.getLogger(__name__)
+
+# Main loop period
+TICK = 1.0
+# Files must keep their size and mtime that long before they are probed
+DEFAULT_SETTLE_SECONDS = 30
+DEFAULT_POLL_INTERVAL = 60
+
+# Options a rule may set, same as the batch mode ones
+FILTER_OPTIONS = [f'{kind}_{name}' for name, _ in TRACK_FILTERS for kind in ('keep', 'drop')]
+RULE_OPTIONS = FILTER_OPTIONS + ['codec', 'preset', 'tune', 'profile', 'container']
+
+
+def add_watch_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('watch mode (--watch)')
+    group.add_argument("--watch", action="store_true",
+                       help="Keep running and process new files of the input directories (implies --no-gui)")
+    group.add_argument("--rules", type=str, metavar="FILE",
+                       help="JSON file with batch mode options per watched directory")
+    group.add_argument("--settle", type=int, default=DEFAULT_SETTLE_SECONDS,
+                       help="Seconds a new file must stay unchanged before it is processed")
+    group.add_argument("--poll-interval", type=int, default=DEFAULT_POLL_INTERVAL,
+                       help="Seconds between scans of directories that cannot be watched (network shares)")
+
+
+def load_rules(path: str) -> Result[Dict[str, dict], str]:
+    # {"/srv/drop/anime": {"keep_audio": ["jpn"], "keep_subtitles": "eng", "preset": "slow"}, ...}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        return Err(f'Unable to read rules {path}: {e}')
+    if not isinstance(data, dict):
+        return Err(f'Rules {path} must map directories to options')
+
+    rules = {}
+    for folder, options in data.items():
+        if not isinstance(options, dict):
+            return Err(f'Rules of {folder} must be an object')
+        rule = {}
+        for option, value in options.items():
+            if option not in RULE_OPTIONS:
+                return Err(f'Unknown option {option} of {folder}. Known: {", ".join(RULE_OPTIONS)}')
+            if option in FILTER_OPTIONS:
+                value = [value] if isinstance(value, str) else value
+                if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+                    return Err(f'{option} of {folder} must be a string or a list of strings')
+            elif not isinstance(value, str):
+                return Err(f'{option} of {folder} must be a string')
+            rule[option] = value
+
+        if rule.get('codec') not in [None] + [codec.name for codec in KNOWN_CODECS]:
+            return Err(f'Unknown codec {rule["codec"]} of {folder}')
+        if rule.get('container') not in [None] + [container.ext for container in SUPPORTED_CONTAINERS]:
+            return Err(f'Unknown container {rule["container"]} of {folder}')
+        rules[os.path.abspath(folder)] = rule
+    return Ok(rules)
+
+
+def is_candidate(path: str) -> bool:
+    # Media files that are not outputs or temporary files of trimmer itself
+    name = os.path.basename(path)
+    if '.trimmed.' in name or os.path.splitext(name)[1][1:].lower() not in {c.ext for c in SUPPORTED_CONTAINERS}:
+        return False
+    return not any(part.startswith('.trimmer-') for part in path.split(os.sep))
+
+
+def scan(folder: str, recursive: bool) -> List[str]:
+    # Every file, is_candidate() picks the media ones. No os.walk, same as collect_files()
+    try:
+        tokens = os.listdir(folder)
+    except OSError as e:
+        logger.warning('Unable to scan %s: %s', folder, e)
+        return []
+
+    files = []
+    for token in tokens:
+        path = os.path.join(folder, token)
+        if os.path.isdir(path):
+            if recursive:
+                files += scan(path, True)
+        else:
+            files.append(path)
+    return files
+
+
+class InotifyWatcher:
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    # struct inotify_event without the name
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, folders: List[str], recursive: bool):
+        self.__folders = folders
+        self.__recursive = recursive
+        self.__libc = ctypes.CDLL(None, use_errno=True)
+        self.__fd = self.__libc.inotify_init1(self.IN_CLOEXEC)
+        if self.__fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f'inotify_init1 failed: {os.strerror(errno)}')
+        self.__watches: Dict[int, str] = {}  # wd -> directory
+        self.__scanned = False
+
+    def __add_tree(self, folder: str) -> List[str]:
+        # Watches are set before listing, so no file is missed in between.
+        # Returns the files that are there already
+        wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(folder), self.MASK)
+        if wd < 0:
+            # ENOSPC: fs.inotify.max_user_watches is too low for this tree
+            logger.warning('Unable to watch %s: %s', folder, os.strerror(ctypes.get_errno()))
+        else:
+            self.__watches[wd] = folder
+
+        files = []
+        try:
+            tokens = os.listdir(folder)
+        except OSError as e:
+            logger.warning('Unable to scan %s: %s', folder, e)
+            return files
+        for token in tokens:
+            path = os.path.join(folder, token)
+            if os.path.isdir(path):
+                if self.__recursive:
+                    files += self.__add_tree(path)
+            else:
+                files.append(path)
+        return files
+
+    def changes(self, timeout: float) -> List[str]:
+        # Files that were created, written or moved in. The first call
+        # returns every file of the folders
+        if not self.__scanned:
+            self.__scanned = True
+            return [file for folder in self.__folders for file in self.__add_tree(folder)]
+
+        if not select.select([self.__fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.__fd, 64 * 1024)
+
+        files = []
+        offset = 0
+        while offset + self.EVENT.size <= len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b'\0'))
+            offset += self.EVENT.size + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                logger.warning('Too many changes at once, scanning the watched directories again')
+                files += [file for folder in self.__folders for file in self.__add_tree(folder)]
+            elif mask & self.IN_IGNORED:
+                self.__watches.pop(wd, None)  # Directory was removed
+            elif wd in self.__watches:
+                path = os.path.join(self.__watches[wd], name)
+                if not mask & self.IN_ISDIR:
+                    files.append(path)
+                elif self.__recursive:
+                    # Files may be moved in together with their directory
+                    files += self.__add_tree(path)
+        return files
+
+    def close(self):
+        os.close(self.__fd)
+
+
+class PollingWatcher:
+    def __init__(self, folders: List[str], recursive: bool, interval: float):
+        self.__folders = folders
+        self.__recursive = recursive
+        self.__interval = interval
+        self.__last_scan = None
+        self.__identities: Dict[str, Tuple[int, int]] = {}
+
+    def changes(self, timeout: float) -> List[str]:
+        # Files that are new or changed since the previous scan. Never
+        # blocks, scans happen once per interval
+        if self.__last_scan is not None and time.time() - self.__last_scan < self.__interval:
+            return []
+        self.__last_scan = time.time()
+
+        identities = {}
+        for folder in self.__folders:
+            for file in scan(folder, self.__recursive):
+                if not is_candidate(file):
+                    continue
+                try:
+                    st = os.stat(file)
+                except OSError:
+                    continue
+                identities[file] = (st.st_size, st.st_mtime_ns)
+        files = [file for file, identity in identities.items() if self.__identities.get(file) != identity]
+        self.__identities = identities
+        return files
+
+    def close(self):
+        pass
+
+
+class PendingFiles:
+    # Files that showed up, waiting until they stop growing
+    def __init__(self, settle: float):
+        self.__settle = settle
+        self.__files: Dict[str, Tuple[Tuple[int, int], float]] = {}  # path -> (identity, unchanged since)
+
+    def __len__(self):
+        return len(self.__files)
+
+    def add(self, path: str):
+        # Seen again (still written): waits from the start
+        self.__files.pop(path, None)
+        self.__files[path] = ((-1, -1), time.time())
+
+    def ready(self) -> List[str]:
+        now = time.time()
+        ready = []
+        for path, (identity, since) in list(self.__files.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.__files[path]  # Removed or moved away
+                continue
+            if (st.st_size, st.st_mtime_ns) != identity:
+                self.__files[path] = ((st.st_size, st.st_mtime_ns), now)
+            elif now - since >= self.__settle:
+                del self.__files[path]
+                ready.append(path)
+        return ready
+
+
+class WatchDaemon:
+    def __init__(self, ffmpeg: str, ffprobe: str, cache: Optional[ProbeCache], slots: SlotConfig,
+                 args, rules: Dict[str, dict]):
+        self.__ffmpeg = ffmpeg
+        self.__ffprobe = ffprobe
+        self.__cache = cache
+        self.__slots = slots
+        self.__args = args
+        self.__rules = rules
+        self.__codecs: Dict[Optional[str], Codec] = {}
+
+        self.__stopping = threading.Event()
+        # Jobs are handed to the scheduler only when a slot of their type
+        # is free, so stopping never waits for a backlog of queued jobs,
+        # and a job waiting for a CPU slot does not hold back a copy
+        self.__free = {slot_type: threading.Semaphore(slots.count(slot_type)) for slot_type in SLOT_TYPES}
+        self.__jobs: Dict[str, deque] = {slot_type: deque() for slot_type in SLOT_TYPES}
+        self.__wakeup = threading.Event()  # A job was queued or a slot was freed
+        self.__lock = threading.Lock()
+        # Queued or running jobs by scheduler index -> (container, slot type)
+        self.__containers: Dict[int, Tuple[Container, str]] = {}
+        self.__fed = 0  # Index of the next job
+        self.__active = set()  # Queued or running files
+        # Outputs of this process -> identity, until their change events are seen
+        self.__produced: Dict[str, Tuple[int, int]] = {}
+        self.__processed = 0
+        self.__failed = 0
+        self.__backups = Counter()  # Backup strategy -> files
+
+    def folders(self) -> List[str]:
+        folders = [os.path.abspath(path) for path in self.__args.input] + list(self.__rules.keys())
+        return list(dict.fromkeys(folders))
+
+    def __options(self, file: str) -> argparse.Namespace:
+        # Command line options, overridden by the rule of the nearest folder
+        options = {option: getattr(self.__args, option) for option in RULE_OPTIONS}
+        best = None
+        for folder in self.__rules.keys():
+            if file.startswith(folder.rstrip(os.sep) + os.sep) and (best is None or len(folder) > len(best)):
+                best = folder
+        if best is not None:
+            options.update(self.__rules[best])
+        return argparse.Namespace(**options)
+
+    def __codec(self, name: Optional[str]) -> Result[Codec, str]:
+        if name not in self.__codecs:
+            codec = choose_codec(self.__ffmpeg, name)
+            if codec.is_err():
+                return codec
+            self.__codecs[name] = codec.unwrap()
+            logger.info('Codec: %s', codec.unwrap().name)
+        return Ok(self.__codecs[name])
+
+    def __open(self, file: str) -> Result[Optional[Container], str]:
+        # None - nothing to do with the file
+        options = self.__options(file)
+        codec = self.__codec(options.codec)
+        if codec.is_err():
+            return Err(f'No suitable HEVC codec: {codec.unwrap_err()}')
+
+        if self.__args.retry_quarantined:
+            release_quarantined([file])
+        container = Container(file, codec.unwrap())
+        if (res := container.parse(self.__ffprobe, self.__cache)).is_err():
+            return res
+        if container.processed_by is not None and not self.__args.force:
+            logger.debug('Skipping %s, processed by trimmer %s', file, container.processed_by)
+            return Ok(None)
+
+        apply_filters([container], track_filters(options))
+        if (res := apply_options(container, options)).is_err():
+            return res
+        return Ok(container)
+
+    def __enqueue(self, file: str):
+        with self.__lock:
+            if file in self.__active:
+                return
+            try:
+                st = os.stat(file)
+            except OSError:
+                return
+            if self.__produced.pop(file, None) == (st.st_size, st.st_mtime_ns):
+                return  # Our own output, the signature may be lost in some containers
+
+        res = self.__open(file)
+        if res.is_err():
+            logger.error('Unable to open %s: %s', file, res.unwrap_err())
+            return
+        if (container := res.unwrap()) is None:
+            return
+
+        with self.__lock:
+            self.__active.add(file)
+        # Fully parsed by __open(), the scheduler classifies it the same way
+        slot_type = classify(container)
+        logger.info('Queued %s (%s)', file, slot_type)
+        self.__jobs[slot_type].append(container)
+        self.__wakeup.set()
+
+    def __feed(self):
+        # Blocks the scheduler until there is a job with a free slot of its type
+        while not self.__stopping.is_set():
+            self.__wakeup.clear()
+            for slot_type in SLOT_TYPES:
+                if len(self.__jobs[slot_type]) == 0 or not self.__free[slot_type].acquire(blocking=False):
+                    continue
+                container = self.__jobs[slot_type].popleft()
+                with self.__lock:
+                    self.__containers[self.__fed] = (container, slot_type)
+                    self.__fed += 1
+                yield container
+                break
+            else:
+                self.__wakeup.wait(TICK)
+
+    def __on_status(self, index: int, status: str, backup: Optional[str]):
+        if status not in ('done', 'error'):
+            return
+        with self.__lock:
+            container, slot_type = self.__containers.pop(index)
+            self.__active.discard(container.file)
+            if status == 'done':
+                self.__processed += 1
+                if backup is not None:
+                    self.__backups[backup] += 1
+                destfile = f'{os.path.splitext(container.file)[0]}.{container.container.ext}'
+                try:
+                    st = os.stat(destfile)
+                    self.__produced[destfile] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    pass
+            else:
+                self.__failed += 1
+        logger.info('%s: %s', status, container.file)
+        self.__free[slot_type].release()
+        self.__wakeup.set()
+
+    def stop(self):
+        self.__stopping.set()
+
+    def run(self) -> int:
+        folders = self.folders()
+        if len(folders) == 0:
+            logger.error('Nothing to watch: give input directories or --rules')
+            return 2
+
+        watched, polled = [], []
+        for folder in folders:
+            if not os.path.isdir(folder):
+                logger.error('Not a directory: %s', folder)
+                return 2
+            if platform.system() == 'Linux' and not is_network_path(folder):
+                watched.append(folder)
+            else:
+                polled.append(folder)
+
+        watchers = []
+        if len(watched) != 0:
+            try:
+                watchers.append(InotifyWatcher(watched, self.__args.recursive))
+            except OSError as e:
+                logger.warning('inotify is not available, polling instead: %s', e)
+                polled += watched
+                watched = []
+        if len(polled) != 0:
+            watchers.append(PollingWatcher(polled, self.__args.recursive, max(1, self.__args.poll_interval)))
+        for folder in watched:
+            logger.info('Watching %s', folder)
+        for folder in polled:
+            logger.info('Polling %s every %d s', folder, max(1, self.__args.poll_interval))
+
+        staging = staging_area(self.__ffmpeg, self.__ffprobe, self.__cache, self.__args)
+        scheduler = Scheduler(self.__ffmpeg, self.__ffprobe, self.__cache, self.__slots, staging)
+        thread = threading.Thread(target=scheduler.run, name='scheduler',
+                                  args=(self.__feed(), self.__on_status, lambda index, slot: None,
+                                        lambda index, sample: None, lambda message: logger.error(message)))
+        thread.start()
+
+        pending = PendingFiles(max(0, self.__args.settle))
+        try:
+            while not self.__stopping.is_set():
+                inotify = next((w for w in watchers if isinstance(w, InotifyWatcher)), None)
+                for watcher in watchers:
+                    for file in watcher.changes(TICK if watcher is inotify else 0):
+                        if is_candidate(file):
+                            pending.add(os.path.abspath(file))
+                if inotify is None:
+                    self.__stopping.wait(TICK)
+                for file in pending.ready():
+                    self.__enqueue(file)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.__stopping.set()
+            logger.info('Stopping, waiting for the running jobs')
+            scheduler.stop()
+            thread.join()
+            for watcher in watchers:
+                watcher.close()
+
+        logger.info('Processed %d files, %d failed', self.__processed, self.__failed)
+        if len(self.__backups) != 0:
+            logger.info('Backups: %s', backups_summary(self.__backups))
+        return 1 if self.__failed != 0 else 0
+
+
+def run_watch(args) -> int:
+    rules = {}
+    if args.rules is not None:
+        if (res := load_rules(args.rules)).is_err():
+            logger.error('%s', res.unwrap_err())
+            return 2
+        rules = res.unwrap()
+
+    if (res := setup(args)).is_err():
+        logger.error('%s', res.unwrap_err())
+        return 2
+    ffmpeg, ffprobe, cache, slots = res.unwrap()
+
+    daemon = WatchDaemon(ffmpeg, ffprobe, cache, slots, args, rules)
+    # Service managers stop it with SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    return daemon.run()